@@ -50,6 +50,7 @@ Created on Dec 07 2025
 
 from cgn_flexbe_states.cgn_grasp_rgbd_service_state import CGNGraspRGBDServiceState
 from cgn_flexbe_states.move_to_pose_service_state import MoveToPoseServiceState
+from uoc_flexbe_states.filter_merge_instances_state import FilterMergeInstancesState
 from uoc_flexbe_states.select_instance_to_cgn_indices_state import SelectInstanceToSceneNameState
 from uoc_flexbe_states.unseen_obj_seg_rgbd_service_state import UnseenObjSegRGBDServiceState
 from flexbe_core import Autonomy
@@ -82,6 +83,13 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
         self.name = 'UnseenObjClusterContactGraspnetPipeine'
 
         # parameters of this behavior
+        self.add_parameter('max_fallbacks', 0)
+        self.add_parameter('export_args', False)
+        self.add_parameter('manual_wait_timeout', 60.0)
+        self.add_parameter('speculative_exports', 3)
+        self.add_parameter('point_budget', 0)
+        self.add_parameter('filter_min_area', 0)
+        self.add_parameter('merge_boundary_ratio', 0.0)
 
         # Initialize ROS node information
         initialize_flexbe_core(node)
@@ -106,6 +114,7 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
         _state_machine.userdata.result_dir = ''
         _state_machine.userdata.instance_ids_2d = []
         _state_machine.userdata.instance_id_list = []
+        _state_machine.userdata.instance_id_remap = {}
         _state_machine.userdata.target_instance_id = 0
         _state_machine.userdata.scene_name = 'scene_from_ucn'
         _state_machine.userdata.message = ''
@@ -115,6 +124,8 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
         _state_machine.userdata.grasp_object_ids = []
         _state_machine.userdata.grasp_index = 0
         _state_machine.userdata.manual_target_instance_id = -1
+        _state_machine.userdata.seg_cycle_id = 0
+        _state_machine.userdata.pick_queue = []
 
         # Additional creation code can be added inside the following tags
         # [MANUAL_CREATE]
@@ -129,7 +140,7 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
                                                                     service_timeout=5.0,
                                                                     default_im_name='from_rgbd',
                                                                     background_id=0),
-                                       transitions={'finished': 'SelectInstanceToScene',
+                                       transitions={'finished': 'FilterMergeInstances',
                                                     'failed': 'failed'},
                                        autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
                                        remapping={'im_name': 'im_name',
@@ -138,13 +149,14 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
                                                   'instance_ids_2d': 'instance_ids_2d',
                                                   'instance_id_list': 'instance_id_list',
                                                   'instance_masks': 'instance_masks',
+                                                  'seg_cycle_id': 'seg_cycle_id',
                                                   'message': 'message'})
 
             # x:762 y:41
             OperatableStateMachine.add('CgnGraspRGBD',
                                        CGNGraspRGBDServiceState(service_timeout=20.0,
                                                                 service_name='/get_grasps_rgbd'),
-                                       transitions={'done': 'MoveOMPL', 'failed': 'failed'},
+                                       transitions={'done': 'MoveOMPL', 'failed': 'SelectInstanceToScene'},
                                        autonomy={'done': Autonomy.Off, 'failed': Autonomy.Off},
                                        remapping={'scene_name': 'scene_name',
                                                   'grasp_target_poses': 'grasp_target_poses',
@@ -158,27 +170,59 @@ class UnseenObjClusterContactGraspnetPipeineSM(Behavior):
                                                               service_name='/move_to_pose'),
                                        transitions={'done': 'finished',
                                                     'next': 'MoveOMPL',
-                                                    'failed': 'failed'},
+                                                    'failed': 'SelectInstanceToScene'},
                                        autonomy={'done': Autonomy.Off,
                                                  'next': Autonomy.Off,
                                                  'failed': Autonomy.Off},
                                        remapping={'grasp_poses': 'grasp_target_poses',
                                                   'grasp_index': 'grasp_index'})
 
+            # x:230 y:140
+            OperatableStateMachine.add('FilterMergeInstances',
+                                       FilterMergeInstancesState(min_area=self.filter_min_area,
+                                                                 merge_boundary_ratio=self.merge_boundary_ratio,
+                                                                 merge_depth_tolerance=0.01,
+                                                                 background_id=0,
+                                                                 compact_ids=False),
+                                       transitions={'finished': 'SelectInstanceToScene', 'failed': 'failed'},
+                                       autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
+                                       remapping={'seg_json': 'seg_json',
+                                                  'result_dir': 'result_dir',
+                                                  'instance_ids_2d': 'instance_ids_2d',
+                                                  'instance_id_list': 'instance_id_list',
+                                                  'instance_masks': 'instance_masks',
+                                                  'instance_id_remap': 'instance_id_remap',
+                                                  'message': 'message'})
+
             # x:419 y:38
             OperatableStateMachine.add('SelectInstanceToScene',
                                        SelectInstanceToSceneNameState(default_scene_name='scene_from_ucn',
-                                                                     selection_mode='manual'),
-                                       transitions={'finished': 'CgnGraspRGBD', 'failed': 'failed'},
-                                       autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
+                                                                      selection_mode='manual',
+                                                                      mark_failed_cycles=True,
+                                                                      max_fallbacks=self.max_fallbacks,
+                                                                      export_args=self.export_args,
+                                                                      manual_wait_timeout=self.manual_wait_timeout,
+                                                                      manual_target_topic='/uoc/manual_target_instance_id',
+                                                                      speculative_exports=self.speculative_exports,
+                                                                      point_budget=self.point_budget),
+                                       transitions={'finished': 'CgnGraspRGBD',
+                                                    'next_candidate': 'CgnGraspRGBD',
+                                                    'failed': 'failed'},
+                                       autonomy={'finished': Autonomy.Off,
+                                                 'next_candidate': Autonomy.Off,
+                                                 'failed': Autonomy.Off},
                                        remapping={'seg_json': 'seg_json',
                                                   'result_dir': 'result_dir',
                                                   'instance_ids_2d': 'instance_ids_2d',
                                                   'instance_id_list': 'instance_id_list',
+                                                  'instance_id_remap': 'instance_id_remap',
                                                   'im_name': 'im_name',
                                                   'target_instance_id': 'target_instance_id',
                                                   'scene_name': 'scene_name',
+                                                  'grasp_index': 'grasp_index',
                                                   'manual_target_instance_id': 'manual_target_instance_id',
+                                                  'pick_queue': 'pick_queue',
+                                                  'seg_cycle_id': 'seg_cycle_id',
                                                   'message': 'message'})
 
         return _state_machine
@@ -50,6 +50,7 @@ Created on Feb 16 2026
 
 from gsam_flexbe_states.graspsam_service_state import GraspSAMServiceState
 from cgn_flexbe_states.move_to_pose_service_state import MoveToPoseServiceState
+from uoc_flexbe_states.filter_merge_instances_state import FilterMergeInstancesState
 from uoc_flexbe_states.select_instance_to_cgn_indices_state import SelectInstanceToSceneNameState
 from uoc_flexbe_states.unseen_obj_seg_rgbd_service_state import UnseenObjSegRGBDServiceState
 from flexbe_core import Autonomy
@@ -82,6 +83,8 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
         self.name = 'UnseenObjClusterGraspSamPipeine'
 
         # parameters of this behavior
+        self.add_parameter('filter_min_area', 0)
+        self.add_parameter('merge_boundary_ratio', 0.0)
 
         # Initialize ROS node information
         initialize_flexbe_core(node)
@@ -106,6 +109,7 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
         _state_machine.userdata.result_dir = ''
         _state_machine.userdata.instance_ids_2d = []
         _state_machine.userdata.instance_id_list = []
+        _state_machine.userdata.instance_id_remap = {}
         _state_machine.userdata.target_instance_id = 0
         _state_machine.userdata.scene_name = 'scene_from_ucn'
         _state_machine.userdata.message = ''
@@ -120,6 +124,8 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
         _state_machine.userdata.sam_encoder_type = 'vit_t'
         _state_machine.userdata.no_grasps = 10
         _state_machine.userdata.seen_set = False
+        _state_machine.userdata.seg_cycle_id = 0
+        _state_machine.userdata.pick_queue = []
 
         # Additional creation code can be added inside the following tags
         # [MANUAL_CREATE]
@@ -134,7 +140,7 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
                                                                     service_timeout=5.0,
                                                                     default_im_name='from_rgbd',
                                                                     background_id=0),
-                                       transitions={'finished': 'SelectInstanceToScene',
+                                       transitions={'finished': 'FilterMergeInstances',
                                                     'failed': 'failed'},
                                        autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
                                        remapping={'im_name': 'im_name',
@@ -143,6 +149,7 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
                                                   'instance_ids_2d': 'instance_ids_2d',
                                                   'instance_id_list': 'instance_id_list',
                                                   'instance_masks': 'instance_masks',
+                                                  'seg_cycle_id': 'seg_cycle_id',
                                                   'message': 'message'})
 
             # x:812 y:38
@@ -156,7 +163,7 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
                                                             timeout=2.0,
                                                             seen_set=False,
                                                             seen_set_default=False),
-                                       transitions={'done': 'MoveOMPL', 'failed': 'failed'},
+                                       transitions={'done': 'MoveOMPL', 'failed': 'SelectInstanceToScene'},
                                        autonomy={'done': Autonomy.Off, 'failed': Autonomy.Off},
                                        remapping={'dataset_root': 'dataset_root',
                                                   'dataset_name': 'dataset_name',
@@ -175,7 +182,7 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
                                                               service_name='/move_to_pose'),
                                        transitions={'done': 'finished',
                                                     'next': 'MoveOMPL',
-                                                    'failed': 'failed'  # 666 281 -1 -1 -1 -1
+                                                    'failed': 'SelectInstanceToScene'  # 666 281 -1 -1 -1 -1
                                                     },
                                        autonomy={'done': Autonomy.Off,
                                                  'next': Autonomy.Off,
@@ -183,18 +190,46 @@ class UnseenObjClusterGraspSamPipeineSM(Behavior):
                                        remapping={'grasp_poses': 'grasp_target_poses',
                                                   'grasp_index': 'grasp_index'})
 
+            # x:230 y:140
+            OperatableStateMachine.add('FilterMergeInstances',
+                                       FilterMergeInstancesState(min_area=self.filter_min_area,
+                                                                 merge_boundary_ratio=self.merge_boundary_ratio,
+                                                                 merge_depth_tolerance=0.01,
+                                                                 background_id=0,
+                                                                 compact_ids=False),
+                                       transitions={'finished': 'SelectInstanceToScene', 'failed': 'failed'},
+                                       autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
+                                       remapping={'seg_json': 'seg_json',
+                                                  'result_dir': 'result_dir',
+                                                  'instance_ids_2d': 'instance_ids_2d',
+                                                  'instance_id_list': 'instance_id_list',
+                                                  'instance_masks': 'instance_masks',
+                                                  'instance_id_remap': 'instance_id_remap',
+                                                  'message': 'message'})
+
             # x:419 y:38
             OperatableStateMachine.add('SelectInstanceToScene',
-                                       SelectInstanceToSceneNameState(default_scene_name='scene_from_ucn'),
-                                       transitions={'finished': 'GraspSAM', 'failed': 'failed'},
-                                       autonomy={'finished': Autonomy.Off, 'failed': Autonomy.Off},
+                                       SelectInstanceToSceneNameState(default_scene_name='scene_from_ucn',
+                                                                      mark_failed_cycles=True),
+                                       # GraspSAM's inputs do not depend on the target, so no fallback here;
+                                       # a planning/motion failure re-enters only to flag the cycle as failed
+                                       transitions={'finished': 'GraspSAM',
+                                                    'next_candidate': 'failed',
+                                                    'failed': 'failed'},
+                                       autonomy={'finished': Autonomy.Off,
+                                                 'next_candidate': Autonomy.Off,
+                                                 'failed': Autonomy.Off},
                                        remapping={'seg_json': 'seg_json',
                                                   'result_dir': 'result_dir',
                                                   'instance_ids_2d': 'instance_ids_2d',
                                                   'instance_id_list': 'instance_id_list',
+                                                  'instance_id_remap': 'instance_id_remap',
                                                   'im_name': 'im_name',
                                                   'target_instance_id': 'target_instance_id',
                                                   'scene_name': 'scene_name',
+                                                  'grasp_index': 'grasp_index',
+                                                  'pick_queue': 'pick_queue',
+                                                  'seg_cycle_id': 'seg_cycle_id',
                                                   'message': 'message'})
 
         return _state_machine
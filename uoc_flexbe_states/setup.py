@@ -29,6 +29,8 @@ setup(
         'console_scripts': [
             'example_action_state = uoc_flexbe_states.example_action_state',
             'example_state = uoc_flexbe_states.example_state',
+            'uoc_selection_report = uoc_flexbe_states.selection_report:main',
+            'uoc_policy_eval = uoc_flexbe_states.policy_eval:main',
         ],
     },
 )
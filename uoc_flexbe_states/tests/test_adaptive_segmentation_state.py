@@ -0,0 +1,106 @@
+"""Routing statistics of AdaptiveSegmentationState across behavior runs."""
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flexbe_core')
+
+from uoc_flexbe_states import adaptive_segmentation_state as adaptive  # noqa: E402
+
+
+class _RouteState(object):
+    """Stand-in for a segmentation state: finishes on the first execute()."""
+
+    def __init__(self, outcome='finished', seg_json=None):
+        self._outcome = outcome
+        self._seg_json = seg_json or {}
+
+    def on_enter(self, userdata):
+        userdata.seg_json = dict(self._seg_json)
+        userdata.result_dir = ''
+        userdata.instance_ids_2d = None
+        userdata.instance_id_list = []
+        userdata.instance_masks = []
+        userdata.message = ''
+        # Outputs of UnseenObjSegCloudServiceState
+        userdata.instance_ids = list(self._seg_json.get('instance_ids', []))
+        userdata.classes = list(self._seg_json.get('classes', []))
+        userdata.bboxes = list(self._seg_json.get('bboxes', []))
+
+    def execute(self, userdata):
+        return self._outcome
+
+    def on_exit(self, userdata):
+        pass
+
+
+def _new_state(**kwargs):
+    """A fresh instance, as FlexBE builds for every behavior run."""
+    state = adaptive.AdaptiveSegmentationState(rgbd_service_name='/test_rgbd', cloud_service_name='test_cloud',
+                                               probe_every=0, **kwargs)
+    state._states = {'rgbd': _RouteState(), 'cloud': _RouteState()}
+    return state
+
+
+def _run_cycle(state, cloud_in=None):
+    userdata = SimpleNamespace(im_name='', cloud_in=cloud_in, camera_info=None)
+    state.on_enter(userdata)
+    outcome = state.execute(userdata)
+    state.on_exit(userdata)
+    return outcome, userdata
+
+
+def test_statistics_span_state_instances():
+    adaptive._ROUTE_STATS.clear()
+
+    first = _new_state()
+    for _ in range(3):
+        assert _run_cycle(first)[0] == 'finished'
+
+    # The next behavior run builds a new instance; it continues the same statistics
+    second = _new_state()
+    outcome, userdata = _run_cycle(second)
+    assert outcome == 'finished'
+    assert userdata.route_stats['rgbd']['attempts'] == 4
+    assert adaptive._ROUTE_STATS[('/test_rgbd', 'test_cloud')]['cycles'] == 4
+
+
+def test_statistics_keep_history_when_window_changes():
+    adaptive._ROUTE_STATS.clear()
+
+    first = _new_state(window=5)
+    for _ in range(3):
+        _run_cycle(first)
+
+    second = _new_state(window=2)
+    outcome, userdata = _run_cycle(second)
+    assert outcome == 'finished'
+    assert userdata.route_stats['rgbd']['attempts'] == 2
+
+
+def test_seg_cycle_id_increases_across_state_instances():
+    adaptive._ROUTE_STATS.clear()
+
+    first_id = _run_cycle(_new_state())[1].seg_cycle_id
+    second_id = _run_cycle(_new_state())[1].seg_cycle_id
+    assert second_id > first_id
+
+
+def test_cloud_result_is_converted_to_a_label_map():
+    adaptive._ROUTE_STATS.clear()
+
+    state = _new_state(preferred='cloud', fallback_on_failure=False)
+    cloud_json = {'instance_ids': [4, 9], 'classes': [0, 0], 'bboxes': [[0, 0, 2, 2], [3, 1, 4, 3]],
+                  'result_dir': ''}
+    state._states['cloud'] = _RouteState(seg_json=cloud_json)
+    organized_cloud = SimpleNamespace(height=3, width=4)
+
+    outcome, userdata = _run_cycle(state, cloud_in=organized_cloud)
+    assert outcome == 'finished'
+    assert userdata.seg_route == 'cloud'
+    assert userdata.instance_ids_2d.tolist() == [[4, 4, 0, 0],
+                                                 [4, 4, 0, 9],
+                                                 [0, 0, 0, 9]]
+    assert userdata.instance_id_list == [4, 9]
+    assert [int(m.sum()) for m in userdata.instance_masks] == [4, 2]
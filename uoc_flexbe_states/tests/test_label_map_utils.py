@@ -0,0 +1,106 @@
+"""Label map helpers in label_map_utils."""
+
+import numpy as np
+import pytest
+
+from uoc_flexbe_states.label_map_utils import cloud_label_map, label_adjacency, rank_instances, relabel
+
+# Two 2x2 instances side by side above a background row
+SPLIT = np.array([[1, 1, 2, 2],
+                  [1, 1, 2, 2],
+                  [0, 0, 0, 0]])
+
+
+def test_label_adjacency_of_a_split_object():
+    depth = np.array([[1.0, 1.0, 1.5, 1.5],
+                      [1.0, 1.0, 1.5, 1.5],
+                      [0.0, 0.0, 0.0, 0.0]], dtype=np.float32)
+    adj = label_adjacency(SPLIT, depth=depth)
+
+    assert adj['ids'].tolist() == [1, 2]
+    assert adj['areas'].tolist() == [4, 4]
+    # 2 edges against the other half + 2 against the background row
+    assert adj['perimeters'].tolist() == [4, 4]
+    assert adj['pairs'].tolist() == [[1, 2]]
+    assert adj['boundary'].tolist() == [2]
+    assert adj['depth_gap'].tolist() == pytest.approx([0.5])
+    assert adj['depth_delta'].tolist() == pytest.approx([-0.5])
+
+
+def test_label_adjacency_without_depth_has_nan_gaps():
+    adj = label_adjacency(SPLIT)
+
+    assert np.isnan(adj['depth_gap']).all()
+    assert np.isnan(adj['depth_delta']).all()
+
+
+def test_relabel_merges_and_drops_ids():
+    assert relabel(SPLIT, {1: 5, 2: 5}).tolist() == [[5, 5, 5, 5],
+                                                     [5, 5, 5, 5],
+                                                     [0, 0, 0, 0]]
+    # Labels missing from the mapping become background
+    assert relabel(SPLIT, {2: 1}).tolist() == [[0, 0, 1, 1],
+                                               [0, 0, 1, 1],
+                                               [0, 0, 0, 0]]
+
+
+def _ranking_map():
+    lab = np.zeros((8, 8), dtype=np.int32)
+    lab[0:2, 0:2] = 3      # 4 px
+    lab[4:8, 4:8] = 1      # 16 px
+    lab[0:4, 6:8] = 2      # 8 px
+    return lab
+
+
+def test_rank_instances_exact():
+    ranked = rank_instances(_ranking_map(), [1, 2, 3])
+
+    assert ranked['ids'].tolist() == [1, 2, 3]
+    assert ranked['areas'].tolist() == [16, 8, 4]
+    assert ranked['centroids'].tolist() == [[5.5, 5.5], [1.5, 6.5], [0.5, 0.5]]
+    assert ranked['refined'].all()
+
+
+def test_rank_instances_ties_prefer_the_smaller_id():
+    lab = np.array([[7, 7, 0, 4, 4]])
+
+    assert rank_instances(lab, [7, 4])['ids'].tolist() == [4, 7]
+
+
+def test_rank_instances_coarse_refines_the_top_candidates():
+    ranked = rank_instances(_ranking_map(), [1, 2, 3], stride=2, refine_top=1)
+
+    assert ranked['ids'].tolist() == [1, 2, 3]
+    assert ranked['refined'].tolist() == [True, False, False]
+    # Exact values for the refined candidate
+    assert ranked['areas'][0] == 16
+    assert ranked['centroids'][0].tolist() == [5.5, 5.5]
+
+
+def test_cloud_label_map_from_boxes():
+    # As UnseenObjSegCloudServiceState returns it: flat per-detection lists
+    seg_json = {'instance_ids': [3, 7], 'classes': [1, 1],
+                'bboxes': [[0, 0, 4, 3], [2, 1, 3, 2]]}
+    label = cloud_label_map(seg_json, (4, 5))
+
+    assert label.shape == (4, 5)
+    assert label.dtype == np.int32
+    # The smaller box (7) is painted over the larger one (3)
+    assert label.tolist() == [[3, 3, 3, 3, 0],
+                              [3, 3, 7, 3, 0],
+                              [3, 3, 3, 3, 0],
+                              [0, 0, 0, 0, 0]]
+
+
+def test_cloud_label_map_from_organized_cloud_labels():
+    seg_json = {'instance_ids': [0, 1, 1, 2, 2, 0], 'classes': [], 'bboxes': []}
+    label = cloud_label_map(seg_json, (2, 3))
+
+    assert label.tolist() == [[0, 1, 1], [2, 2, 0]]
+
+
+def test_cloud_label_map_rejects_unusable_results():
+    with pytest.raises(ValueError):
+        cloud_label_map({'instance_ids': [1, 2], 'bboxes': [[0, 0, 1, 1]]}, (4, 4))
+    with pytest.raises(ValueError):
+        cloud_label_map({'instance_ids': [1], 'bboxes': [[0, 0, 1, 1]]}, None)
@@ -0,0 +1,71 @@
+"""Offline selection policy evaluation (policy_eval)."""
+
+import json
+import os
+
+import numpy as np
+
+from uoc_flexbe_states.policy_eval import choose_target, load_label_map
+
+
+def test_choose_target_modes():
+    ranked = [7, 3, 5]
+
+    assert choose_target('largest', ranked) == (7, '')
+    assert choose_target('largest', ranked, manual_id=3) == (7, '')
+    assert choose_target('largest_or_manual', ranked) == (7, '')
+    assert choose_target('largest_or_manual', ranked, manual_id=5) == (5, '')
+    assert choose_target('manual', ranked, manual_id=3) == (3, '')
+    assert choose_target('manual', ranked) == (None, 'no target')
+    assert choose_target('largest', []) == (None, 'no target')
+
+
+def test_choose_target_rejects_ids_outside_the_scene():
+    ranked = [7, 3, 5]
+
+    assert choose_target('manual', ranked, manual_id=99) == (None, 'manual id 99 not in scene')
+    assert choose_target('largest_or_manual', ranked, manual_id=99) == (None, 'manual id 99 not in scene')
+    # valid_ids overrides the ranking (e.g. when empty instances are not ranked)
+    assert choose_target('manual', ranked, manual_id=9, valid_ids=[7, 3, 5, 9]) == (9, '')
+
+
+def _scene(tmp_path, name, label):
+    scene = tmp_path / 'corpus' / name
+    scene.mkdir(parents=True)
+    (scene / 'segmentation.json').write_text(json.dumps({'instance_ids': label}))
+    return str(scene)
+
+
+def test_load_label_map_prefers_the_npy(tmp_path):
+    scene = _scene(tmp_path, 'segmentation_a', [[9]])
+    np.save(os.path.join(scene, 'instance_ids.npy'), np.array([[1, 2]], dtype=np.int32))
+
+    arr, source = load_label_map(scene, 'segmentation.json', 'instance_ids.npy')
+    assert source == 'npy'
+    assert arr.tolist() == [[1, 2]]
+
+
+def test_load_label_map_caches_outside_the_corpus(tmp_path):
+    scene = _scene(tmp_path, 'segmentation_b', [[0, 4], [4, 4]])
+    cache = tmp_path / 'cache'
+    cache.mkdir()
+
+    arr, source = load_label_map(scene, 'segmentation.json', 'instance_ids.npy', str(cache))
+    assert source == 'json'
+    assert arr.dtype == np.int32
+    assert arr.tolist() == [[0, 4], [4, 4]]
+    assert sorted(os.listdir(scene)) == ['segmentation.json']   # the corpus is never written to
+    assert len(os.listdir(cache)) == 1
+
+    arr, source = load_label_map(scene, 'segmentation.json', 'instance_ids.npy', str(cache))
+    assert source == 'cache'
+    assert arr.tolist() == [[0, 4], [4, 4]]
+
+
+def test_load_label_map_without_cache(tmp_path):
+    scene = _scene(tmp_path, 'segmentation_c', [[2]])
+
+    arr, source = load_label_map(scene, 'segmentation.json', 'instance_ids.npy')
+    assert source == 'json'
+    assert arr.tolist() == [[2]]
+    assert sorted(os.listdir(scene)) == ['segmentation.json']
@@ -0,0 +1,76 @@
+"""Point budget of exported grasp scenes (scene_budget)."""
+
+import numpy as np
+
+from uoc_flexbe_states.scene_budget import apply_point_budget, voxel_sample
+
+
+def _plane(h=120, w=160, z=0.8):
+    """Depth scene of a flat surface with a target square in the middle."""
+    depth = np.full((h, w), z, dtype=np.float32)
+    seg = np.zeros((h, w), dtype=np.int32)
+    seg[40:80, 60:100] = 5
+    K = np.array([[200.0, 0.0, w / 2], [0.0, 200.0, h / 2], [0.0, 0.0, 1.0]])
+    return {'depth': depth, 'K': K, 'seg': seg}
+
+
+def test_voxel_sample_keeps_small_clouds():
+    xyz = np.random.default_rng(0).random((50, 3))
+    idx, size = voxel_sample(xyz, 100)
+
+    assert idx.tolist() == list(range(50))
+    assert size == 0.0
+
+
+def test_voxel_sample_lands_at_or_under_the_budget():
+    xyz = np.random.default_rng(0).random((20000, 3))
+    xyz[:, 2] = 0.0   # a surface, as a depth camera sees it
+    idx, size = voxel_sample(xyz, 3000)
+
+    assert 2400 <= len(idx) <= 3000
+    assert len(np.unique(idx)) == len(idx)
+    assert size > 0.0
+    # Spread out: no two kept points share a voxel (the grid starts at the cloud's minimum)
+    cells = np.floor((xyz[idx, :2] - xyz[:, :2].min(axis=0)) / size).astype(np.int64)
+    assert len(np.unique(cells, axis=0)) == len(idx)
+
+
+def test_voxel_sample_degenerate_clouds():
+    line = np.zeros((1000, 3))
+    line[:, 0] = np.linspace(0.0, 1.0, 1000)
+
+    assert len(voxel_sample(line, 100)[0]) == 100
+    assert len(voxel_sample(np.zeros((50, 3)), 10)[0]) == 10
+    assert len(voxel_sample(line, 0)[0]) == 0
+
+
+def test_apply_point_budget_depth_scene():
+    scene = _plane()
+    info = apply_point_budget(scene, 2000, target_id=5, target_share=0.5)
+
+    kept = scene['depth'] > 0
+    assert info['input_points'] == 120 * 160
+    assert info['target_points'] + info['context_points'] == int(kept.sum())
+    assert int(kept.sum()) <= 2000
+    # The target keeps up to half of the budget, the context gets the rest
+    assert info['target_points'] <= 1000
+    assert int((kept & (scene['seg'] == 5)).sum()) == info['target_points']
+    assert scene['point_budget'] is info
+
+
+def test_apply_point_budget_keeps_a_small_target_whole():
+    scene = _plane()
+    info = apply_point_budget(scene, 5000, target_id=5, target_share=0.7)
+
+    # 40x40 = 1600 target pixels fit into 70% of the budget
+    assert info['target_points'] == 1600
+    assert bool((scene['depth'][40:80, 60:100] > 0).all())
+
+
+def test_apply_point_budget_xyz_scene():
+    xyz = np.random.default_rng(1).random((5000, 3))
+    scene = {'xyz': xyz, 'xyz_color': np.zeros((5000, 3))}
+    info = apply_point_budget(scene, 500)
+
+    assert len(scene['xyz']) == info['context_points'] <= 500
+    assert len(scene['xyz_color']) == len(scene['xyz'])
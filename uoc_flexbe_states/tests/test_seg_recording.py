@@ -0,0 +1,88 @@
+"""Record / replay of segmentation traffic (seg_recording)."""
+
+import numpy as np
+import pytest
+
+from uoc_flexbe_states.seg_recording import (FILE_MAGIC, RECORD_MAGIC, SegRecorder, SegReplayer,
+                                             _RECORD_HEADER, read_records)
+
+LABEL = np.array([[0, 1, 1],
+                  [2, 2, 0]], dtype=np.int32)
+
+
+def _record(path):
+    recorder = SegRecorder(str(path))
+    recorder.append('SegImage', {'im_name': 'a'}, {'success': True, 'result_dir': '/tmp/out/a'},
+                    {'instance_ids': LABEL.tolist(), 'result_dir': '/tmp/out/a'}, LABEL,
+                    {'call_sec': 0.25})
+    # Cloud mode: flat per-detection ids next to classes and boxes
+    recorder.append('SegCloud', {'frame_id': 'cam'}, {'success': True},
+                    {'instance_ids': [4, 9], 'classes': [0, 1], 'bboxes': [[0, 0, 2, 2], [1, 1, 3, 2]]})
+    recorder.close()
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'rec.uocseg'
+    _record(path)
+
+    records = list(read_records(str(path)))
+    assert [meta['kind'] for meta, _ in records] == ['SegImage', 'SegCloud']
+
+    meta, label = records[0]
+    assert meta['request'] == {'im_name': 'a'}
+    assert meta['seg_json'] == {'result_dir': '/tmp/out/a'}   # the map is stored as binary
+    assert meta['timing'] == {'call_sec': 0.25}
+    assert label.dtype == np.int32
+    assert label.tolist() == LABEL.tolist()
+
+    meta, ids = records[1]
+    assert 'instance_ids' not in meta['seg_json']
+    assert meta['seg_json']['classes'] == [0, 1]
+    assert ids.tolist() == [4, 9]
+
+
+def test_replay_loops(tmp_path):
+    path = tmp_path / 'rec.uocseg'
+    _record(path)
+
+    replayer = SegReplayer(str(path), loop=True)
+    kinds = [replayer.next()[0]['kind'] for _ in range(3)]
+    replayer.close()
+    assert kinds == ['SegImage', 'SegCloud', 'SegImage']
+
+    replayer = SegReplayer(str(path), loop=False)
+    replayer.next()
+    replayer.next()
+    assert replayer.next() is None
+    replayer.close()
+
+
+def test_truncated_tail_is_dropped_before_appending(tmp_path):
+    path = tmp_path / 'rec.uocseg'
+    _record(path)
+    complete = path.stat().st_size
+
+    # A crash in the middle of the next record
+    with open(path, 'ab') as f:
+        f.write(_RECORD_HEADER.pack(RECORD_MAGIC, 100, 8) + b'{"kind": "Seg')
+    assert len(list(read_records(str(path)))) == 2
+
+    recorder = SegRecorder(str(path))
+    recorder.append('stream', {}, {}, {'instance_ids': [[3]]})
+    recorder.close()
+
+    records = list(read_records(str(path)))
+    assert [meta['kind'] for meta, _ in records] == ['SegImage', 'SegCloud', 'stream']
+    assert records[2][1].tolist() == [[3]]
+    assert path.stat().st_size > complete
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a recording')
+
+    with pytest.raises(ValueError):
+        list(read_records(str(path)))
+    with pytest.raises(ValueError):
+        SegRecorder(str(path)).append('SegImage', {}, {}, {})
+    assert FILE_MAGIC not in path.read_bytes()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from collections import deque
+
+from flexbe_core import EventState, Logger
+
+# (rgbd service, cloud service) -> {'history': {route: deque of (latency, ok)}, 'cycles': int}
+_ROUTE_STATS = {}
+
+
+def _shared_stats(rgbd_service_name, cloud_service_name, window):
+    """Routing statistics shared by all instances and behavior runs for this pair of services."""
+    stats = _ROUTE_STATS.setdefault((rgbd_service_name, cloud_service_name),
+                                    {'history': {}, 'cycles': 0})
+    for route in AdaptiveSegmentationState._ROUTES:
+        history = stats['history'].get(route)
+        if history is None or history.maxlen != window:
+            stats['history'][route] = deque(history or (), maxlen=window)
+    return stats
+
+
+class AdaptiveSegmentationState(EventState):
+    """
+    Route each segmentation cycle to the RGB-D or the point-cloud service, whichever meets the latency target.
+
+    The state wraps an UnseenObjSegRGBDServiceState and an
+    UnseenObjSegCloudServiceState (created on first entry) and keeps, per
+    route, a rolling window of the last `window` attempts (latency from entry
+    to outcome, success).  The statistics are kept per pair of services for
+    the whole process, so they carry over from one behavior run to the next.  A route meets the target if its success rate is at
+    least `min_success_rate` and the mean latency of its successful attempts
+    is at most `latency_target`.  Each cycle goes to:
+
+      * `preferred` if it meets the target (or has no statistics yet),
+      * else the other route if it meets the target,
+      * else the route with the lower mean latency.
+
+    Every `probe_every` cycles the route that was not chosen is used instead,
+    so that its statistics stay fresh.  With `fallback_on_failure`, a failed
+    attempt is retried once on the other route in the same cycle.
+
+    The cloud route needs a PointCloud2: userdata.cloud_in if set, else the
+    latest message on `cloud_topic`; without one it is skipped.  Both routes
+    are normalized to the RGB-D state's contract, so SelectInstanceToSceneNameState
+    and the pick-planning states work unchanged: the cloud route's per-point
+    labels (organized cloud) or per-detection boxes are turned into a label
+    map on the cloud's image grid (label_map_utils.cloud_label_map; an
+    unorganized cloud needs camera_info).  A cloud result that fits neither
+    counts as a failure.
+
+    -- latency_target       float   Max acceptable mean latency per cycle (sec) (default: 3.0)
+    -- window               int     Attempts per route kept in the rolling statistics (default: 20)
+    -- min_success_rate     float   Min success rate for a route to meet the target (default: 0.8)
+    -- probe_every          int     Use the other route every N-th cycle, 0 = never (default: 10)
+    -- preferred            string  'rgbd' | 'cloud' (default: 'rgbd')
+    -- fallback_on_failure  bool    Retry a failed cycle once on the other route (default: True)
+    -- rgbd_service_name    string  RGB-D segmentation service (default: '/segmentation_rgbd')
+    -- rgbd_timeout         float   RGB-D service discovery timeout (sec) (default: 10.0)
+    -- cloud_service_name   string  Point-cloud segmentation service (default: 'run_segmentation_cloud')
+    -- cloud_timeout        float   Point-cloud service discovery timeout (sec) (default: 5.0)
+    -- cloud_topic          string  PointCloud2 topic used if userdata.cloud_in is empty, '' = none (default: '')
+    -- background_id        int     Label treated as background in cloud results (default: 0)
+
+    ># im_name              string   Optional im_name for the RGB-D route
+    ># cloud_in             object   Optional PointCloud2 for the cloud route
+    ># camera_info          object   Optional CameraInfo for the cloud route
+    <# seg_json             dict     Full segmentation JSON
+    <# result_dir           string   Output directory
+    <# instance_ids_2d      object   HxW np.ndarray of instance IDs (int32)
+    <# instance_id_list     list     Sorted unique non-background IDs
+    <# instance_masks       list     List of HxW np.uint8 masks (one per instance)
+    <# seg_cycle_id         int      New, process-wide increasing id for every segmentation result
+    <# seg_route            string   'rgbd' or 'cloud'
+    <# route_stats          dict     Per route: attempts, success rate, mean/last latency, meets_target
+    <# message              string   Summary
+
+    <= finished             Segmentation succeeded and userdata filled
+    <= failed               No route produced a segmentation
+    """
+
+    _ROUTES = ('rgbd', 'cloud')
+    _INPUTS = {
+        'rgbd': ('im_name',),
+        'cloud': ('cloud_in', 'camera_info'),
+    }
+
+    def __init__(self,
+                 latency_target: float = 3.0,
+                 window: int = 20,
+                 min_success_rate: float = 0.8,
+                 probe_every: int = 10,
+                 preferred: str = 'rgbd',
+                 fallback_on_failure: bool = True,
+                 rgbd_service_name: str = '/segmentation_rgbd',
+                 rgbd_timeout: float = 10.0,
+                 cloud_service_name: str = 'run_segmentation_cloud',
+                 cloud_timeout: float = 5.0,
+                 cloud_topic: str = '',
+                 background_id: int = 0):
+        super().__init__(
+            outcomes=['finished', 'failed'],
+            input_keys=['im_name', 'cloud_in', 'camera_info'],
+            output_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list', 'instance_masks',
+                         'seg_cycle_id', 'seg_route', 'route_stats', 'message']
+        )
+        self._latency_target = float(latency_target)
+        self._window = max(int(window), 1)
+        self._min_success_rate = float(min_success_rate)
+        self._probe_every = max(int(probe_every), 0)
+        self._preferred = str(preferred).lower().strip()
+        self._fallback = bool(fallback_on_failure)
+        self._rgbd_service_name = str(rgbd_service_name)
+        self._rgbd_timeout = float(rgbd_timeout)
+        self._cloud_service_name = str(cloud_service_name)
+        self._cloud_timeout = float(cloud_timeout)
+        self._cloud_topic = str(cloud_topic)
+        self._background_id = int(background_id)
+
+        self._states = None        # route -> segmentation state, created on first entry
+        self._sub = None
+        self._stats = _shared_stats(self._rgbd_service_name, self._cloud_service_name, self._window)
+        self._history = self._stats['history']
+        self._route = None
+        self._tried = []
+        self._ud = None
+        self._start = None
+        self._had_error = False
+        self._msg = ""
+
+    def _create_states(self):
+        from uoc_flexbe_states.unseen_obj_seg_rgbd_service_state import UnseenObjSegRGBDServiceState
+        from uoc_flexbe_states.unseen_obj_seg_cloud_service_state import UnseenObjSegCloudServiceState
+
+        self._states = {
+            'rgbd': UnseenObjSegRGBDServiceState(service_name=self._rgbd_service_name,
+                                                 service_timeout=self._rgbd_timeout,
+                                                 background_id=self._background_id),
+            'cloud': UnseenObjSegCloudServiceState(cloud_service=self._cloud_service_name,
+                                                   service_timeout=self._cloud_timeout),
+        }
+        if self._cloud_topic:
+            from sensor_msgs.msg import PointCloud2
+            from flexbe_core.proxy import ProxySubscriberCached
+
+            self._sub = ProxySubscriberCached({self._cloud_topic: PointCloud2})
+
+    # ------------------------------------------------------------------
+    # Statistics and routing
+    # ------------------------------------------------------------------
+
+    def _route_stats(self, route):
+        history = self._history[route]
+        latencies = [lat for lat, ok in history if ok]
+        attempts = len(history)
+        success_rate = sum(1 for _, ok in history if ok) / attempts if attempts else None
+        mean_latency = sum(latencies) / len(latencies) if latencies else None
+        meets = (attempts == 0 or
+                 (success_rate >= self._min_success_rate and mean_latency is not None
+                  and mean_latency <= self._latency_target))
+        return {'attempts': attempts,
+                'success_rate': success_rate,
+                'mean_latency': mean_latency,
+                'last_latency': history[-1][0] if history else None,
+                'meets_target': meets}
+
+    def _cloud_input(self, userdata):
+        cloud = getattr(userdata, 'cloud_in', None)
+        if cloud is None and self._sub is not None and self._sub.has_msg(self._cloud_topic):
+            cloud = self._sub.get_last_msg(self._cloud_topic)
+        return cloud
+
+    def _choose(self, available):
+        """Route for this cycle among the available ones, and whether it is a probe."""
+        if len(available) == 1:
+            return available[0], False
+        other = {'rgbd': 'cloud', 'cloud': 'rgbd'}
+        stats = {route: self._route_stats(route) for route in available}
+
+        if stats[self._preferred]['meets_target']:
+            best = self._preferred
+        elif stats[other[self._preferred]]['meets_target']:
+            best = other[self._preferred]
+        else:
+            # Neither meets the target: the faster one; a route without successes counts as slowest
+            best = min(available, key=lambda r: (stats[r]['mean_latency'] is None,
+                                                 stats[r]['mean_latency'] or 0.0, r != self._preferred))
+
+        if self._probe_every and self._stats['cycles'] % self._probe_every == 0:
+            return other[best], True
+        return best, False
+
+    def _start_route(self, route, userdata):
+        inputs = {key: getattr(userdata, key, None) for key in self._INPUTS[route]}
+        if route == 'cloud':
+            inputs['cloud_in'] = self._cloud_input(userdata)
+        from types import SimpleNamespace
+
+        self._route = route
+        self._tried.append(route)
+        self._ud = SimpleNamespace(**inputs)
+        self._start = time.monotonic()
+        self._states[route].on_enter(self._ud)
+
+    # ------------------------------------------------------------------
+    # FlexBE lifecycle
+    # ------------------------------------------------------------------
+
+    def on_enter(self, userdata):
+        self._had_error = False
+        self._msg = ""
+        self._tried = []
+        self._route = None
+
+        if self._preferred not in self._ROUTES:
+            self._msg = f"[AdaptiveSegmentationState] Unknown preferred route '{self._preferred}' (use 'rgbd' or 'cloud')."
+            Logger.logerr(self._msg)
+            self._had_error = True
+            return
+
+        try:
+            if self._states is None:
+                self._create_states()
+        except Exception as e:
+            self._msg = f"[AdaptiveSegmentationState] Failed to create segmentation states: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
+            return
+
+        self._stats['cycles'] += 1
+        available = ['rgbd'] + (['cloud'] if self._cloud_input(userdata) is not None else [])
+        route, probe = self._choose(available)
+        if probe:
+            Logger.loginfo(f"[AdaptiveSegmentationState] Probing the '{route}' route.")
+        self._start_route(route, userdata)
+
+    def execute(self, userdata):
+        if self._had_error:
+            userdata.message = self._msg
+            return 'failed'
+
+        outcome = self._states[self._route].execute(self._ud)
+        if outcome is None:
+            return None
+
+        ok = outcome == 'finished' and self._normalize(self._route)
+        latency = time.monotonic() - self._start
+        self._history[self._route].append((latency, ok))
+        userdata.route_stats = {route: self._route_stats(route) for route in self._ROUTES}
+
+        if ok:
+            return self._finish(userdata, latency)
+
+        self._states[self._route].on_exit(self._ud)
+        Logger.logwarn(f"[AdaptiveSegmentationState] '{self._route}' route failed after {latency:.2f}s: "
+                       f"{getattr(self._ud, 'message', '')}")
+        other = 'cloud' if self._route == 'rgbd' else 'rgbd'
+        if self._fallback and other not in self._tried and \
+                (other == 'rgbd' or self._cloud_input(userdata) is not None):
+            self._start_route(other, userdata)
+            return None
+
+        self._msg = f"[AdaptiveSegmentationState] No route produced a segmentation (tried {', '.join(self._tried)})."
+        Logger.logerr(self._msg)
+        self._route = None
+        userdata.message = self._msg
+        return 'failed'
+
+    def _image_shape(self):
+        """(height, width) of the cloud route's image grid, or None."""
+        cloud = getattr(self._ud, 'cloud_in', None)
+        if cloud is not None and int(getattr(cloud, 'height', 1)) > 1:
+            return int(cloud.height), int(cloud.width)
+        info = getattr(self._ud, 'camera_info', None)
+        if info is not None and int(getattr(info, 'height', 0)) > 0:
+            return int(info.height), int(info.width)
+        return None
+
+    def _normalize(self, route):
+        """Bring a cloud result into the RGB-D contract; False if it cannot be turned into a label map."""
+        if route == 'rgbd':
+            return True
+        import numpy as np
+        from uoc_flexbe_states.label_map_utils import cloud_label_map
+
+        ud = self._ud
+        seg_json = dict(getattr(ud, 'seg_json', None) or {})
+        seg_json.setdefault('instance_ids', getattr(ud, 'instance_ids', []))
+        seg_json.setdefault('bboxes', getattr(ud, 'bboxes', []))
+        try:
+            arr = cloud_label_map(seg_json, self._image_shape(), self._background_id)
+        except (TypeError, ValueError) as e:
+            ud.message = f"Cloud segmentation not usable: {e}"
+            return False
+        ids = [int(i) for i in np.unique(arr) if i != self._background_id]
+        ud.instance_ids_2d = arr
+        ud.instance_id_list = ids
+        ud.instance_masks = [(arr == i).astype(np.uint8) for i in ids]
+        ud.message = getattr(ud, 'message', '') or "Cloud segmentation succeeded."
+        return True
+
+    def _finish(self, userdata, latency):
+        from uoc_flexbe_states.label_map_utils import next_seg_cycle_id
+
+        ud = self._ud
+        userdata.seg_json = ud.seg_json
+        userdata.result_dir = ud.result_dir
+        userdata.instance_ids_2d = ud.instance_ids_2d
+        userdata.instance_id_list = ud.instance_id_list
+        userdata.instance_masks = ud.instance_masks
+        userdata.seg_cycle_id = next_seg_cycle_id()
+        userdata.seg_route = self._route
+
+        stats = self._route_stats(self._route)
+        self._msg = (f"[AdaptiveSegmentationState] '{self._route}' route in {latency:.2f}s "
+                     f"(mean {stats['mean_latency']:.2f}s, target {self._latency_target:.2f}s, "
+                     f"success {stats['success_rate']:.0%}).")
+        Logger.loginfo(self._msg)
+        userdata.message = getattr(ud, 'message', '') or self._msg
+        return 'finished'
+
+    def on_exit(self, userdata):
+        # Let the active segmentation state clean up (e.g. a pending offloaded decode)
+        if self._route is not None:
+            self._states[self._route].on_exit(self._ud)
+            self._route = None
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+from flexbe_core import EventState, Logger
+
+
+def depth_from_image(msg, depth_scale=0.001):
+    """HxW float32 depth from a sensor_msgs/Image (16UC1 / mono16 scaled by depth_scale, 32FC1 as is)."""
+    import numpy as np
+
+    encoding = str(getattr(msg, 'encoding', '')).upper()
+    if encoding in ('16UC1', 'MONO16'):
+        dtype, scale = np.uint16, float(depth_scale)
+    elif encoding == '32FC1':
+        dtype, scale = np.float32, 1.0
+    else:
+        raise ValueError(f"unsupported depth encoding '{msg.encoding}'")
+    dtype = np.dtype(dtype).newbyteorder('>' if getattr(msg, 'is_bigendian', False) else '<')
+    rows = np.frombuffer(bytes(msg.data), dtype=dtype).reshape(msg.height, -1)
+    return rows[:, :msg.width].astype(np.float32) * scale
+
+
+def changed_instances(label_map, planned_depth, live_depth, ids, tolerance, max_fraction):
+    """
+    Ids among `ids` whose depth moved since the planned frame.
+
+    An instance moved if more than `max_fraction` of its pixels with valid
+    depth in both frames differ by more than `tolerance`.  A live frame of
+    another resolution is sampled nearest-neighbour onto the label map.
+    """
+    import numpy as np
+
+    label_map = np.asarray(label_map)
+    live = np.asarray(live_depth, dtype=np.float32)
+    if live.shape != label_map.shape:
+        rows = np.linspace(0, live.shape[0] - 1, label_map.shape[0]).round().astype(np.intp)
+        cols = np.linspace(0, live.shape[1] - 1, label_map.shape[1]).round().astype(np.intp)
+        live = live[np.ix_(rows, cols)]
+    planned = np.asarray(planned_depth, dtype=np.float32)
+    valid = np.isfinite(planned) & np.isfinite(live) & (planned > 0) & (live > 0)
+    moved = valid & (np.abs(live - planned) > tolerance)
+
+    out = []
+    for inst_id in ids:
+        inside = valid & (label_map == inst_id)
+        n = int(inside.sum())
+        if n and np.count_nonzero(moved & inside) > max_fraction * n:
+            out.append(int(inst_id))
+    return out
+
+
+class CheckSceneChangeState(EventState):
+    """
+    Detect whether a pick disturbed the objects still waiting in the pick queue.
+
+    After a pick (or a failed attempt), the state takes the next depth frame
+    on `depth_topic` and compares it, inside the masks of the queued
+    instances other than the head (the one just picked or attempted), with the
+    depth frame the queue was planned on.  If any of them moved, the queue is
+    cleared and the behavior re-segments.  If there is nothing to compare
+    (no topic, no planned depth frame, no live frame within `timeout`), the
+    scene is assumed unchanged.
+
+    -- depth_topic           string  sensor_msgs/Image depth topic, '' = never report a change
+    -- depth_scale           float   Factor from 16-bit depth to the planned frame's units (default: 0.001)
+    -- change_tolerance      float   Depth difference counted as motion, in depth-map units (default: 0.01)
+    -- max_changed_fraction  float   Fraction of an instance's pixels that may move (default: 0.2)
+    -- timeout               float   Max wait for a fresh depth frame (sec) (default: 1.0)
+    -- depth_file            string  Depth frame name inside result_dir (default: 'depth.npy')
+
+    ># seg_json              dict     Segmentation JSON (for an optional 'depth_path')
+    ># result_dir            string   Segmentation output directory
+    ># instance_ids_2d       object   HxW instance-id map the queue was planned on
+    ># pick_queue            list     Instance ids in pick order, head = last picked / attempted
+    <# pick_queue            list     Unchanged, or empty if the scene changed
+    <# message               string   Summary
+
+    <= unchanged             The remaining instances are where they were
+    <= changed               Some remaining instance moved; queue cleared
+    """
+
+    def __init__(self,
+                 depth_topic: str = '',
+                 depth_scale: float = 0.001,
+                 change_tolerance: float = 0.01,
+                 max_changed_fraction: float = 0.2,
+                 timeout: float = 1.0,
+                 depth_file: str = 'depth.npy'):
+        super().__init__(
+            outcomes=['unchanged', 'changed'],
+            input_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'pick_queue'],
+            output_keys=['pick_queue', 'message']
+        )
+        self._depth_topic = str(depth_topic)
+        self._depth_scale = float(depth_scale)
+        self._tolerance = float(change_tolerance)
+        self._max_fraction = float(max_changed_fraction)
+        self._timeout = float(timeout)
+        self._depth_file = str(depth_file)
+
+        self._sub = None   # created on first entry
+        self._enter_time = None
+
+    def on_enter(self, userdata):
+        self._enter_time = time.monotonic()
+        if not self._depth_topic:
+            return
+        try:
+            if self._sub is None:
+                from sensor_msgs.msg import Image
+                from flexbe_core.proxy import ProxySubscriberCached
+
+                self._sub = ProxySubscriberCached({self._depth_topic: Image})
+            # Only a frame taken after the pick counts
+            self._sub.remove_last_msg(self._depth_topic)
+        except Exception as e:
+            Logger.logwarn(f"[CheckSceneChangeState] Failed to subscribe to '{self._depth_topic}': {e}")
+            self._sub = None
+
+    def _unchanged(self, userdata, why):
+        userdata.message = f"[CheckSceneChangeState] Assuming the scene is unchanged: {why}."
+        Logger.logwarn(userdata.message)
+        return 'unchanged'
+
+    def execute(self, userdata):
+        if self._sub is None:
+            return self._unchanged(userdata, 'no depth topic')
+        if not self._sub.has_msg(self._depth_topic):
+            if time.monotonic() - self._enter_time > self._timeout:
+                return self._unchanged(userdata, f"no frame on '{self._depth_topic}' within {self._timeout:.1f}s")
+            return None
+
+        from uoc_flexbe_states.label_map_utils import load_depth_map
+
+        queue = list(getattr(userdata, 'pick_queue', None) or [])
+        try:
+            label_map = userdata.instance_ids_2d
+            planned = load_depth_map(getattr(userdata, 'seg_json', None), getattr(userdata, 'result_dir', ''),
+                                     self._depth_file, shape=getattr(label_map, 'shape', None))
+            if planned is None:
+                return self._unchanged(userdata, 'no depth frame for the planned segmentation')
+            live = depth_from_image(self._sub.get_last_msg(self._depth_topic), self._depth_scale)
+            moved = changed_instances(label_map, planned, live, queue[1:], self._tolerance, self._max_fraction)
+        except Exception as e:
+            return self._unchanged(userdata, f"comparison failed ({e})")
+
+        if not moved:
+            userdata.message = f"[CheckSceneChangeState] {len(queue[1:])} queued instances unchanged."
+            Logger.loginfo(userdata.message)
+            return 'unchanged'
+
+        userdata.pick_queue = []
+        userdata.message = f"[CheckSceneChangeState] Instances {moved} moved, re-segmenting."
+        Logger.logwarn(userdata.message)
+        return 'changed'
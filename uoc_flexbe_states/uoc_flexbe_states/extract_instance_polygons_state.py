@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+from flexbe_core import EventState, Logger
+
+
+class ExtractInstancePolygonsState(EventState):
+    """
+    Reduce every instance mask to a simplified outline.
+
+    Each instance becomes the outer contour of its largest part, simplified
+    with Douglas-Peucker to `tolerance` pixels, computed per instance on a
+    thread pool shared by the process (needs OpenCV).  `instance_polygons`
+    holds the flat vertex array and the per-instance offsets (see
+    label_map_utils.split_polygons); with `in_json` the same data is added
+    to seg_json['instance_polygons'] as plain lists, so remote consumers do
+    not need the raster.  Place it after FilterMergeInstancesState, so the
+    outlines match the cleaned map.
+
+    -- tolerance        float     Max outline simplification error in pixels (default: 1.5)
+    -- workers          int       Threads used for outline extraction, <= 1 = inline (default: 4)
+    -- in_json          bool      Also store the outlines in seg_json (default: False)
+
+    ># seg_json         dict      Segmentation JSON
+    ># instance_id_list list      Instance ids
+    ># instance_masks   list      HxW np.uint8 masks, one per id
+    <# seg_json         dict      Unchanged, or with 'instance_polygons' added (in_json)
+    <# instance_polygons dict     {'ids', 'coords' (M,2) int32 x/y, 'offsets' (N+1,), 'tolerance'}, None on failure
+    <# message          string    Summary
+
+    <= done             Outlines computed (or skipped on failure, with instance_polygons None)
+    """
+
+    def __init__(self, tolerance: float = 1.5, workers: int = 4, in_json: bool = False):
+        super().__init__(
+            outcomes=['done'],
+            input_keys=['seg_json', 'instance_id_list', 'instance_masks'],
+            output_keys=['seg_json', 'instance_polygons', 'message']
+        )
+        self._tolerance = float(tolerance)
+        self._workers = int(workers)
+        self._in_json = bool(in_json)
+
+    def execute(self, userdata):
+        ids = list(getattr(userdata, 'instance_id_list', None) or [])
+        seg_json = getattr(userdata, 'seg_json', None)
+        try:
+            from uoc_flexbe_states.label_map_utils import polygon_executor, polygon_output
+
+            executor = polygon_executor(self._workers) if self._workers > 1 else None
+            t0 = time.monotonic()
+            polygons = polygon_output(ids, list(userdata.instance_masks or []), self._tolerance, executor,
+                                      seg_json if self._in_json and isinstance(seg_json, dict) else None)
+        except Exception as e:
+            userdata.instance_polygons = None
+            userdata.message = f"[ExtractInstancePolygonsState] Polygon extraction failed: {e}"
+            Logger.logwarn(userdata.message)
+            return 'done'
+
+        userdata.seg_json = seg_json
+        userdata.instance_polygons = polygons
+        userdata.message = (f"[ExtractInstancePolygonsState] {len(polygons['coords'])} outline vertices for "
+                            f"{len(ids)} instances in {(time.monotonic() - t0) * 1000.0:.1f} ms.")
+        Logger.loginfo(userdata.message)
+        return 'done'
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flexbe_core import EventState, Logger
+
+
+class FilterMergeInstancesState(EventState):
+    """
+    Clean up a UCN label map: drop speckle instances and merge over-segmented fragments.
+
+    The instance adjacency graph (shared boundary length and depth step across
+    each boundary) is built from the label map in a single vectorized pass.
+    Two adjacent instances are merged when their shared boundary is a large
+    enough fraction of the smaller instance's perimeter and the depth across
+    the boundary is continuous.  After merging, instances smaller than
+    `min_area` pixels are set to background and the map is relabelled.
+
+    For an object cut cleanly in two, the ratio is about 0.25 (an elongated
+    object cut across its length) to 0.4 (cut along it); the default of 0.2
+    merges both.  With min_area <= 0 and merge_boundary_ratio <= 0 the state
+    passes its input through unchanged, so behaviors can keep it in place
+    and switch it on by parameter.
+
+    Outlines (ExtractInstancePolygonsState) and operator thumbnails
+    (PublishInstanceThumbnailsState) go after this state, so they match the
+    cleaned map.
+
+    -- min_area               int     Instances below this pixel area are dropped (default: 200)
+    -- merge_boundary_ratio   float   Min shared boundary / smaller perimeter to merge (default: 0.2, <= 0 disables merging)
+    -- merge_depth_tolerance  float   Max mean depth step across the boundary, in depth-map units (default: 0.01)
+    -- merge_without_depth    bool    Merge on boundary alone if no depth frame is found (default: False)
+    -- depth_file             string  Depth frame name inside result_dir (default: 'depth.npy')
+    -- background_id          int     Label treated as background (default: 0)
+    -- compact_ids            bool    Renumber surviving instances 1..N (default: True)
+
+    ># seg_json              dict     Segmentation JSON (for an optional 'depth_path')
+    ># result_dir            string   Segmentation output directory
+    ># instance_ids_2d       object   HxW instance-id map
+    ># instance_id_list      list     Instance ids in the map
+    ># instance_masks        list     Masks of the input map (passed through when the state is disabled)
+    <# instance_ids_2d       object   Cleaned HxW instance-id map (int32)
+    <# instance_id_list      list     Sorted surviving instance ids
+    <# instance_masks        list     HxW np.uint8 masks, one per surviving instance
+    <# instance_id_remap     dict     New id -> list of original ids merged into it
+    <# message               string   Summary of what was dropped / merged
+
+    <= finished              Label map cleaned (possibly with no instances left)
+    <= failed                Invalid input
+    """
+
+    def __init__(self,
+                 min_area: int = 200,
+                 merge_boundary_ratio: float = 0.2,
+                 merge_depth_tolerance: float = 0.01,
+                 merge_without_depth: bool = False,
+                 depth_file: str = 'depth.npy',
+                 background_id: int = 0,
+                 compact_ids: bool = True):
+        super().__init__(
+            outcomes=['finished', 'failed'],
+            input_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list', 'instance_masks'],
+            output_keys=['instance_ids_2d', 'instance_id_list', 'instance_masks', 'instance_id_remap', 'message']
+        )
+        self._min_area = int(min_area)
+        self._merge_ratio = float(merge_boundary_ratio)
+        self._depth_tol = float(merge_depth_tolerance)
+        self._merge_without_depth = bool(merge_without_depth)
+        self._depth_file = str(depth_file)
+        self._background_id = int(background_id)
+        self._compact_ids = bool(compact_ids)
+
+        self._had_error = False
+        self._msg = ""
+        self._result = None
+
+    def _merge_groups(self, graph, have_depth):
+        """Union-find over adjacency pairs that pass the merge criteria; returns {id: root}."""
+        ids = [int(i) for i in graph['ids']]
+        parent = {i: i for i in ids}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        if self._merge_ratio <= 0 or (not have_depth and not self._merge_without_depth):
+            return parent
+
+        perim = dict(zip(ids, (int(p) for p in graph['perimeters'])))
+        for (lo, hi), shared, gap in zip(graph['pairs'], graph['boundary'], graph['depth_gap']):
+            lo, hi = int(lo), int(hi)
+            smaller = min(perim[lo], perim[hi])
+            if smaller <= 0 or shared / smaller < self._merge_ratio:
+                continue
+            if have_depth and not (gap <= self._depth_tol):  # NaN gap => no evidence, don't merge
+                continue
+            ra, rb = find(lo), find(hi)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+
+        return {i: find(i) for i in ids}
+
+    def on_enter(self, userdata):
+        import numpy as np
+        from uoc_flexbe_states.label_map_utils import label_adjacency, load_depth_map, relabel
+
+        self._had_error = False
+        self._msg = ""
+        self._result = None
+
+        if self._min_area <= 0 and self._merge_ratio <= 0:
+            id_list = [int(i) for i in (getattr(userdata, 'instance_id_list', None) or [])]
+            self._result = (userdata.instance_ids_2d, id_list, getattr(userdata, 'instance_masks', None),
+                            {i: [i] for i in id_list})
+            self._msg = f"[FilterMergeInstancesState] Disabled, passing {len(id_list)} instances through."
+            return
+
+        try:
+            arr = np.asarray(userdata.instance_ids_2d, dtype=np.int32)
+            if arr.ndim != 2:
+                self._msg = f"[FilterMergeInstancesState] instance_ids_2d must be 2D, got shape {arr.shape}."
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                return
+
+            depth = load_depth_map(getattr(userdata, 'seg_json', None), getattr(userdata, 'result_dir', ''),
+                                   self._depth_file, shape=arr.shape)
+            graph = label_adjacency(arr, self._background_id, depth)
+            roots = self._merge_groups(graph, depth is not None)
+
+            # Group sizes after merging, then drop small groups
+            area = dict(zip((int(i) for i in graph['ids']), (int(a) for a in graph['areas'])))
+            groups = {}
+            for inst_id, root in roots.items():
+                groups.setdefault(root, []).append(inst_id)
+            kept = sorted(r for r, members in groups.items()
+                          if sum(area[m] for m in members) >= self._min_area)
+
+            if self._compact_ids:
+                new_ids = []
+                next_id = 1
+                while len(new_ids) < len(kept):
+                    if next_id != self._background_id:
+                        new_ids.append(next_id)
+                    next_id += 1
+                new_for_root = dict(zip(kept, new_ids))
+            else:
+                new_for_root = {r: r for r in kept}
+
+            mapping = {m: new_for_root[r] for r in kept for m in groups[r]}
+            cleaned = relabel(arr, mapping, self._background_id)
+            id_list = sorted(new_for_root.values())
+            masks = [(cleaned == inst_id).astype(np.uint8) for inst_id in id_list]
+            remap = {new_for_root[r]: sorted(groups[r]) for r in kept}
+
+            n_in = len(graph['ids'])
+            n_merged = sum(len(groups[r]) - 1 for r in kept)
+            n_dropped = sum(len(m) for r, m in groups.items() if r not in new_for_root)
+            self._msg = (f"[FilterMergeInstancesState] {n_in} instances -> {len(id_list)} "
+                         f"(merged {n_merged} fragments, dropped {n_dropped} below {self._min_area} px"
+                         f"{'' if depth is not None else ', no depth frame'}).")
+            Logger.loginfo(self._msg)
+
+            self._result = (cleaned, id_list, masks, remap)
+
+        except Exception as e:
+            self._msg = f"[FilterMergeInstancesState] Exception: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
+
+    def execute(self, userdata):
+        if self._had_error or self._result is None:
+            userdata.message = self._msg
+            return 'failed'
+
+        cleaned, id_list, masks, remap = self._result
+        userdata.instance_ids_2d = cleaned
+        userdata.instance_id_list = id_list
+        userdata.instance_masks = masks
+        userdata.instance_id_remap = remap
+        userdata.message = self._msg
+        return 'finished'
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact per-cycle selection messages for a remote operator.
+
+Instead of the full-resolution visualization, the operator gets, per
+segmentation cycle, a small JSON message with every instance's id, area and
+bounding box, followed by one message per instance carrying a downscaled,
+JPEG-compressed crop (base64).  Thumbnails are encoded one at a time on a
+background thread, largest instance first, and generation stops as soon as
+a newer cycle arrives or nobody is listening any more.
+
+Messages (JSON strings):
+
+  {"type": "instances", "cycle_id": 7, "shape": [H, W], "thumbnails": N,
+   "instances": [{"id": 3, "area": 5120, "bbox": [x, y, w, h]}, ...]}
+
+  {"type": "thumbnail", "cycle_id": 7, "id": 3, "format": "jpeg",
+   "size": [w, h], "data": "<base64>"}
+
+cycle_id is process-wide: it keeps increasing across behavior runs, so an
+operator never confuses a new cycle with an old one.  One streamer (and
+encoding thread) is shared per topic (shared_streamer()).
+
+Crops come from the color image of the cycle if one is found (see
+label_map_utils.load_color_image), otherwise from the instance silhouette.
+Pixels outside the instance are dimmed.  Needs OpenCV for the thumbnails;
+the instance message is sent without it.
+"""
+
+import base64
+import itertools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from uoc_flexbe_states.label_map_utils import instance_stats, load_color_image
+
+_CYCLE_IDS = itertools.count(1)
+_STREAMERS = {}   # topic -> ThumbnailStreamer
+
+
+def instance_summary(label_map, ids):
+    """Per-instance {'id', 'area', 'bbox': [x, y, w, h]}, largest first."""
+    stats = instance_stats(label_map, ids, bboxes=True)
+    order = np.argsort(-stats['areas'], kind='stable')
+    out = []
+    for k in order:
+        r0, c0, r1, c1 = (int(v) for v in stats['bboxes'][k])
+        if r1 < 0:
+            continue
+        out.append({'id': int(stats['ids'][k]), 'area': int(stats['areas'][k]),
+                    'bbox': [c0, r0, c1 - c0, r1 - r0]})
+    return out
+
+
+def encode_thumbnail(label_map, inst_id, bbox, image=None, max_side=64, quality=70, pad=4, dim=0.35):
+    """Base64 JPEG of the instance crop, scaled so its longer side is at most max_side; returns (data, (w, h))."""
+    import cv2
+
+    x, y, w, h = bbox
+    rows, cols = label_map.shape[:2]
+    r0, c0 = max(y - pad, 0), max(x - pad, 0)
+    r1, c1 = min(y + h + pad, rows), min(x + w + pad, cols)
+    inside = np.asarray(label_map[r0:r1, c0:c1]) == inst_id
+
+    if image is not None:
+        crop = np.array(image[r0:r1, c0:c1], dtype=np.float32)
+        if crop.ndim == 2:
+            crop = crop[..., None]
+        crop[~inside] *= dim
+        crop = crop.astype(np.uint8)
+    else:
+        crop = np.where(inside, 255, int(255 * dim)).astype(np.uint8)
+
+    scale = min(1.0, float(max_side) / max(crop.shape[0], crop.shape[1]))
+    if scale < 1.0:
+        size = (max(int(round(crop.shape[1] * scale)), 1), max(int(round(crop.shape[0] * scale)), 1))
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode('.jpg', crop, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        raise ValueError(f"JPEG encoding failed for instance {inst_id}")
+    return base64.b64encode(buf.tobytes()).decode('ascii'), (crop.shape[1], crop.shape[0])
+
+
+class ThumbnailStreamer(object):
+    """
+    Publish the selection messages of a cycle from a background thread.
+
+    publish          callable(str), sends one JSON message
+    has_subscribers  callable() -> bool, checked before a cycle and before every thumbnail
+    max_side         Longer side of a thumbnail in pixels
+    quality          JPEG quality (0-100)
+    """
+
+    def __init__(self, publish, has_subscribers, max_side=64, quality=70):
+        self._publish = publish
+        self._has_subscribers = has_subscribers
+        self._max_side = int(max_side)
+        self._quality = int(quality)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._latest = None   # cycle id of the newest submission
+
+    def submit(self, label_map, ids, seg_json=None, result_dir=''):
+        """Queue a cycle if anybody listens; an older cycle still being encoded is abandoned."""
+        if not self._has_subscribers():
+            return None
+        cycle_id = next(_CYCLE_IDS)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='uoc_thumbnails')
+        with self._lock:
+            self._latest = cycle_id
+        return self._pool.submit(self._run, cycle_id, label_map, list(ids), seg_json, result_dir)
+
+    def _current(self, cycle_id):
+        with self._lock:
+            return self._latest == cycle_id
+
+    def _run(self, cycle_id, label_map, ids, seg_json, result_dir):
+        if not self._current(cycle_id):
+            return 0
+        instances = instance_summary(label_map, ids)
+        self._publish(json.dumps({'type': 'instances', 'cycle_id': cycle_id,
+                                  'shape': list(label_map.shape[:2]), 'thumbnails': len(instances),
+                                  'instances': instances}))
+
+        image = load_color_image(seg_json, result_dir, shape=label_map.shape[:2])
+        sent = 0
+        for inst in instances:
+            if not self._current(cycle_id) or not self._has_subscribers():
+                break
+            try:
+                data, size = encode_thumbnail(label_map, inst['id'], inst['bbox'], image,
+                                              self._max_side, self._quality)
+            except ImportError:
+                break   # no OpenCV: the instance message alone still allows a selection
+            self._publish(json.dumps({'type': 'thumbnail', 'cycle_id': cycle_id, 'id': inst['id'],
+                                      'format': 'jpeg', 'size': list(size), 'data': data}))
+            sent += 1
+        return sent
+
+
+def shared_streamer(topic, max_side=64, quality=70):
+    """Streamer publishing std_msgs/String on `topic`, shared by all states and behavior runs (first caller sets size/quality)."""
+    streamer = _STREAMERS.get(topic)
+    if streamer is None:
+        from std_msgs.msg import String
+        from flexbe_core.proxy import ProxyPublisher
+
+        pub = ProxyPublisher({topic: String})
+
+        def has_subscribers():
+            try:
+                return pub.number_of_subscribers(topic) > 0
+            except Exception:
+                return True   # cannot tell: publish anyway
+
+        streamer = ThumbnailStreamer(lambda data: pub.publish(topic, String(data=data)),
+                                     has_subscribers, max_side, quality)
+        _STREAMERS[topic] = streamer
+    return streamer
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized helpers shared by the UOC states for working with the 2D
+instance-id (label) map returned by the segmentation server.
+
+These are plain functions (no FlexBE dependency) so they can also be used
+from offline tools.
+"""
+
+import itertools
+import os
+import threading
+
+import numpy as np
+
+_POLYGON_POOL = None
+_POLYGON_POOL_LOCK = threading.Lock()
+
+# seg_cycle_id source for every segmentation state; process-wide, since FlexBE
+# builds new state instances on every behavior run
+_SEG_CYCLE_IDS = itertools.count(1)
+_SEG_CYCLE_LOCK = threading.Lock()
+
+
+def next_seg_cycle_id():
+    """A new seg_cycle_id, unique and increasing for the whole process."""
+    with _SEG_CYCLE_LOCK:
+        return next(_SEG_CYCLE_IDS)
+
+
+def label_adjacency(label_map, background_id=0, depth=None):
+    """
+    Build the instance adjacency graph of a label map in one vectorized pass.
+
+    Every horizontally / vertically neighbouring pixel pair with different
+    labels is a boundary edge (4-connectivity).  Returns a dict with
+
+      ids          (N,)   sorted non-background instance ids
+      areas        (N,)   pixel count per id
+      perimeters   (N,)   boundary edges per id (against anything, incl. background)
+      pairs        (P,2)  adjacent id pairs (lo, hi), lo < hi, background excluded
+      boundary     (P,)   shared boundary length (edges) per pair
+      depth_gap    (P,)   mean |depth(lo) - depth(hi)| across the shared boundary
+      depth_delta  (P,)   mean depth(lo) - depth(hi) across the shared boundary
+
+    depth_gap / depth_delta are NaN if no depth is given or a pair has no
+    valid (finite, > 0) depth on both sides of its boundary.
+    """
+    lab = np.asarray(label_map)
+    labels, inv = np.unique(lab, return_inverse=True)
+    inv = inv.reshape(lab.shape)
+    n_all = labels.size
+
+    areas_all = np.bincount(inv.ravel(), minlength=n_all)
+
+    if depth is not None:
+        depth = np.asarray(depth, dtype=np.float32)
+        if depth.shape != lab.shape:
+            depth = None
+
+    side_a, side_b, gaps, valid = [], [], [], []
+    for sl_a, sl_b in (((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+                       ((slice(None, -1), slice(None)), (slice(1, None), slice(None)))):
+        a = inv[sl_a]
+        b = inv[sl_b]
+        edge = a != b
+        side_a.append(a[edge])
+        side_b.append(b[edge])
+        if depth is not None:
+            da = depth[sl_a][edge]
+            db = depth[sl_b][edge]
+            gaps.append(da - db)
+            valid.append(np.isfinite(da) & np.isfinite(db) & (da > 0) & (db > 0))
+
+    a = np.concatenate(side_a)
+    b = np.concatenate(side_b)
+    perim_all = np.bincount(a, minlength=n_all) + np.bincount(b, minlength=n_all)
+
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    # Signed depth difference oriented as depth(lo) - depth(hi)
+    if depth is not None:
+        gap = np.concatenate(gaps)
+        gap = np.where(a == lo, gap, -gap)
+        ok = np.concatenate(valid)
+
+    bg_idx = np.flatnonzero(labels == background_id)
+    keep = np.ones(lo.shape, dtype=bool)
+    if bg_idx.size:
+        keep = (lo != bg_idx[0]) & (hi != bg_idx[0])
+
+    keys = lo[keep].astype(np.int64) * n_all + hi[keep]
+    pair_keys, pair_inv, boundary = np.unique(keys, return_inverse=True, return_counts=True)
+    n_pairs = pair_keys.size
+
+    depth_gap = np.full(n_pairs, np.nan)
+    depth_delta = np.full(n_pairs, np.nan)
+    if depth is not None and n_pairs:
+        g = gap[keep]
+        w = ok[keep].astype(np.float64)
+        cnt = np.bincount(pair_inv, weights=w, minlength=n_pairs)
+        s_abs = np.bincount(pair_inv, weights=np.abs(g) * w, minlength=n_pairs)
+        s_sig = np.bincount(pair_inv, weights=g * w, minlength=n_pairs)
+        has = cnt > 0
+        depth_gap[has] = s_abs[has] / cnt[has]
+        depth_delta[has] = s_sig[has] / cnt[has]
+
+    fg = labels != background_id
+    pairs = np.stack([labels[pair_keys // n_all], labels[pair_keys % n_all]], axis=1) if n_pairs \
+        else np.zeros((0, 2), dtype=labels.dtype)
+
+    return {
+        'ids': labels[fg],
+        'areas': areas_all[fg],
+        'perimeters': perim_all[fg],
+        'pairs': pairs,
+        'boundary': boundary,
+        'depth_gap': depth_gap,
+        'depth_delta': depth_delta,
+    }
+
+
+def instance_mean_depth(label_map, ids, depth):
+    """Mean valid (finite, > 0) depth per id in `ids`; NaN where an instance has no valid depth."""
+    ids = np.asarray(ids)
+    out = np.full(ids.size, np.nan)
+    if depth is None or ids.size == 0:
+        return out
+    lab = np.asarray(label_map).ravel()
+    d = np.asarray(depth, dtype=np.float64).ravel()
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    pos = np.clip(np.searchsorted(sorted_ids, lab), 0, ids.size - 1)
+    sel = (sorted_ids[pos] == lab) & np.isfinite(d) & (d > 0)
+    cnt = np.bincount(pos[sel], minlength=ids.size)
+    tot = np.bincount(pos[sel], weights=d[sel], minlength=ids.size)
+    has = cnt > 0
+    out[order[has]] = tot[has] / cnt[has]
+    return out
+
+
+def _lookup(values, ids):
+    """Index into `ids` for every entry of `values` and a mask of the entries that are in `ids`."""
+    if values.dtype.kind in 'iu' and ids.dtype.kind in 'iu' and values.size:
+        lo, hi = int(values.min()), int(values.max())
+        if lo >= 0 and hi < (1 << 20):
+            # Small non-negative labels: a lookup table beats a binary search per pixel
+            lut = np.full(hi + 1, -1, dtype=np.int64)
+            ok = ids <= hi
+            lut[ids[ok]] = np.flatnonzero(ok)
+            idx = lut[values]
+            return idx, idx >= 0
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    pos = np.clip(np.searchsorted(sorted_ids, values), 0, ids.size - 1)
+    hit = sorted_ids[pos] == values
+    return order[pos], hit
+
+
+def instance_stats(label_map, ids, stride=1, bboxes=False):
+    """
+    Area and centroid per id in `ids` in one vectorized pass.
+
+    With stride > 1 only every stride-th row and column is read.  Areas are
+    then scaled by stride**2 and coordinates refer to the full-resolution
+    map, so the result is an estimate; instances thinner than `stride` may
+    not be seen at all.  Returns a dict with
+
+      ids        (N,)    the ids, in the given order
+      areas      (N,)    pixel count (estimated if stride > 1)
+      centroids  (N,2)   (row, col), NaN if the id was not seen
+      bboxes     (N,4)   (r0, c0, r1, c1) half-open, -1 if not seen (only if bboxes=True)
+    """
+    ids = np.asarray(ids).ravel()
+    lab = np.asarray(label_map)
+    stride = max(int(stride), 1)
+    view = lab[::stride, ::stride] if stride > 1 else lab
+    n = ids.size
+
+    out = {'ids': ids, 'areas': np.zeros(n), 'centroids': np.full((n, 2), np.nan)}
+    if bboxes:
+        out['bboxes'] = np.full((n, 4), -1, dtype=np.int64)
+    if n == 0 or view.size == 0:
+        return out
+
+    idx, hit = _lookup(view.ravel(), ids)
+    lin = np.flatnonzero(hit)
+    idx = idx[lin]
+    rows, cols = np.divmod(lin, view.shape[1])
+
+    cnt = np.bincount(idx, minlength=n)
+    seen = cnt > 0
+    out['areas'] = cnt * float(stride * stride)
+    out['centroids'][seen, 0] = np.bincount(idx, weights=rows, minlength=n)[seen] / cnt[seen] * stride
+    out['centroids'][seen, 1] = np.bincount(idx, weights=cols, minlength=n)[seen] / cnt[seen] * stride
+
+    if bboxes:
+        box = np.empty((n, 4), dtype=np.int64)
+        box[:, :2] = np.iinfo(np.int64).max
+        box[:, 2:] = -1
+        np.minimum.at(box[:, 0], idx, rows)
+        np.minimum.at(box[:, 1], idx, cols)
+        np.maximum.at(box[:, 2], idx, rows)
+        np.maximum.at(box[:, 3], idx, cols)
+        box[:, :2] *= stride
+        box[:, 2:] = box[:, 2:] * stride + 1
+        out['bboxes'][seen] = box[seen]
+    return out
+
+
+def rank_instances(label_map, ids, stride=1, refine_top=3):
+    """
+    Rank instances by area, largest first (ties: smaller id first).
+
+    stride == 1 is the exact mode: one full-resolution pass.  With stride > 1
+    all instances are scored on the strided map, then the `refine_top` best
+    candidates get exact area / centroid from a full-resolution scan of their
+    coarse bounding box grown by `stride` pixels, and the list is re-sorted.
+    Returns the instance_stats() dict reordered by rank, plus
+
+      refined    (N,)    True where area / centroid are full-resolution values
+    """
+    lab = np.asarray(label_map)
+    stride = max(int(stride), 1)
+    coarse = stride > 1
+    stats = instance_stats(lab, ids, stride, bboxes=coarse)
+    n = stats['ids'].size
+    stats['refined'] = np.full(n, not coarse)
+
+    if coarse and n:
+        h, w = lab.shape
+        first = np.lexsort((stats['ids'], -stats['areas']))
+        for i in first[:max(int(refine_top), 0)]:
+            r0, c0, r1, c1 = stats['bboxes'][i]
+            if r1 < 0:
+                continue
+            r0, c0 = max(r0 - stride, 0), max(c0 - stride, 0)
+            r1, c1 = min(r1 + stride, h), min(c1 + stride, w)
+            mask = lab[r0:r1, c0:c1] == stats['ids'][i]
+            row_cnt = mask.sum(axis=1)
+            area = int(row_cnt.sum())
+            stats['areas'][i] = area
+            stats['refined'][i] = True
+            if area:
+                col_cnt = mask.sum(axis=0)
+                stats['centroids'][i] = (r0 + np.dot(np.arange(row_cnt.size), row_cnt) / area,
+                                         c0 + np.dot(np.arange(col_cnt.size), col_cnt) / area)
+
+    rank = np.lexsort((stats['ids'], -stats['areas']))
+    return {k: v[rank] for k, v in stats.items()}
+
+
+def _mask_polygon(mask, tolerance):
+    """Simplified outer contour (K,2) int32 (x, y) of the largest blob in a binary mask."""
+    import cv2
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return np.zeros((0, 2), dtype=np.int32)
+    cols = np.flatnonzero(mask.any(axis=0))
+    r0, c0 = rows[0], cols[0]
+    crop = np.ascontiguousarray(mask[r0:rows[-1] + 1, c0:cols[-1] + 1], dtype=np.uint8)
+    contours = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    if not contours:
+        return np.zeros((0, 2), dtype=np.int32)
+    contour = max(contours, key=cv2.contourArea)
+    if tolerance > 0:
+        contour = cv2.approxPolyDP(contour, float(tolerance), True)
+    return contour.reshape(-1, 2).astype(np.int32) + np.array([c0, r0], dtype=np.int32)
+
+
+def instance_polygons(masks, tolerance=1.5, executor=None):
+    """
+    Simplified outline of every instance mask, packed into flat arrays.
+
+    Each instance is reduced to the outer contour of its largest connected
+    part, simplified with Douglas-Peucker (`tolerance` in pixels).  The work
+    is done per instance on the given concurrent.futures executor if any
+    (OpenCV releases the GIL, so a thread pool scales).  Needs OpenCV.
+    Returns (coords, offsets):
+
+      coords   (M,2) int32  (x, y) vertices of all polygons, back to back
+      offsets  (N+1,) int64  polygon i is coords[offsets[i]:offsets[i + 1]]
+    """
+    if executor is not None and len(masks) > 1:
+        polys = list(executor.map(lambda m: _mask_polygon(m, tolerance), masks))
+    else:
+        polys = [_mask_polygon(m, tolerance) for m in masks]
+    offsets = np.zeros(len(polys) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in polys], out=offsets[1:])
+    coords = np.concatenate(polys) if polys else np.zeros((0, 2), dtype=np.int32)
+    return coords, offsets
+
+
+def polygon_executor(max_workers=4):
+    """Thread pool for instance_polygons(), shared by the whole process (created on first use)."""
+    global _POLYGON_POOL
+    with _POLYGON_POOL_LOCK:
+        if _POLYGON_POOL is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _POLYGON_POOL = ThreadPoolExecutor(max_workers=max(int(max_workers), 1),
+                                               thread_name_prefix='uoc_polygons')
+        return _POLYGON_POOL
+
+
+def polygon_output(ids, masks, tolerance=1.5, executor=None, seg_json=None):
+    """
+    instance_polygons() packed as the `instance_polygons` userdata dict
+    {'ids', 'coords', 'offsets', 'tolerance'}; if seg_json is given, a plain
+    list copy is stored in seg_json['instance_polygons'] as well.
+    """
+    coords, offsets = instance_polygons(masks, tolerance, executor)
+    if seg_json is not None:
+        seg_json['instance_polygons'] = {
+            'ids': [int(i) for i in ids],
+            'coords': coords.ravel().tolist(),
+            'offsets': offsets.tolist(),
+            'tolerance': float(tolerance),
+        }
+    return {'ids': [int(i) for i in ids], 'coords': coords, 'offsets': offsets, 'tolerance': float(tolerance)}
+
+
+def split_polygons(coords, offsets):
+    """Inverse of the packing in instance_polygons(): list of (K,2) vertex arrays."""
+    coords = np.asarray(coords).reshape(-1, 2)
+    return np.split(coords, np.asarray(offsets)[1:-1])
+
+
+def decode_instance_map(seg_json, background_id=0):
+    """(HxW int32 map, sorted non-background ids, per-instance np.uint8 masks) from a segmentation JSON."""
+    instance_ids = seg_json.get('instance_ids', None)
+    if instance_ids is None:
+        raise KeyError("Segmentation JSON missing 'instance_ids'.")
+    arr = np.asarray(instance_ids, dtype=np.int32)
+    unique_ids = sorted(int(v) for v in np.unique(arr) if v != background_id)
+    masks = [(arr == inst_id).astype(np.uint8) for inst_id in unique_ids]
+    return arr, unique_ids, masks
+
+
+def cloud_label_map(seg_json, shape, background_id=0):
+    """
+    HxW label map from a point-cloud segmentation result.
+
+    The cloud service returns `instance_ids`, `classes` and `bboxes` as flat
+    per-detection lists.  `shape` is the image grid: (height, width) of an
+    organized cloud or of its CameraInfo.  Handled layouts of `instance_ids`:
+
+      * 2D map                   used as is
+      * height * width entries   per-point labels of the organized cloud
+      * one id per detection     each detection's `bboxes` entry (pixel
+                                 [x_min, y_min, x_max, y_max]) is filled with
+                                 its id; larger boxes first, so a smaller box
+                                 on top of a larger one stays visible
+
+    Raises ValueError if none applies.
+    """
+    ids = np.asarray(seg_json.get('instance_ids', []))
+    if ids.ndim == 2:
+        return ids.astype(np.int32)
+    if shape is None:
+        raise ValueError('no image shape for the cloud result (unorganized cloud without CameraInfo)')
+    h, w = int(shape[0]), int(shape[1])
+    if ids.size == h * w and ids.size > 1:
+        return ids.reshape(h, w).astype(np.int32)
+
+    boxes = np.asarray(seg_json.get('bboxes', []), dtype=np.float64)
+    if ids.size == 0 or boxes.shape != (ids.size, 4):
+        raise ValueError(f"cloud result has {ids.size} instance ids and bboxes of shape {boxes.shape}; "
+                         f"expected a {h}x{w} label map, {h * w} per-point labels or one box per id")
+    x0 = np.clip(np.floor(boxes[:, 0]), 0, w).astype(np.intp)
+    y0 = np.clip(np.floor(boxes[:, 1]), 0, h).astype(np.intp)
+    x1 = np.clip(np.ceil(boxes[:, 2]), 0, w).astype(np.intp)
+    y1 = np.clip(np.ceil(boxes[:, 3]), 0, h).astype(np.intp)
+    label = np.full((h, w), background_id, dtype=np.int32)
+    for k in np.argsort(-(x1 - x0) * (y1 - y0), kind='stable'):
+        label[y0[k]:y1[k], x0[k]:x1[k]] = int(ids[k])
+    return label
+
+
+def relabel(label_map, mapping, background_id=0):
+    """
+    Apply {old_id: new_id} to a label map with a single lookup-table pass.
+
+    Labels not in `mapping` become `background_id`.
+    """
+    lab = np.asarray(label_map)
+    labels, inv = np.unique(lab, return_inverse=True)
+    lut = np.array([mapping.get(int(v), background_id) for v in labels], dtype=np.int32)
+    return lut[inv].reshape(lab.shape)
+
+
+def load_depth_map(seg_json, result_dir, depth_file='depth.npy', shape=None):
+    """
+    Best-effort load of the depth frame belonging to a segmentation result.
+
+    Looks at seg_json['depth_path'] / seg_json['depth_file'] first, then at
+    <result_dir>/<depth_file>.  .npy files are read with NumPy; image files
+    need OpenCV.  Returns a float32 array or None.
+    """
+    candidates = []
+    if isinstance(seg_json, dict):
+        for key in ('depth_path', 'depth_file'):
+            p = seg_json.get(key)
+            if p:
+                candidates.append(p if os.path.isabs(p) or not result_dir else os.path.join(result_dir, p))
+    if result_dir and depth_file:
+        candidates.append(os.path.join(result_dir, depth_file))
+
+    for path in candidates:
+        if not os.path.isfile(path):
+            continue
+        try:
+            if path.endswith('.npy'):
+                depth = np.load(path)
+            else:
+                import cv2
+                depth = cv2.imread(path, cv2.IMREAD_ANYDEPTH)
+                if depth is None:
+                    continue
+            depth = np.asarray(depth, dtype=np.float32)
+            if depth.ndim == 3:
+                depth = depth[..., 0]
+            if shape is not None and depth.shape != tuple(shape):
+                continue
+            return depth
+        except Exception:
+            continue
+    return None
+
+
+def load_color_image(seg_json, result_dir, shape=None,
+                     names=('rgb.png', 'color.png', 'image.png', 'rgb.jpg', 'color.jpg')):
+    """
+    Best-effort load of the color frame belonging to a segmentation result.
+
+    Looks at seg_json['rgb_path'] / seg_json['image_path'] first, then for
+    the given file names in result_dir.  Needs OpenCV.  Returns an HxWx3
+    uint8 BGR array or None.
+    """
+    candidates = []
+    if isinstance(seg_json, dict):
+        for key in ('rgb_path', 'image_path'):
+            p = seg_json.get(key)
+            if p:
+                candidates.append(p if os.path.isabs(p) or not result_dir else os.path.join(result_dir, p))
+    if result_dir:
+        candidates.extend(os.path.join(result_dir, name) for name in names)
+
+    for path in candidates:
+        if not os.path.isfile(path):
+            continue
+        try:
+            import cv2
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+        except Exception:
+            return None
+        if image is None or (shape is not None and image.shape[:2] != tuple(shape)):
+            continue
+        return image
+    return None
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bounded disk usage for segmentation output directories.
+
+The segmentation server writes every cycle under `result_dir` (by default
+inside /tmp/ucn_io/out) and the visualizer / scene export add files next to
+it.  OutputRetentionManager keeps that directory within size and age caps:
+
+  * end_cycle(result_dir) is called once a cycle is over.  If cycle history
+    is enabled, the result directory is renamed (O(1), same filesystem) into
+    `<parent>/.uoc_history/<stamp>_<finished|failed>_<name>`, so that the
+    server's next cycle does not overwrite it.  A cycle that is not kept is
+    renamed into `<parent>/.uoc_trash` first and only then deleted in the
+    background, so deletion never races with the next cycle writing to the
+    same result directory.
+  * Eviction (size, age, keep-last-N) runs on a background thread, oldest
+    entries first, and never touches the current result directory.  It only
+    considers what the manager owns: the entries of `.uoc_history` and
+    `.uoc_trash` and the result directories it was given; anything else in
+    the output root (other tools' files, datasets) is left alone.
+
+Any state can flag the current cycle as failed with mark_cycle_failed();
+the flag is a marker file inside result_dir, so it works across states.
+
+FlexBE builds new state instances on every behavior run, so the segmentation
+state gets its manager from shared_manager(): managers and their open cycle
+(the result directory still in use, per output root) live for the process.
+"""
+
+import os
+import queue
+import shutil
+import threading
+import time
+
+HISTORY_DIR = '.uoc_history'
+TRASH_DIR = '.uoc_trash'
+FAILED_MARKER = '.uoc_failed'
+
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def shared_manager(max_total_mb=0.0, max_age_sec=0.0, keep_last=0, keep_failed_only=False):
+    """Process-wide OutputRetentionManager for the given caps (created on first use)."""
+    key = (float(max_total_mb), float(max_age_sec), int(keep_last), bool(keep_failed_only))
+    with _MANAGERS_LOCK:
+        if key not in _MANAGERS:
+            _MANAGERS[key] = OutputRetentionManager(*key)
+        return _MANAGERS[key]
+
+
+def mark_cycle_failed(result_dir):
+    """Flag the cycle whose output lives in result_dir as failed (best effort)."""
+    if not result_dir or not os.path.isdir(result_dir):
+        return
+    try:
+        with open(os.path.join(result_dir, FAILED_MARKER), 'w') as f:
+            f.write(time.strftime('%Y-%m-%d %H:%M:%S'))
+    except OSError:
+        pass
+
+
+def _entry_size(path):
+    """Total size in bytes of a file or directory tree."""
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+    except OSError:
+        return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+class OutputRetentionManager(object):
+    """
+    Size / age / count caps for segmentation output, evicted asynchronously.
+
+    max_total_mb      Cap on the total size of the managed output (0 = no cap)
+    max_age_sec       Entries older than this are removed (0 = no cap)
+    keep_last         Keep the last N cycles in history (0 = no history unless keep_failed_only)
+    keep_failed_only  Only keep cycles flagged with mark_cycle_failed() in history
+    """
+
+    def __init__(self, max_total_mb=0.0, max_age_sec=0.0, keep_last=0, keep_failed_only=False):
+        self._max_bytes = int(float(max_total_mb) * 1024 * 1024)
+        self._max_age = float(max_age_sec)
+        self._keep_last = int(keep_last)
+        self._keep_failed_only = bool(keep_failed_only)
+
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._open = {}   # output root -> result_dir of the cycle still in use
+        self._owned = set()   # result directories seen by open_cycle() / end_cycle()
+
+    @property
+    def enabled(self):
+        return bool(self._max_bytes > 0 or self._max_age > 0 or self._keep_last > 0 or self._keep_failed_only)
+
+    @property
+    def keeps_history(self):
+        return self._keep_last > 0 or self._keep_failed_only
+
+    def open_cycle(self, result_dir):
+        """Remember result_dir as the open cycle of its output root, to be closed by close_open_cycles()."""
+        if not result_dir:
+            return
+        result_dir = os.path.normpath(result_dir)
+        with self._lock:
+            self._open[os.path.dirname(result_dir)] = result_dir
+            self._owned.add(result_dir)
+
+    def close_open_cycles(self, forget=True):
+        """end_cycle() for every open cycle; with forget=False they stay open (eviction only)."""
+        with self._lock:
+            dirs = list(self._open.values())
+            if forget:
+                self._open.clear()
+        for result_dir in dirs:
+            self.end_cycle(result_dir)
+
+    def end_cycle(self, result_dir, current_dir=None):
+        """
+        Close the cycle that produced result_dir and schedule eviction.
+
+        Only a rename happens on the calling thread; deletion and size scans
+        are done by the worker.  current_dir, if given, is never evicted.
+        """
+        if not self.enabled or not result_dir:
+            return
+        result_dir = os.path.normpath(result_dir)
+        parent = os.path.dirname(result_dir)
+        with self._lock:
+            self._owned.add(result_dir)
+
+        if self.keeps_history and os.path.isdir(result_dir):
+            failed = os.path.exists(os.path.join(result_dir, FAILED_MARKER))
+            stamp = time.strftime('%Y%m%d-%H%M%S') + f"-{int(time.time() * 1e6) % 1000000:06d}"
+            if self._keep_failed_only and not failed:
+                # Move it out of the way now; the next cycle may recreate result_dir right away
+                trash = os.path.join(parent, TRASH_DIR)
+                target = os.path.join(trash, f"{stamp}_{os.getpid()}_{os.path.basename(result_dir)}")
+                try:
+                    os.makedirs(trash, exist_ok=True)
+                    os.rename(result_dir, target)
+                    self._submit(('remove', target))
+                except OSError:
+                    pass
+            else:
+                history = os.path.join(parent, HISTORY_DIR)
+                target = os.path.join(history, f"{stamp}_{'failed' if failed else 'finished'}_"
+                                               f"{os.path.basename(result_dir)}")
+                try:
+                    os.makedirs(history, exist_ok=True)
+                    os.rename(result_dir, target)
+                except OSError:
+                    pass
+
+            if not os.path.exists(result_dir):
+                with self._lock:
+                    self._owned.discard(result_dir)   # moved away; open_cycle() registers it again
+
+        self._submit(('evict', parent, os.path.normpath(current_dir) if current_dir else result_dir))
+
+    def _submit(self, job):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='uoc_output_retention', daemon=True)
+                self._thread.start()
+        self._jobs.put(job)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job[0] == 'remove':
+                    _remove(job[1])
+                else:
+                    self._evict(job[1], job[2])
+            except Exception:
+                pass
+
+    def _evict(self, parent, protected):
+        """Apply age, keep-last and total-size caps to the entries owned under parent, oldest first."""
+        history = os.path.join(parent, HISTORY_DIR)
+        now = time.time()
+
+        def stamped(paths):
+            out = []
+            for path in paths:
+                try:
+                    out.append((os.lstat(path).st_mtime, path))
+                except OSError:
+                    pass
+            return out
+
+        def listing(d):
+            try:
+                return [os.path.join(d, name) for name in os.listdir(d)]
+            except OSError:
+                return []
+
+        with self._lock:
+            owned = [p for p in self._owned if os.path.dirname(p) == parent and p != protected]
+        history_entries = sorted(stamped(listing(history)))
+        entries = sorted(stamped(owned + listing(os.path.join(parent, TRASH_DIR))) + history_entries)
+
+        evicted = set()
+        if self._max_age > 0:
+            for mtime, path in entries:
+                if now - mtime > self._max_age:
+                    _remove(path)
+                    evicted.add(path)
+
+        if self._keep_last > 0:
+            alive = [p for _, p in history_entries if p not in evicted]
+            for path in alive[:max(0, len(alive) - self._keep_last)]:
+                _remove(path)
+                evicted.add(path)
+
+        if self._max_bytes > 0:
+            alive = [p for _, p in entries if p not in evicted]
+            sizes = [_entry_size(p) for p in alive]
+            total = sum(sizes) + _entry_size(protected)
+            for path, size in zip(alive, sizes):
+                if total <= self._max_bytes:
+                    break
+                _remove(path)
+                evicted.add(path)
+                total -= size
+
+        with self._lock:
+            self._owned.difference_update(evicted)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+
+from flexbe_core import EventState, Logger
+
+
+class PlanPickSequenceState(EventState):
+    """
+    Order all segmented instances into a pick queue from a single perception pass.
+
+    For every pair of touching instances the mean depth step across their
+    shared boundary is measured.  If one side is closer to the camera by more
+    than `occlusion_depth_step`, it is taken to occlude or rest on the other
+    and must be picked first.  The resulting dependency graph is sorted
+    topologically; among instances that are free to pick, the one closest to
+    the camera (then the largest) goes first.  Dependency cycles are broken at
+    the closest remaining instance.  Without a depth frame there are no
+    dependencies and instances are ordered by area.
+
+    -- occlusion_depth_step  float   Min mean depth step across a boundary to call it occlusion/support,
+                                     in depth-map units (default: 0.01)
+    -- min_shared_boundary   int     Ignore contacts shorter than this many boundary pixels (default: 5)
+    -- max_queue_length      int     Keep at most this many picks, 0 = all (default: 0)
+    -- depth_file            string  Depth frame name inside result_dir (default: 'depth.npy')
+    -- background_id         int     Label treated as background (default: 0)
+
+    ># seg_json              dict     Segmentation JSON (for an optional 'depth_path')
+    ># result_dir            string   Segmentation output directory
+    ># instance_ids_2d       object   HxW instance-id map
+    ># instance_id_list      list     Instance ids in the map
+    <# pick_queue            list     Instance ids in pick order
+    <# message               string   Summary
+
+    <= finished              Non-empty pick queue planned
+    <= empty                 No instances to pick
+    <= failed                Invalid input
+    """
+
+    def __init__(self,
+                 occlusion_depth_step: float = 0.01,
+                 min_shared_boundary: int = 5,
+                 max_queue_length: int = 0,
+                 depth_file: str = 'depth.npy',
+                 background_id: int = 0):
+        super().__init__(
+            outcomes=['finished', 'empty', 'failed'],
+            input_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list'],
+            output_keys=['pick_queue', 'message']
+        )
+        self._step = float(occlusion_depth_step)
+        self._min_boundary = int(min_shared_boundary)
+        self._max_len = int(max_queue_length)
+        self._depth_file = str(depth_file)
+        self._background_id = int(background_id)
+
+        self._had_error = False
+        self._queue = []
+        self._msg = ""
+
+    def _order(self, graph, mean_depth):
+        """Topological sort of the 'pick before' graph, closest / largest first."""
+        ids = [int(i) for i in graph['ids']]
+        depth = {i: (d if d == d else float('inf')) for i, d in zip(ids, mean_depth)}  # NaN -> last
+        area = dict(zip(ids, (int(a) for a in graph['areas'])))
+
+        blockers = {i: set() for i in ids}   # i cannot be picked before all of blockers[i]
+        for (lo, hi), shared, delta in zip(graph['pairs'], graph['boundary'], graph['depth_delta']):
+            if shared < self._min_boundary or not (abs(delta) >= self._step):
+                continue
+            lo, hi = int(lo), int(hi)
+            top, below = (lo, hi) if delta < 0 else (hi, lo)
+            blockers[below].add(top)
+
+        def key(i):
+            return (depth[i], -area[i], i)
+
+        heap = [key(i) for i in ids if not blockers[i]]
+        heapq.heapify(heap)
+        remaining = set(ids)
+        order = []
+        n_cycles = 0
+        while remaining:
+            if not heap:
+                # Cycle in the occlusion graph: release the closest remaining instance
+                n_cycles += 1
+                heapq.heappush(heap, min(key(i) for i in remaining))
+            i = heapq.heappop(heap)[2]
+            if i not in remaining:
+                continue
+            remaining.discard(i)
+            order.append(i)
+            for j in remaining:
+                if i in blockers[j]:
+                    blockers[j].discard(i)
+                    if not blockers[j]:
+                        heapq.heappush(heap, key(j))
+        return order, n_cycles
+
+    def on_enter(self, userdata):
+        import numpy as np
+        from uoc_flexbe_states.label_map_utils import instance_mean_depth, label_adjacency, load_depth_map
+
+        self._had_error = False
+        self._queue = []
+        self._msg = ""
+
+        try:
+            arr = np.asarray(userdata.instance_ids_2d, dtype=np.int32)
+            if arr.ndim != 2:
+                self._msg = f"[PlanPickSequenceState] instance_ids_2d must be 2D, got shape {arr.shape}."
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                return
+
+            depth = load_depth_map(getattr(userdata, 'seg_json', None), getattr(userdata, 'result_dir', ''),
+                                   self._depth_file, shape=arr.shape)
+            graph = label_adjacency(arr, self._background_id, depth)
+
+            wanted = set(int(i) for i in (userdata.instance_id_list or []))
+            if wanted:
+                sel = np.isin(graph['ids'], list(wanted))
+                for k in ('ids', 'areas', 'perimeters'):
+                    graph[k] = graph[k][sel]
+                pair_sel = np.isin(graph['pairs'], graph['ids']).all(axis=1)
+                for k in ('pairs', 'boundary', 'depth_gap', 'depth_delta'):
+                    graph[k] = graph[k][pair_sel]
+
+            if depth is not None:
+                mean_depth = instance_mean_depth(arr, graph['ids'], depth)
+            else:
+                mean_depth = np.full(len(graph['ids']), np.nan)
+
+            order, n_cycles = self._order(graph, mean_depth)
+            if self._max_len > 0:
+                order = order[:self._max_len]
+            self._queue = order
+
+            self._msg = (f"[PlanPickSequenceState] Pick queue {order}"
+                         f"{' (no depth frame, ordered by area)' if depth is None else ''}"
+                         f"{f', broke {n_cycles} occlusion cycle(s)' if n_cycles else ''}.")
+            Logger.loginfo(self._msg)
+
+        except Exception as e:
+            self._msg = f"[PlanPickSequenceState] Exception: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
+
+    def execute(self, userdata):
+        userdata.message = self._msg
+        if self._had_error:
+            return 'failed'
+
+        userdata.pick_queue = list(self._queue)
+        return 'finished' if self._queue else 'empty'
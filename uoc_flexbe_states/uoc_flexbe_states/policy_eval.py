@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Evaluate target-selection policies offline over a corpus of saved segmentations.
+
+Every directory below the corpus root that holds a segmentation.json is one
+scene (its result_dir).  The label map is read from <scene>/<label-file>
+(.npy, memory-mapped); scenes without one have the 'instance_ids' of their
+JSON converted once into --cache-dir (a temp directory by default; the corpus
+itself is never written to).  Scenes are spread
+over a process pool; each worker ranks the instances with rank_instances()
+and applies every requested policy with the same rules as
+SelectInstanceToSceneNameState (without waiting for an operator):
+
+  largest            the largest instance
+  manual             the id from --labels, failure if the scene has none
+  largest_or_manual  the id from --labels if any, else the largest
+
+As in the selection state, a labelled id that is not an instance of the
+scene is a failure ('manual id N not in scene'), not a choice.
+
+With --export-script the scene of every chosen target is exported as the
+selection state does with export_args=True (optionally thinned to
+--point-budget points) and removed again unless --keep-scenes.
+
+One row per scene and policy goes to the CSV (chosen id, label match,
+timings, peak worker memory); a per-policy summary is printed.
+
+Usage:
+    uoc_policy_eval /data/ucn_corpus --modes largest largest_or_manual --strides 1 4 \\
+        --labels labels.csv --workers 8 --out policy_eval.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from uoc_flexbe_states.label_map_utils import rank_instances
+
+MODES = ('largest', 'manual', 'largest_or_manual')
+
+
+def find_scenes(root, json_name='segmentation.json'):
+    """Sorted scene directories (those holding json_name) below root."""
+    pattern = os.path.join(root, '**', json_name)
+    return sorted(os.path.dirname(p) for p in glob.glob(pattern, recursive=True))
+
+
+def read_labels(path):
+    """{scene: target_id} from a CSV with 'scene' and 'target_id' columns (scene relative to the corpus root)."""
+    labels = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            labels[os.path.normpath(row['scene'])] = int(row['target_id'])
+    return labels
+
+
+def choose_target(mode, ranked, manual_id=None, valid_ids=None):
+    """
+    (target id, error) for a policy (mirrors SelectInstanceToSceneNameState._decide() and _commit()).
+
+    A manual id outside valid_ids (default: ranked) is reported as an error with no target.
+    """
+    best_id = ranked[0] if ranked else None
+    if mode == 'largest' or (mode == 'largest_or_manual' and manual_id is None):
+        return best_id, '' if best_id is not None else 'no target'
+    if manual_id is None:
+        return None, 'no target'
+    if manual_id not in (ranked if valid_ids is None else valid_ids):
+        return None, f"manual id {manual_id} not in scene"
+    return manual_id, ''
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return float('nan')
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024.0   # KB on Linux
+
+
+def load_label_map(scene_dir, json_name, label_file, cache_dir=''):
+    """
+    Memory-mapped label map of a scene and where it came from ('npy', 'cache' or 'json').
+
+    A label map converted from the JSON is saved into cache_dir (never into
+    the scene directory); without cache_dir the parsed copy is returned.
+    """
+    path = os.path.join(scene_dir, label_file)
+    if os.path.isfile(path):
+        return np.load(path, mmap_mode='r'), 'npy'
+
+    cached = os.path.join(cache_dir, scene_dir.strip(os.sep).replace(os.sep, '__') + '.npy') if cache_dir else ''
+    if cached and os.path.isfile(cached):
+        return np.load(cached, mmap_mode='r'), 'cache'
+
+    with open(os.path.join(scene_dir, json_name)) as f:
+        seg_json = json.load(f)
+    if 'instance_ids' not in seg_json:
+        raise KeyError("Segmentation JSON missing 'instance_ids'.")
+    arr = np.asarray(seg_json['instance_ids'], dtype=np.int32)
+    if not cached:
+        return arr, 'json'
+    try:
+        np.save(cached, arr)
+        return np.load(cached, mmap_mode='r'), 'json'
+    except OSError:
+        return arr, 'json'   # cache dir not writable: work on the parsed copy
+
+
+def _export(cfg, scene_dir, target_id, tag):
+    """Run the export script for one target; returns (ok, export_ms, points)."""
+    import subprocess
+
+    scene_name = f"eval_{os.getpid()}_{tag}_{target_id}"
+    scene_path = os.path.join(os.path.dirname(cfg['export_script']), scene_name + '.npy')
+    im_name = os.path.basename(scene_dir.rstrip(os.sep))
+    if im_name.startswith('segmentation_'):
+        im_name = im_name[len('segmentation_'):]
+    cmd = ["python3", cfg['export_script'], "--im_name", im_name, "--seg_dir", scene_dir,
+           "--scene_name", scene_name, "--target_id", str(target_id)]
+
+    t0 = time.perf_counter()
+    points = -1
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if cfg['point_budget'] > 0:
+            from uoc_flexbe_states.scene_budget import budget_scene_file
+
+            info = budget_scene_file(scene_path, cfg['point_budget'], target_id)
+            points = info.get('target_points', 0) + info.get('context_points', 0)
+        ok = True
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+        ok = False
+    export_ms = (time.perf_counter() - t0) * 1e3
+    if not cfg['keep_scenes']:
+        try:
+            os.remove(scene_path)
+        except OSError:
+            pass
+    return ok, export_ms, points
+
+
+def evaluate_scene(task):
+    """Worker: all policy rows for one scene (list of dicts)."""
+    n, scene_dir, scene, manual_id, cfg = task
+    base = {'scene': scene, 'manual_id': manual_id if manual_id is not None else ''}
+
+    t0 = time.perf_counter()
+    try:
+        label_map, source = load_label_map(scene_dir, cfg['json_name'], cfg['label_file'], cfg['cache_dir'])
+        if label_map.ndim != 2:
+            raise ValueError(f"label map has shape {label_map.shape}")
+        ids = np.unique(label_map)
+    except Exception as e:
+        return [dict(base, mode=mode, allow_background=allow, stride=stride, error=str(e))
+                for mode in cfg['modes'] for allow in cfg['allow_background'] for stride in cfg['strides']]
+    load_ms = (time.perf_counter() - t0) * 1e3
+    base.update({'shape': 'x'.join(map(str, label_map.shape)), 'source': source, 'load_ms': load_ms})
+
+    exported = {}   # target id -> (ok, export_ms, points), one export per distinct target
+    rows = []
+    for stride in cfg['strides']:
+        for allow in cfg['allow_background']:
+            candidates = [int(i) for i in ids if allow or int(i) != 0]
+            t0 = time.perf_counter()
+            ranked = rank_instances(label_map, candidates, stride=stride, refine_top=cfg['refine_top'])
+            rank_ms = (time.perf_counter() - t0) * 1e3
+            order = [int(i) for i, a in zip(ranked['ids'], ranked['areas']) if a > 0]
+            areas = dict(zip(ranked['ids'].tolist(), ranked['areas'].tolist()))
+
+            for mode in cfg['modes']:
+                chosen, error = choose_target(mode, order, manual_id, candidates) if order else (None, 'no target')
+                row = dict(base, mode=mode, allow_background=allow, stride=stride,
+                           instances=len(candidates), rank_ms=rank_ms,
+                           chosen_id=chosen if chosen is not None else '',
+                           chosen_area=areas.get(chosen, '') if chosen is not None else '',
+                           match=int(chosen == manual_id) if manual_id is not None and chosen is not None else '',
+                           error=error)
+                if chosen is not None and cfg['export_script']:
+                    if chosen not in exported:
+                        exported[chosen] = _export(cfg, scene_dir, chosen, n)
+                    ok, export_ms, points = exported[chosen]
+                    row.update({'export_ok': int(ok), 'export_ms': export_ms, 'scene_points': points})
+                rows.append(row)
+
+    for row in rows:
+        row.update({'rss_mb': _rss_mb(), 'peak_rss_mb': _peak_rss_mb(),
+                    'export_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN)})
+    return rows
+
+
+FIELDS = ['scene', 'mode', 'allow_background', 'stride', 'shape', 'source', 'instances', 'manual_id',
+          'chosen_id', 'chosen_area', 'match', 'error', 'load_ms', 'rank_ms', 'export_ok', 'export_ms',
+          'scene_points', 'rss_mb', 'peak_rss_mb', 'export_peak_rss_mb']
+
+
+def _summary(rows, modes, allow_background, strides):
+    print(f"{'mode':>18} {'bg':>3} {'stride':>6} {'scenes':>7} {'failed':>7} {'match':>6} "
+          f"{'rank_ms p50':>11} {'p95':>8} {'export_ms p50':>13} {'peak_mb':>8}")
+    for mode in modes:
+        for allow in allow_background:
+            for stride in strides:
+                sel = [r for r in rows if r['mode'] == mode and r['allow_background'] == allow
+                       and r['stride'] == stride]
+                if not sel:
+                    continue
+                ok = [r for r in sel if not r.get('error')]
+                matches = [r['match'] for r in sel if r.get('match', '') != '']
+                rank = [r['rank_ms'] for r in ok]
+                export = [r['export_ms'] for r in ok if 'export_ms' in r]
+                peak = max((r['peak_rss_mb'] for r in sel if 'peak_rss_mb' in r), default=float('nan'))
+                print(f"{mode:>18} {'y' if allow else 'n':>3} {stride:>6} {len(sel):>7} {len(sel) - len(ok):>7} "
+                      f"{(np.mean(matches) if matches else float('nan')):>6.1%} "
+                      f"{(np.percentile(rank, 50) if rank else float('nan')):>11.2f} "
+                      f"{(np.percentile(rank, 95) if rank else float('nan')):>8.2f} "
+                      f"{(np.percentile(export, 50) if export else float('nan')):>13.1f} {peak:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('corpus', help='Directory searched recursively for segmentation results')
+    parser.add_argument('--modes', nargs='+', default=['largest'], choices=MODES)
+    parser.add_argument('--allow-background', choices=['no', 'yes', 'both'], default='no',
+                        help='Whether id 0 may be selected (both = evaluate either way)')
+    parser.add_argument('--strides', type=int, nargs='+', default=[1], help='coarse_stride values')
+    parser.add_argument('--refine-top', type=int, default=3)
+    parser.add_argument('--labels', default='', help="CSV with 'scene,target_id' (operator choices / ground truth)")
+    parser.add_argument('--json-name', default='segmentation.json')
+    parser.add_argument('--label-file', default='instance_ids.npy', help='Label map file inside each scene')
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'uoc_policy_eval'),
+                        help="Where label maps converted from JSON go, '' = do not keep them (default: %(default)s)")
+    parser.add_argument('--export-script', default='', help='Also export the scene of every chosen target')
+    parser.add_argument('--point-budget', type=int, default=0)
+    parser.add_argument('--keep-scenes', action='store_true', help='Keep exported scene files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--limit', type=int, default=0, help='Evaluate at most N scenes')
+    parser.add_argument('--out', default='policy_eval.csv', help='Per-scene results CSV')
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.corpus)
+    scenes = find_scenes(root, args.json_name)
+    if args.limit > 0:
+        scenes = scenes[:args.limit]
+    if not scenes:
+        print(f"No '{args.json_name}' found below {root}.", file=sys.stderr)
+        return 1
+    labels = read_labels(args.labels) if args.labels else {}
+    if args.cache_dir:
+        os.makedirs(args.cache_dir, exist_ok=True)
+
+    cfg = {
+        'modes': args.modes,
+        'allow_background': {'no': [False], 'yes': [True], 'both': [False, True]}[args.allow_background],
+        'strides': [max(s, 1) for s in args.strides],
+        'refine_top': args.refine_top,
+        'json_name': args.json_name,
+        'label_file': args.label_file,
+        'cache_dir': os.path.abspath(args.cache_dir) if args.cache_dir else '',
+        'export_script': args.export_script,
+        'point_budget': args.point_budget,
+        'keep_scenes': args.keep_scenes,
+    }
+    tasks = []
+    for n, scene_dir in enumerate(scenes):
+        scene = os.path.relpath(scene_dir, root)
+        tasks.append((n, scene_dir, scene, labels.get(os.path.normpath(scene)), cfg))
+
+    t0 = time.perf_counter()
+    rows = []
+    workers = max(args.workers, 1)
+    if workers == 1:
+        for task in tasks:
+            rows.extend(evaluate_scene(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Scenes are cheap, so hand them out in chunks to keep the pool overhead low
+            for scene_rows in pool.map(evaluate_scene, tasks, chunksize=max(len(tasks) // (workers * 8), 1)):
+                rows.extend(scene_rows)
+    wall = time.perf_counter() - t0
+
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"{len(scenes)} scenes, {len(rows)} rows in {wall:.1f}s with {workers} workers -> {args.out}")
+    _summary(rows, cfg['modes'], cfg['allow_background'], cfg['strides'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
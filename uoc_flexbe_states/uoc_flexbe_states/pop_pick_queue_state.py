@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flexbe_core import EventState, Logger
+
+
+class PopPickQueueState(EventState):
+    """
+    Advance the pick queue after a successful pick.
+
+    Removes the head of `pick_queue` (the instance that was just picked) and
+    reports whether more picks remain from the current segmentation.  The
+    behavior re-segments the scene only when the queue is empty.
+
+    ># pick_queue   list     Instance ids in pick order, head = last picked
+    <# pick_queue   list     Remaining instance ids
+    <# message      string   Summary
+
+    <= next         More instances remain; select the new head
+    <= empty        Queue exhausted; re-segment the scene
+    """
+
+    def __init__(self):
+        super().__init__(
+            outcomes=['next', 'empty'],
+            input_keys=['pick_queue'],
+            output_keys=['pick_queue', 'message']
+        )
+
+    def execute(self, userdata):
+        queue = list(getattr(userdata, 'pick_queue', None) or [])
+        picked = queue.pop(0) if queue else None
+
+        userdata.pick_queue = queue
+        userdata.message = (f"[PopPickQueueState] Picked {picked}, "
+                            f"{len(queue)} left in queue: {queue}")
+        Logger.loginfo(userdata.message)
+        return 'next' if queue else 'empty'
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Worker-process pool for heavy segmentation post-processing.
+
+JSON parsing of the instance map, np.unique, per-instance mask building and
+the label-map scans of the selection state hold the GIL for tens of
+milliseconds at high resolution.  With offloading enabled, the states submit
+that work to a small process pool and poll the future from execute(), so the
+FlexBE onboard thread and ROS callbacks keep running.
+
+Large arrays never go through pickling: workers write them into files in a
+shared-memory directory (/dev/shm by default) and return only the path,
+shape and dtype; the parent maps them with np.memmap (zero copy).  A mapped
+array stays valid after its file is unlinked, so the owner can remove the
+files at any time (release_files()).  Files that must outlive a state
+instance (so that later states can pass them on to workers without a copy)
+are held per owner key (hold_files()) and released on the owner's next
+cycle (release_held()), whichever instance runs it.
+
+Only NumPy and the standard library are imported here, so workers start
+quickly and never touch ROS.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+_POOL = None
+_POOL_WORKERS = 0
+_LIVE_FILES = set()
+_HELD_FILES = {}   # owner key -> paths of its latest cycle
+
+
+def shm_dir(preferred='/dev/shm'):
+    """Directory for shared arrays: `preferred` if usable, else the temp directory."""
+    if preferred and os.path.isdir(preferred) and os.access(preferred, os.W_OK):
+        return preferred
+    return tempfile.gettempdir()
+
+
+def get_pool(max_workers=2):
+    """Process pool shared by all states in this process (spawned, created on first use)."""
+    global _POOL, _POOL_WORKERS
+    if _POOL is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn: never fork a process that runs rclpy executor threads
+        _POOL_WORKERS = max(int(max_workers), 1)
+        _POOL = ProcessPoolExecutor(max_workers=_POOL_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _POOL
+
+
+def _new_path(out_dir, tag):
+    return os.path.join(out_dir, f"uoc_{tag}_{os.getpid()}_{uuid.uuid4().hex[:12]}.bin")
+
+
+def map_array(info, mode='c'):
+    """np.memmap view of an array described by {'path', 'shape', 'dtype'} (copy-on-write by default)."""
+    _LIVE_FILES.add(info['path'])
+    return np.memmap(info['path'], dtype=np.dtype(info['dtype']), mode=mode, shape=tuple(info['shape']))
+
+
+def release_files(paths):
+    """Unlink shared files; arrays already mapped from them stay valid."""
+    for path in paths:
+        _LIVE_FILES.discard(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def hold_files(owner, paths):
+    """Keep `paths` until the next release_held(owner); releases the owner's previous files."""
+    release_held(owner)
+    _HELD_FILES[owner] = list(paths)
+
+
+def release_held(owner):
+    """Unlink the files held for `owner` (no-op if there are none)."""
+    release_files(_HELD_FILES.pop(owner, []))
+
+
+@atexit.register
+def _cleanup():
+    release_files(list(_LIVE_FILES))
+
+
+def share_array(arr, out_dir):
+    """
+    Describe `arr` as a shared file for a worker.
+
+    Returns (info, owned): a file-backed memmap of the whole file is passed
+    as is (owned=False); anything else is written to a new file in out_dir
+    that the caller must release (owned=True).
+    """
+    if isinstance(arr, np.memmap) and arr.filename and arr.offset == 0 and arr.flags.c_contiguous \
+            and os.path.exists(arr.filename) and os.path.getsize(arr.filename) == arr.nbytes:
+        return {'path': arr.filename, 'shape': list(arr.shape), 'dtype': arr.dtype.str}, False
+    arr = np.ascontiguousarray(arr)
+    path = _new_path(out_dir, 'arr')
+    out = np.memmap(path, dtype=arr.dtype, mode='w+', shape=arr.shape)
+    out[...] = arr
+    out.flush()
+    del out
+    return {'path': path, 'shape': list(arr.shape), 'dtype': arr.dtype.str}, True
+
+
+# ----------------------------------------------------------------------
+# Worker functions (run in the pool)
+# ----------------------------------------------------------------------
+
+def decode_segmentation(json_str, background_id, out_dir, build_masks=True):
+    """
+    Parse a segmentation JSON string into shared arrays.
+
+    Returns a dict with the JSON without 'instance_ids', the sorted
+    non-background ids, and {'path', 'shape', 'dtype'} descriptions of the
+    HxW int32 label map and of the (N,H,W) uint8 mask stack (None if
+    build_masks is False or there are no instances).
+    """
+    t0 = time.monotonic()
+    seg_json = json.loads(json_str)
+    ids = seg_json.pop('instance_ids', None)
+    if ids is None:
+        raise KeyError("Segmentation JSON missing 'instance_ids'.")
+
+    arr = np.asarray(ids, dtype=np.int32)
+    unique_ids = [int(v) for v in np.unique(arr) if v != background_id]
+
+    label = {'path': _new_path(out_dir, 'labels'), 'shape': list(arr.shape), 'dtype': arr.dtype.str}
+    out = np.memmap(label['path'], dtype=np.int32, mode='w+', shape=arr.shape)
+    out[...] = arr
+    out.flush()
+    del out
+
+    masks = None
+    if build_masks and unique_ids:
+        shape = (len(unique_ids),) + arr.shape
+        masks = {'path': _new_path(out_dir, 'masks'), 'shape': list(shape), 'dtype': np.dtype(np.uint8).str}
+        out = np.memmap(masks['path'], dtype=np.uint8, mode='w+', shape=shape)
+        for k, inst_id in enumerate(unique_ids):
+            np.equal(arr, inst_id, out=out[k].view(bool))
+        out.flush()
+        del out
+
+    return {'seg_json': seg_json, 'unique_ids': unique_ids, 'label': label, 'masks': masks,
+            'decode_sec': time.monotonic() - t0}
+
+
+def rank_shared(label, ids, stride=1, refine_top=3):
+    """label_map_utils.rank_instances() on a shared label map; returns small arrays only."""
+    from uoc_flexbe_states.label_map_utils import rank_instances
+
+    lab = np.memmap(label['path'], dtype=np.dtype(label['dtype']), mode='r', shape=tuple(label['shape']))
+    ranked = rank_instances(lab, ids, stride=stride, refine_top=refine_top)
+    return {'ids': ranked['ids'], 'areas': ranked['areas']}
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flexbe_core import EventState, Logger
+
+
+class PublishInstanceThumbnailsState(EventState):
+    """
+    Publish the instances of a segmentation as compact selection messages for a remote operator.
+
+    First a JSON message with the instance ids, areas and bounding boxes,
+    then one downscaled JPEG crop per instance, largest first (std_msgs/String,
+    see instance_thumbnails).  The crops are encoded on a background thread
+    shared per topic, only while the topic has subscribers, and a newer cycle
+    stops the older one, so the state returns right away.  Place it after
+    FilterMergeInstancesState, so the offered ids are the ones the selection
+    state uses; the operator answers e.g. on SelectInstanceToSceneNameState's
+    manual_target_topic.
+
+    -- topic            string    Selection message topic (default: '/uoc/instance_thumbnails')
+    -- size             int       Longer side of an instance thumbnail in pixels (default: 64)
+    -- quality          int       JPEG quality of the thumbnails (default: 70)
+
+    ># seg_json         dict      Segmentation JSON (to find the color image)
+    ># result_dir       string    Segmentation output directory
+    ># instance_ids_2d  object    HxW instance-id map
+    ># instance_id_list list      Instance ids
+
+    <= done             Messages queued (or nobody listens)
+    """
+
+    def __init__(self, topic: str = '/uoc/instance_thumbnails', size: int = 64, quality: int = 70):
+        super().__init__(
+            outcomes=['done'],
+            input_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list']
+        )
+        self._topic = str(topic)
+        self._size = int(size)
+        self._quality = int(quality)
+
+    def execute(self, userdata):
+        try:
+            from uoc_flexbe_states.instance_thumbnails import shared_streamer
+
+            shared_streamer(self._topic, self._size, self._quality).submit(
+                userdata.instance_ids_2d, list(userdata.instance_id_list or []),
+                getattr(userdata, 'seg_json', None), getattr(userdata, 'result_dir', ''))
+        except Exception as e:
+            Logger.logwarn(f"[PublishInstanceThumbnailsState] Thumbnail publishing failed: {e}")
+        return 'done'
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from flexbe_core import EventState, Logger
+
+# Race statistics per (CGN service, GraspSAM service), kept for the whole process:
+# FlexBE builds new state instances for every behavior run
+_RACE_STATS = {}
+
+# (planner, service name, timeout) -> {'idle': [planner states], 'size': states created}.
+# A planner state whose call was cancelled stays out of the pool until that call returns.
+_PLANNER_POOLS = {}
+_POOL_LOCK = threading.Lock()
+
+
+class RaceGraspPlannersState(EventState):
+    """
+    Run Contact-GraspNet and GraspSAM in parallel on the selected instance and keep one grasp set.
+
+    The state drives a CGNGraspRGBDServiceState and a GraspSAMServiceState
+    each on its own worker thread, so their service calls overlap even if the
+    planner states block.  The FlexBE onboard thread only polls for results.
+
+    Policies:
+      'first'  The first planner that returns a non-empty grasp set wins; the
+               other one is cancelled.
+      'best'   Wait for both (or until `deadline`) and keep the non-empty set
+               with the highest top score.  Missing scores count as 0, so on a
+               tie CGN is preferred.
+
+    A cancelled planner gets its on_exit() called and its result discarded;
+    a service call already in flight cannot be interrupted and finishes in
+    the background.  Every race therefore takes idle planner states from a
+    process-wide pool (up to `pool_size` per planner, created on demand), so
+    a loser still finishing its call does not keep it out of the next race;
+    a planner is only skipped if all of its states are busy.  Per-planner latency, failures and win rate are
+    accumulated over all races in the process (across behavior runs, per
+    pair of service names), logged and written to `race_stats`.
+
+    -- policy              string  'first' | 'best' (default: 'first')
+    -- deadline            float   Max time to wait for a result (sec) (default: 20.0)
+    -- cgn_service_name    string  Contact-GraspNet service (default: '/get_grasps_rgbd')
+    -- cgn_timeout         float   CGN service timeout (sec) (default: 20.0)
+    -- gsam_service_name   string  GraspSAM service (default: '/run_graspsam')
+    -- gsam_timeout        float   GraspSAM timeout (sec) (default: 2.0)
+    -- poll_rate           float   Rate (Hz) at which the worker threads poll the planner states (default: 20.0)
+    -- pool_size           int     Planner states per planner, i.e. calls that may overlap (default: 2)
+
+    ># scene_name          string   CGN scene name (from SelectInstanceToSceneNameState)
+    ># dataset_root        string   GraspSAM inputs
+    ># dataset_name        string
+    ># checkpoint_path     string
+    ># sam_encoder_type    string
+    ># no_grasps           int
+    ># seen_set            bool
+    <# grasp_target_poses  list     Grasp poses of the winning planner
+    <# grasp_scores        list     Scores of the winning planner (empty if it provides none)
+    <# winning_planner     string   'cgn' or 'graspsam'
+    <# race_stats          dict     Per planner: runs, wins, failures, last/mean latency, win rate
+    <# message             string   Summary
+
+    <= done                A grasp set was selected
+    <= failed              Neither planner returned grasps in time
+    """
+
+    _PLANNERS = ('cgn', 'graspsam')
+    _INPUTS = {
+        'cgn': ('scene_name',),
+        'graspsam': ('dataset_root', 'dataset_name', 'checkpoint_path', 'sam_encoder_type', 'no_grasps', 'seen_set'),
+    }
+
+    def __init__(self,
+                 policy: str = 'first',
+                 deadline: float = 20.0,
+                 cgn_service_name: str = '/get_grasps_rgbd',
+                 cgn_timeout: float = 20.0,
+                 gsam_service_name: str = '/run_graspsam',
+                 gsam_timeout: float = 2.0,
+                 poll_rate: float = 20.0,
+                 pool_size: int = 2):
+        super().__init__(
+            outcomes=['done', 'failed'],
+            input_keys=['scene_name', 'dataset_root', 'dataset_name', 'checkpoint_path',
+                        'sam_encoder_type', 'no_grasps', 'seen_set'],
+            output_keys=['grasp_target_poses', 'grasp_scores', 'winning_planner', 'race_stats', 'message']
+        )
+        self._policy = str(policy).lower().strip()
+        self._deadline = float(deadline)
+        self._cgn_service_name = str(cgn_service_name)
+        self._cgn_timeout = float(cgn_timeout)
+        self._gsam_service_name = str(gsam_service_name)
+        self._gsam_timeout = float(gsam_timeout)
+        self._period = 1.0 / max(float(poll_rate), 1.0)
+        self._pool_size = max(int(pool_size), 1)
+
+        self._runs = {}            # name -> {'thread', 'cancel', 'outcome', 'latency', 'ud', 'planner'}
+        self._start = None
+        self._had_error = False
+        self._msg = ""
+        self._stats = _RACE_STATS.setdefault(
+            (self._cgn_service_name, self._gsam_service_name),
+            {name: {'runs': 0, 'wins': 0, 'failures': 0, 'cancelled': 0,
+                    'latency_sum': 0.0, 'last_latency': None}
+             for name in self._PLANNERS})
+
+    def _pool_key(self, name):
+        if name == 'cgn':
+            return (name, self._cgn_service_name, self._cgn_timeout)
+        return (name, self._gsam_service_name, self._gsam_timeout)
+
+    def _create_planner(self, name):
+        if name == 'cgn':
+            from cgn_flexbe_states.cgn_grasp_rgbd_service_state import CGNGraspRGBDServiceState
+
+            return CGNGraspRGBDServiceState(service_timeout=self._cgn_timeout,
+                                            service_name=self._cgn_service_name)
+        from gsam_flexbe_states.graspsam_service_state import GraspSAMServiceState
+
+        # Constructor defaults match UnseenObjClusterGraspSamPipeine; the live values come from userdata
+        return GraspSAMServiceState(service_name=self._gsam_service_name,
+                                    dataset_root='./datasets/sample_scene_ucn',
+                                    dataset_name='from_rgbd',
+                                    checkpoint_path='pretrained_checkpoint/mobile_sam.pt',
+                                    sam_encoder_type='vit_t',
+                                    no_grasps=10,
+                                    timeout=self._gsam_timeout,
+                                    seen_set=False,
+                                    seen_set_default=False)
+
+    def _acquire(self, name):
+        """An idle planner state for this race, a new one while the pool has room, else None."""
+        with _POOL_LOCK:
+            pool = _PLANNER_POOLS.setdefault(self._pool_key(name), {'idle': [], 'size': 0})
+            if pool['idle']:
+                return pool['idle'].pop()
+            if pool['size'] >= self._pool_size:
+                return None
+            pool['size'] += 1
+        try:
+            return self._create_planner(name)
+        except Exception:
+            with _POOL_LOCK:
+                pool['size'] -= 1
+            raise
+
+    def _release(self, name, planner):
+        with _POOL_LOCK:
+            _PLANNER_POOLS[self._pool_key(name)]['idle'].append(planner)
+
+    def _drive(self, name, run):
+        """Worker thread: run one planner state's lifecycle until it returns an outcome or is cancelled."""
+        from types import SimpleNamespace
+
+        planner = run['planner']
+        ud = run['ud']
+        t0 = time.monotonic()
+        outcome = None
+        try:
+            planner.on_enter(ud)
+            while outcome is None and not run['cancel'].is_set():
+                outcome = planner.execute(ud)
+                if outcome is None:
+                    time.sleep(self._period)
+        except Exception as e:
+            Logger.logwarn(f"[RaceGraspPlannersState] Planner '{name}' raised: {e}")
+            outcome = 'failed'
+        finally:
+            try:
+                planner.on_exit(ud)
+            except Exception:
+                pass
+        run['latency'] = time.monotonic() - t0
+        run['outcome'] = outcome if not run['cancel'].is_set() else None
+        run['result'] = SimpleNamespace(poses=list(getattr(ud, 'grasp_target_poses', None) or []),
+                                        scores=list(getattr(ud, 'grasp_scores', None) or []),
+                                        grasps=getattr(ud, 'grasps', None))
+        self._release(name, planner)
+
+    @staticmethod
+    def _score(result):
+        """Top score of a grasp set; GraspSAM results may carry scores inside `grasps`."""
+        scores = list(result.scores)
+        if not scores and result.grasps:
+            for g in result.grasps:
+                s = g.get('score') if isinstance(g, dict) else getattr(g, 'score', None)
+                if s is not None:
+                    scores.append(s)
+        try:
+            return float(max(scores)) if scores else 0.0
+        except (TypeError, ValueError):
+            return 0.0
+
+    def _acceptable(self, name):
+        run = self._runs[name]
+        return run['outcome'] == 'done' and bool(run['result'].poses)
+
+    def on_enter(self, userdata):
+        from types import SimpleNamespace
+
+        self._had_error = False
+        self._msg = ""
+        self._runs = {}
+        self._start = time.monotonic()
+
+        if self._policy not in ('first', 'best'):
+            self._msg = f"[RaceGraspPlannersState] Unknown policy '{self._policy}' (use 'first' or 'best')."
+            Logger.logerr(self._msg)
+            self._had_error = True
+            return
+
+        for name in self._PLANNERS:
+            inputs = {key: getattr(userdata, key, None) for key in self._INPUTS[name]}
+            run = {'cancel': threading.Event(), 'outcome': None, 'latency': None, 'result': None,
+                   'ud': SimpleNamespace(**inputs), 'skipped': False, 'planner': None}
+            run['thread'] = threading.Thread(target=self._drive, args=(name, run),
+                                             name=f'race_{name}', daemon=True)
+            self._runs[name] = run
+            try:
+                run['planner'] = self._acquire(name)
+            except Exception as e:
+                self._msg = f"[RaceGraspPlannersState] Failed to create planner state '{name}': {e}"
+                Logger.logerr(self._msg)
+                self._had_error = True
+                self.on_exit(userdata)
+                return
+
+            if run['planner'] is None:
+                # Every state of this planner is still finishing a cancelled call
+                Logger.logwarn(f"[RaceGraspPlannersState] All {self._pool_size} '{name}' planner states are "
+                               f"still busy with earlier requests, skipping it this time.")
+                run['skipped'] = True
+                run['latency'] = 0.0
+                run['result'] = SimpleNamespace(poses=[], scores=[], grasps=None)
+                continue
+
+            self._stats[name]['runs'] += 1
+            run['thread'].start()
+
+    def execute(self, userdata):
+        if self._had_error:
+            userdata.message = self._msg
+            return 'failed'
+
+        finished = [n for n in self._PLANNERS
+                    if self._runs[n]['skipped'] or not self._runs[n]['thread'].is_alive()]
+        timed_out = time.monotonic() - self._start > self._deadline
+
+        winner = None
+        if self._policy == 'first':
+            winner = next((n for n in finished if self._acceptable(n)), None)
+            if winner is None and len(finished) < len(self._PLANNERS) and not timed_out:
+                return None
+        else:
+            if len(finished) < len(self._PLANNERS) and not timed_out:
+                return None
+            candidates = [n for n in finished if self._acceptable(n)]
+            if candidates:
+                # max() keeps the first of equal scores, i.e. CGN on ties
+                winner = max(candidates, key=lambda n: self._score(self._runs[n]['result']))
+
+        return self._finish(userdata, winner, finished)
+
+    def _finish(self, userdata, winner, finished):
+        for name in self._PLANNERS:
+            run = self._runs[name]
+            stats = self._stats[name]
+            if run['skipped']:
+                continue
+            if name not in finished:
+                run['cancel'].set()
+                stats['cancelled'] += 1
+                continue
+            stats['last_latency'] = run['latency']
+            stats['latency_sum'] += run['latency']
+            if not self._acceptable(name):
+                stats['failures'] += 1
+        if winner is not None:
+            self._stats[winner]['wins'] += 1
+
+        race_stats = {}
+        for name, stats in self._stats.items():
+            completed = stats['runs'] - stats['cancelled']
+            race_stats[name] = {
+                'runs': stats['runs'],
+                'wins': stats['wins'],
+                'failures': stats['failures'],
+                'cancelled': stats['cancelled'],
+                'last_latency': stats['last_latency'],
+                'mean_latency': stats['latency_sum'] / completed if completed else None,
+                'win_rate': stats['wins'] / stats['runs'] if stats['runs'] else 0.0,
+            }
+        userdata.race_stats = race_stats
+
+        cumulative = ', '.join(f"{n} {race_stats[n]['wins']}/{race_stats[n]['runs']} "
+                               f"({race_stats[n]['win_rate']:.0%})" for n in self._PLANNERS)
+        latencies = ', '.join(f"{n}=skipped" if self._runs[n]['skipped'] else
+                              f"{n}={self._runs[n]['latency']:.2f}s" if n in finished else f"{n}=cancelled"
+                              for n in self._PLANNERS)
+        if winner is None:
+            self._msg = (f"[RaceGraspPlannersState] No planner returned grasps ({self._policy}; {latencies}); "
+                         f"wins so far: {cumulative}.")
+            Logger.logwarn(self._msg)
+            userdata.message = self._msg
+            return 'failed'
+
+        result = self._runs[winner]['result']
+        userdata.grasp_target_poses = result.poses
+        userdata.grasp_scores = result.scores
+        userdata.winning_planner = winner
+        self._msg = (f"[RaceGraspPlannersState] '{winner}' won ({self._policy}; {latencies}); "
+                     f"{len(result.poses)} grasps; wins so far: {cumulative}.")
+        Logger.loginfo(self._msg)
+        userdata.message = self._msg
+        return 'done'
+
+    def on_exit(self, userdata):
+        # Behavior left the state early (e.g. preempted): cancel anything still running
+        for name, run in self._runs.items():
+            if not run['skipped'] and run['thread'].is_alive() and not run['cancel'].is_set():
+                run['cancel'].set()
+                self._stats[name]['cancelled'] += 1
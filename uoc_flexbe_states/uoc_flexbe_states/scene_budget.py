@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Point budget for exported grasp scenes.
+
+The scene .npy written by the export script is a dict in the Contact-GraspNet
+input format: either 'depth' + 'K' (+ 'rgb', 'seg'), which the planner
+back-projects to a point cloud, or an explicit 'xyz' cloud (+ 'xyz_color').
+apply_point_budget() thins it so that the planner sees at most `budget`
+points:
+
+  * the target instance ('seg' == target_id) keeps up to target_share of the
+    budget and is only thinned if it alone exceeds that;
+  * the context gets the rest of the budget.
+
+Thinning is a vectorized voxel sampler: one random point per occupied voxel,
+with the voxel size estimated from the bounding box and the budget (see
+voxel_sample), so that the count lands at or just under the budget.  In depth form, dropped pixels get depth 0 (invalid), so the
+image layout is preserved.  The applied budget is recorded in
+scene['point_budget'].
+"""
+
+import numpy as np
+
+# Voxel search runs on a random subset of at most this many times the wanted count
+_PRESAMPLE = 8
+
+
+def voxel_sample(xyz, n, rng=None):
+    """
+    Indices of at most n points of xyz (P,3), spread evenly in space (one random point per voxel).
+
+    The voxel size comes straight from the bounding box and n: a depth camera
+    sees surfaces, so the occupied voxel count is taken to scale with the
+    area of the two largest box extents over size^2.  If that estimate leaves
+    fewer than 0.8 n voxels, it is corrected once from the measured count;
+    voxels beyond n are dropped at random.  Hence one or two np.unique passes.
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    total = len(xyz)
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), 0.0
+    if total <= n:
+        return np.arange(total), 0.0
+    rng = np.random.default_rng(0) if rng is None else rng
+
+    perm = rng.permutation(total)[:_PRESAMPLE * n]   # random order => random voxel representative
+    pts = xyz[perm]
+    lo = pts.min(axis=0)
+    ext = np.sort(pts.max(axis=0) - lo)[::-1]
+    if ext[0] <= 0:
+        return np.sort(perm[:n]), 0.0   # all points coincide
+
+    def occupied(size):
+        cell = np.floor((pts - lo) / size).astype(np.int64)
+        dims = cell.max(axis=0) + 1
+        key = (cell[:, 0] * dims[1] + cell[:, 1]) * dims[2] + cell[:, 2]
+        return np.unique(key, return_index=True)[1]
+
+    # Collinear points: n cells along the line
+    area = ext[0] * ext[1] if ext[1] > 0 else ext[0] * ext[0] / n
+    size = float(np.sqrt(area / n))
+    first = occupied(size)
+    if len(first) < 0.8 * n:
+        size *= float(np.sqrt(len(first) / n))
+        first = occupied(size)
+    if len(first) > n:
+        first = rng.choice(first, n, replace=False)
+    return np.sort(perm[first]), size
+
+
+def _backproject(depth, K, rows, cols):
+    z = depth[rows, cols].astype(np.float64)
+    x = (cols - K[0, 2]) * z / K[0, 0]
+    y = (rows - K[1, 2]) * z / K[1, 1]
+    return np.stack([x, y, z], axis=1)
+
+
+def _split_budget(n_target, n_context, budget, target_share):
+    """Target keeps up to target_share of the budget; whatever it does not use goes to the context."""
+    keep_target = min(n_target, int(round(budget * target_share)))
+    keep_context = min(n_context, budget - keep_target)
+    keep_target = min(n_target, budget - keep_context)
+    return keep_target, keep_context
+
+
+def apply_point_budget(scene, budget, target_id=None, target_share=0.7, seed=0):
+    """
+    Thin a scene dict in place to at most `budget` points; returns the recorded metadata.
+
+    target_id selects the target in scene['seg']; if it is missing from the
+    map but the map has a single instance, that instance is the target.
+    """
+    rng = np.random.default_rng(seed)
+    budget = int(budget)
+    info = {'budget': budget, 'target_id': None if target_id is None else int(target_id),
+            'target_share': float(target_share)}
+
+    if 'depth' in scene and 'K' in scene:
+        depth = np.array(scene['depth'], dtype=np.float32)
+        K = np.asarray(scene['K'], dtype=np.float64).reshape(3, 3)
+        valid = np.isfinite(depth) & (depth > 0)
+
+        target = np.zeros_like(valid)
+        seg = scene.get('seg')
+        if seg is not None and np.shape(seg) == depth.shape:
+            seg = np.asarray(seg)
+            if target_id is not None and (seg == target_id).any():
+                target = seg == target_id
+            else:
+                labels = np.unique(seg[seg != 0])
+                if labels.size == 1:
+                    target = seg == labels[0]
+        target &= valid
+        context = valid & ~target
+
+        t_rows, t_cols = np.nonzero(target)
+        c_rows, c_cols = np.nonzero(context)
+        keep_t, keep_c = _split_budget(len(t_rows), len(c_rows), budget, target_share)
+
+        t_idx, t_voxel = voxel_sample(_backproject(depth, K, t_rows, t_cols), keep_t, rng) \
+            if keep_t < len(t_rows) else (np.arange(len(t_rows)), 0.0)
+        c_idx, c_voxel = voxel_sample(_backproject(depth, K, c_rows, c_cols), keep_c, rng) \
+            if keep_c < len(c_rows) else (np.arange(len(c_rows)), 0.0)
+
+        keep = np.zeros_like(valid)
+        keep[t_rows[t_idx], t_cols[t_idx]] = True
+        keep[c_rows[c_idx], c_cols[c_idx]] = True
+        depth[~keep] = 0.0
+        scene['depth'] = depth
+
+        info.update({'input_points': int(valid.sum()), 'target_points': int(len(t_idx)),
+                     'context_points': int(len(c_idx)), 'target_voxel': t_voxel, 'context_voxel': c_voxel})
+
+    elif 'xyz' in scene:
+        xyz = np.asarray(scene['xyz']).reshape(-1, 3)
+        idx, voxel = voxel_sample(xyz, budget, rng)
+        scene['xyz'] = xyz[idx]
+        if 'xyz_color' in scene:
+            scene['xyz_color'] = np.asarray(scene['xyz_color']).reshape(-1, 3)[idx]
+        info.update({'input_points': int(len(xyz)), 'target_points': 0,
+                     'context_points': int(len(idx)), 'target_voxel': 0.0, 'context_voxel': voxel})
+    else:
+        raise KeyError("Scene has neither 'depth' + 'K' nor 'xyz'.")
+
+    scene['point_budget'] = info
+    return info
+
+
+def budget_scene_file(path, budget, target_id=None, target_share=0.7, seed=0):
+    """Apply a point budget to a scene .npy (dict) file in place; returns the metadata."""
+    scene = np.load(path, allow_pickle=True)
+    scene = scene.item() if scene.dtype == object and scene.shape == () else None
+    if not isinstance(scene, dict):
+        raise ValueError(f"'{path}' does not hold a scene dict")
+    info = apply_point_budget(scene, budget, target_id, target_share, seed)
+    np.save(path, scene)
+    return info
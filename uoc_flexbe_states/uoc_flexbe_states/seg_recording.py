@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Record / replay of segmentation service traffic.
+
+A recording is an append-only binary log:
+
+    b'UOCSEG1\\n'                                    file header
+    repeated:
+        b'REC1' <uint32 meta_len> <uint32 blob_len>  little endian
+        meta  (meta_len bytes, UTF-8 JSON)
+        blob  (blob_len bytes, zlib-compressed label map, may be empty)
+
+`meta` holds the request fields, the scalar response fields, the
+segmentation JSON without its 'instance_ids' map, the label map's shape and
+dtype, and timings.  The label map (or, in cloud mode, the per-detection
+id list) is stored as raw binary, not as JSON text.  Records are flushed one
+at a time, so a log cut short by a crash is still readable up to its last
+complete record; a recorder reopening such a log cuts the partial record
+off before it appends.
+
+FlexBE builds new state instances on every behavior run, so the states get
+their recorder / replayer from shared_recorder() / shared_replayer(): one
+per file for the whole process, so a replay keeps its position across runs.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+FILE_MAGIC = b'UOCSEG1\n'
+RECORD_MAGIC = b'REC1'
+_RECORD_HEADER = struct.Struct('<4sII')
+
+_SHARED = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def _shared(cls, path, *args):
+    key = (cls.__name__, os.path.abspath(os.path.expanduser(path))) + args
+    with _SHARED_LOCK:
+        if key not in _SHARED:
+            _SHARED[key] = cls(path, *args)
+        return _SHARED[key]
+
+
+def shared_recorder(path):
+    """Process-wide SegRecorder for path."""
+    return _shared(SegRecorder, path)
+
+
+def shared_replayer(path, loop=True):
+    """Process-wide SegReplayer for path; the replay position persists across behavior runs."""
+    return _shared(SegReplayer, path, bool(loop))
+
+
+class SegRecorder(object):
+    """Append segmentation requests/responses to a recording file."""
+
+    def __init__(self, path):
+        self._path = os.path.expanduser(path)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, kind, request, response, seg_json, label_map=None, timing=None):
+        """
+        Write one record.
+
+        kind       e.g. 'SegImage', 'SegCloud' or 'stream'
+        request    dict of request fields (JSON-serializable)
+        response   dict of scalar response fields (success, log_output, result_dir, ...)
+        seg_json   parsed segmentation JSON; 'instance_ids' is taken from label_map instead
+        label_map  label array (defaults to seg_json['instance_ids']: the HxW map, or
+                   the cloud mode id list)
+        timing     dict of timings in seconds
+        """
+        seg_json = dict(seg_json or {})
+        ids = seg_json.pop('instance_ids', None)
+        if label_map is None and ids is not None:
+            arr = np.asarray(ids)
+            if arr.dtype.kind in 'biu':
+                label_map = arr
+            else:
+                seg_json['instance_ids'] = ids  # not numeric (e.g. ragged): keep as JSON
+
+        label = None
+        blob = b''
+        if label_map is not None:
+            arr = np.ascontiguousarray(label_map)
+            label = {'shape': list(arr.shape), 'dtype': arr.dtype.str}
+            blob = zlib.compress(arr.tobytes(), 1)
+
+        meta = json.dumps({
+            'kind': kind,
+            'stamp': time.time(),
+            'request': request or {},
+            'response': response or {},
+            'seg_json': seg_json,
+            'label': label,
+            'timing': timing or {},
+        }, default=str).encode('utf-8')
+
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+                new = not os.path.exists(self._path) or os.path.getsize(self._path) == 0
+                if not new:
+                    _truncate_partial(self._path)
+                self._file = open(self._path, 'ab')
+                if new:
+                    self._file.write(FILE_MAGIC)
+            self._file.write(_RECORD_HEADER.pack(RECORD_MAGIC, len(meta), len(blob)))
+            self._file.write(meta)
+            self._file.write(blob)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _truncate_partial(path):
+    """Cut a recording back to its last complete record (a crash may have left half of one)."""
+    size = os.path.getsize(path)
+    with open(path, 'rb+') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"'{path}' is not a segmentation recording")
+        end = f.tell()
+        while True:
+            head = f.read(_RECORD_HEADER.size)
+            if len(head) < _RECORD_HEADER.size:
+                break
+            magic, meta_len, blob_len = _RECORD_HEADER.unpack(head)
+            if magic != RECORD_MAGIC or end + _RECORD_HEADER.size + meta_len + blob_len > size:
+                break
+            end += _RECORD_HEADER.size + meta_len + blob_len
+            f.seek(end)
+        if end < size:
+            f.truncate(end)
+
+
+def read_records(path):
+    """Yield (meta, label_map or None) for every complete record in a recording file."""
+    with open(os.path.expanduser(path), 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"'{path}' is not a segmentation recording")
+        while True:
+            record = _read_record(f)
+            if record is None:
+                return
+            yield record
+
+
+def _read_record(f):
+    head = f.read(_RECORD_HEADER.size)
+    if len(head) < _RECORD_HEADER.size:
+        return None
+    magic, meta_len, blob_len = _RECORD_HEADER.unpack(head)
+    if magic != RECORD_MAGIC:
+        raise ValueError('Corrupt segmentation recording (bad record magic)')
+    meta_bytes = f.read(meta_len)
+    blob = f.read(blob_len)
+    if len(meta_bytes) < meta_len or len(blob) < blob_len:
+        return None  # truncated tail
+    meta = json.loads(meta_bytes.decode('utf-8'))
+    label = None
+    if meta.get('label'):
+        info = meta['label']
+        label = np.frombuffer(bytearray(zlib.decompress(blob)), dtype=np.dtype(info['dtype'])).reshape(info['shape'])
+    return meta, label
+
+
+class SegReplayer(object):
+    """Serve recorded segmentation results in order, optionally looping."""
+
+    def __init__(self, path, loop=True):
+        self._path = os.path.expanduser(path)
+        self._loop = bool(loop)
+        self._file = None
+
+    def next(self):
+        """Return the next (meta, label_map) record, or None when the log is exhausted."""
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+            if self._file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"'{self._path}' is not a segmentation recording")
+        record = _read_record(self._file)
+        if record is None and self._loop:
+            self._file.seek(len(FILE_MAGIC))
+            record = _read_record(self._file)
+        return record
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
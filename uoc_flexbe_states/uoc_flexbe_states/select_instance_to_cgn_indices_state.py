@@ -2,48 +2,105 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
+import time
 from flexbe_core import EventState, Logger
-import subprocess
-import numpy as np
+
+from uoc_flexbe_states.output_retention import mark_cycle_failed
+
+DEFAULT_EXPORT_SCRIPT = ('/home/csrobot/graspnet_ws/src/contact_graspnet_ros2/contact_graspnet/test_data/'
+                         'ucn_to_cgn_scene.py')
 
 class SelectInstanceToSceneNameState(EventState):
     def __init__(self,
                  default_scene_name: str = 'scene_from_ucn',
-                 selection_mode: str = 'manual',  # 'largest' | 'manual' | 'largest_or_manual'
+                 selection_mode: str = 'manual',  # 'largest' | 'manual' | 'largest_or_manual' | 'queue'
                  allow_background: bool = False,
-                 manual_sentinel: int = -1):
+                 manual_sentinel: int = -1,
+                 mark_failed_cycles: bool = False,
+                 coarse_stride: int = 1,       # > 1: score instances on every N-th row/column (high-res cameras)
+                 refine_top: int = 3,          # coarse mode: exact stats for this many top candidates
+                 max_fallbacks: int = 0,       # re-entry on the same seg_cycle_id tries up to N next-best instances
+                                               # (needs export_args so that the scene follows the target)
+                 export_script: str = DEFAULT_EXPORT_SCRIPT,
+                 export_args: bool = False,    # pass --im_name/--seg_dir/--scene_name/--target_id to the script
+                                               # (set it only if the script accepts them)
+                 scene_per_target: bool = False,     # with export_args: scene_name is <default_scene_name>_<target id>
+                 manual_wait_timeout: float = 0.0,   # manual mode: wait up to N sec for the target instead of failing
+                 manual_target_topic: str = '',      # std_msgs/Int32 topic on which an operator UI sends the target
+                 speculative_exports: int = 0,       # while waiting, pre-export scenes of the top-K candidates
+                                                     # (with export_args; scene_name is then per target)
+                 speculative_workers: int = 2,       # exports running at the same time
+                 point_budget: int = 0,              # > 0: thin the exported scene to at most N points
+                 target_point_share: float = 0.7,    # share of the budget reserved for the target instance
+                 offload_workers: int = 0):          # > 0: rank instances in a worker-process pool
         super().__init__(
-            outcomes=['finished', 'failed'],
+            outcomes=['finished', 'next_candidate', 'failed'],
             input_keys=[
                 'seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list', 'im_name',
-                'manual_target_instance_id'   # NEW
+                'manual_target_instance_id',   # NEW
+                'pick_queue',                  # used by selection_mode='queue'
+                'seg_cycle_id',                # used by max_fallbacks
+                'instance_id_remap'            # from FilterMergeInstancesState: maps merged fragment ids
             ],
-            output_keys=['target_instance_id', 'scene_name', 'message']
+            output_keys=['target_instance_id', 'scene_name', 'grasp_index', 'message']
         )
         self._default_scene_name = str(default_scene_name)
         self._selection_mode = str(selection_mode).lower().strip()
         self._allow_background = bool(allow_background)
         self._manual_sentinel = int(manual_sentinel)
+        self._mark_failed_cycles = bool(mark_failed_cycles)
+        self._coarse_stride = max(int(coarse_stride), 1)
+        self._refine_top = int(refine_top)
+        self._max_fallbacks = max(int(max_fallbacks), 0)
+        self._export_script = str(export_script)
+        self._export_args = bool(export_args)
+        self._scene_per_target = bool(scene_per_target)
+        self._manual_wait = float(manual_wait_timeout)
+        self._manual_topic = str(manual_target_topic)
+        # Pre-exports need per-candidate scene names, i.e. export args; without them the feature is off
+        self._speculative = max(int(speculative_exports), 0) if self._export_args else 0
+        self._speculative_workers = int(speculative_workers)
+        self._point_budget = max(int(point_budget), 0)
+        self._target_point_share = float(target_point_share)
+        self._offload_workers = max(int(offload_workers), 0)
+        self._rank_future = None
+        self._rank_ctx = None
 
         self._had_error = False
         self._target_id = None
+        self._scene_name = self._default_scene_name
         self._msg = ""
 
-    def _pick_largest(self, instance_ids, instance_ids_2d):
-        best_id = None
-        best_area = -1
-        areas = {}
+        # Waiting for a manual target (speculative exports run meanwhile)
+        self._waiting = False
+        self._wait_start = None
+        self._pending = None
+        self._handoff = False
+        self._exporter = None
+        self._sub = None
+        self._topic_target = None   # (receive time, id)
+
+        # Ranked candidates of the current segmentation cycle, for fallback on re-entry
+        self._candidates = []
+        self._candidate_cycle = None
+        self._tried = 0
+        self._is_fallback = False
 
-        for inst_id in instance_ids:
-            mask = (instance_ids_2d == inst_id)
-            area = int(mask.sum())
-            areas[int(inst_id)] = area
-            Logger.loginfo(f"[SelectInstanceToSceneNameState] Instance {inst_id} has area {area}.")
-            if area > best_area:
-                best_area = area
-                best_id = inst_id
+    def _rank(self, instance_ids, instance_ids_2d):
+        """Instance ids ranked largest first, and {id: area}."""
+        from uoc_flexbe_states.label_map_utils import rank_instances
 
-        return (None, None, areas) if best_id is None else (int(best_id), int(best_area), areas)
+        ranked = rank_instances(instance_ids_2d, [int(i) for i in instance_ids],
+                                stride=self._coarse_stride, refine_top=self._refine_top)
+        return self._ranked_areas(ranked)
+
+    def _ranked_areas(self, ranked):
+        areas = {int(i): int(a) for i, a in zip(ranked['ids'], ranked['areas'])}
+        coarse = f" (stride {self._coarse_stride}, top {self._refine_top} refined)" if self._coarse_stride > 1 else ""
+        Logger.loginfo(f"[SelectInstanceToSceneNameState] Instance areas{coarse}: {areas}")
+
+        return [int(i) for i in ranked['ids']], areas
 
     def _get_manual_id(self, userdata):
         # Accept None, missing, sentinel => "not provided"
@@ -60,10 +117,226 @@ class SelectInstanceToSceneNameState(EventState):
             return None
         return v
 
+    @staticmethod
+    def _resolve_merged_id(userdata, chosen_id, valid_ids):
+        """Map an original (server) id that FilterMergeInstancesState merged into another instance to that instance."""
+        if int(chosen_id) in valid_ids:
+            return chosen_id
+        remap = getattr(userdata, 'instance_id_remap', None) or {}
+        for new_id, originals in remap.items():
+            if int(chosen_id) in [int(o) for o in originals]:
+                Logger.loginfo(f"[SelectInstanceToSceneNameState] Instance {chosen_id} was merged into "
+                               f"{new_id}, selecting {new_id}.")
+                return int(new_id)
+        return chosen_id
+
+    def _export_cmd(self, userdata, scene_name, target_id):
+        cmd = ["python3", self._export_script]
+        if self._export_args:
+            cmd += ["--im_name", str(getattr(userdata, 'im_name', '') or ''),
+                    "--seg_dir", str(getattr(userdata, 'result_dir', '') or ''),
+                    "--scene_name", scene_name,
+                    "--target_id", str(target_id)]
+        return cmd
+
+    def _target_scene_name(self, target_id):
+        # Speculative exports build one scene per candidate, so the chosen one keeps that name
+        if self._export_args and (self._scene_per_target or self._speculative):
+            return f"{self._default_scene_name}_{target_id}"
+        return self._default_scene_name
+
+    def _scene_path(self, scene_name):
+        # The export script writes <scene_name>.npy next to itself (contact_graspnet/test_data)
+        return os.path.join(os.path.dirname(self._export_script), scene_name + '.npy')
+
+    def _export_scene(self, userdata):
+        import subprocess
+
+        self._scene_name = self._target_scene_name(self._target_id)
+        subprocess.check_call(self._export_cmd(userdata, self._scene_name, self._target_id))
+
+        Logger.loginfo(f"[SelectInstanceToSceneNameState] Generated scene '{self._scene_name}' "
+                       f"using {os.path.basename(self._export_script)}")
+        self._apply_point_budget()
+
+    def _apply_point_budget(self):
+        """Thin the exported scene to point_budget points (target dense, context sparse)."""
+        if self._point_budget <= 0:
+            return
+        from uoc_flexbe_states.scene_budget import budget_scene_file
+
+        info = budget_scene_file(self._scene_path(self._scene_name), self._point_budget,
+                                 self._target_id, self._target_point_share)
+        Logger.loginfo(f"[SelectInstanceToSceneNameState] Point budget {info['budget']}: kept "
+                       f"{info['target_points']} target + {info['context_points']} context points "
+                       f"of {info['input_points']}.")
+
+    def _topic_cb(self, msg):
+        self._topic_target = (time.monotonic(), int(msg.data))
+
+    def _start_waiting(self, userdata, ranked, areas, instance_ids, cycle):
+        """Wait for the operator's target; meanwhile export the top-K candidates in the background."""
+        self._waiting = True
+        self._wait_start = time.monotonic()
+        self._pending = (ranked, areas, instance_ids, cycle)
+
+        if self._manual_topic and self._sub is None:
+            from std_msgs.msg import Int32
+            from flexbe_core.proxy import ProxySubscriberCached
+
+            self._sub = ProxySubscriberCached()
+            self._sub.subscribe(self._manual_topic, Int32, callback=self._topic_cb)
+
+        speculated = []
+        if self._speculative > 0:
+            from uoc_flexbe_states.speculative_export import SpeculativeSceneExporter
+
+            if self._exporter is None:
+                self._exporter = SpeculativeSceneExporter(self._speculative_workers)
+            for tid in [i for i in ranked if areas[i] > 0][:self._speculative]:
+                scene = self._target_scene_name(tid)
+                self._exporter.start(tid, self._export_cmd(userdata, scene, tid), scene,
+                                     self._scene_path(scene))
+                speculated.append(tid)
+
+        self._msg = (f"[SelectInstanceToSceneNameState] Waiting up to {self._manual_wait:.0f}s for "
+                     f"manual_target_instance_id{f' or {self._manual_topic}' if self._manual_topic else ''}"
+                     f"{f', pre-exporting {speculated}' if speculated else ''}.")
+        Logger.loginfo(self._msg)
+
+    def _discard_speculative(self):
+        if self._exporter is not None:
+            self._exporter.discard()
+
+    def _commit(self, userdata, chosen_id, ranked, areas, instance_ids, cycle):
+        """Validate the chosen target, remember the fallback candidates and export (or hand off) its scene."""
+        valid_ids = [int(x) for x in instance_ids]
+        chosen_id = self._resolve_merged_id(userdata, chosen_id, valid_ids)
+        if int(chosen_id) not in valid_ids:
+            self._msg = (f"[SelectInstanceToSceneNameState] Chosen instance id {chosen_id} "
+                         f"is not in instance_id_list {valid_ids}.")
+            Logger.logwarn(self._msg)
+            self._had_error = True
+            self._discard_speculative()
+            return
+
+        chosen_area = areas.get(int(chosen_id), -1)
+        self._target_id = int(chosen_id)
+        self._msg = (f"[SelectInstanceToSceneNameState] Selected instance {self._target_id} "
+                     f"(area={chosen_area}) → scene_name='{self._target_scene_name(self._target_id)}'")
+        Logger.loginfo(self._msg)
+
+        if cycle is not None:
+            # Chosen target first, then the remaining non-empty instances by area
+            self._candidates = [self._target_id] + [i for i in ranked
+                                                    if i != self._target_id and areas[i] > 0]
+            self._candidate_cycle = cycle
+            self._tried = 1
+
+        if self._exporter is not None:
+            from uoc_flexbe_states.speculative_export import SpeculativeSceneExporter
+
+            self._exporter.discard(keep=self._target_id)
+            if self._exporter.status(self._target_id) != SpeculativeSceneExporter.MISSING:
+                self._handoff = True   # execute() hands the pre-built scene off once it is ready
+                return
+
+        self._export_scene(userdata)
+
+    def _finish_handoff(self, userdata):
+        """Poll the speculative export of the chosen target; False while it is still running."""
+        from uoc_flexbe_states.speculative_export import SpeculativeSceneExporter
+
+        status = self._exporter.status(self._target_id)
+        if status in (SpeculativeSceneExporter.PENDING, SpeculativeSceneExporter.RUNNING):
+            return False
+        self._handoff = False
+        scene = self._exporter.take(self._target_id)
+        try:
+            if scene is None:
+                Logger.logwarn(f"[SelectInstanceToSceneNameState] Speculative export of instance "
+                               f"{self._target_id} failed, exporting again.")
+                self._export_scene(userdata)
+            else:
+                self._scene_name = scene
+                self._msg = (f"[SelectInstanceToSceneNameState] Selected instance {self._target_id} "
+                             f"→ pre-built scene_name='{scene}'")
+                Logger.loginfo(self._msg)
+                self._apply_point_budget()
+        except Exception as e:
+            self._msg = f"[SelectInstanceToSceneNameState] Exception: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
+        return True
+
+    def _next_fallback(self, userdata):
+        """On re-entry for the same segmentation cycle, move to the next ranked candidate."""
+        if self._max_fallbacks > 0 and not self._export_args:
+            # Without --target_id the script would export the same scene again
+            self._msg = ("[SelectInstanceToSceneNameState] Fallback candidates need export_args=True "
+                         "(an export script that accepts --target_id).")
+            Logger.logwarn(self._msg)
+            self._had_error = True
+            return
+        if self._tried > self._max_fallbacks or self._tried >= len(self._candidates):
+            self._msg = (f"[SelectInstanceToSceneNameState] No fallback left for this segmentation "
+                         f"(tried {self._candidates[:self._tried]}).")
+            Logger.logwarn(self._msg)
+            self._had_error = True
+            return
+
+        self._target_id = self._candidates[self._tried]
+        self._tried += 1
+        self._scene_name = self._target_scene_name(self._target_id)
+        self._is_fallback = True
+        self._msg = (f"[SelectInstanceToSceneNameState] Falling back to instance {self._target_id} "
+                     f"(candidate {self._tried}/{min(len(self._candidates), self._max_fallbacks + 1)}) "
+                     f"→ scene_name='{self._scene_name}'")
+        Logger.loginfo(self._msg)
+        try:
+            self._export_scene(userdata)
+        except Exception as e:
+            self._msg = f"[SelectInstanceToSceneNameState] Exception: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
+
     def on_enter(self, userdata):
+        # Deferred so that loading a behavior does not import NumPy
+        import numpy as np
+
         self._had_error = False
         self._target_id = None
         self._msg = ""
+        self._is_fallback = False
+        self._waiting = False
+        self._handoff = False
+        self._rank_future = None
+        self._discard_speculative()
+
+        cycle = getattr(userdata, 'seg_cycle_id', None)
+        if cycle is not None and cycle == self._candidate_cycle:
+            if self._selection_mode != 'queue':
+                # Re-entered without a new segmentation, i.e. grasping failed for the previous
+                # candidate: reuse the ranking (max_fallbacks=0 fails right away)
+                self._next_fallback(userdata)
+                return
+            queue = list(getattr(userdata, 'pick_queue', None) or [])
+            if queue and self._candidates and int(queue[0]) == self._candidates[0]:
+                # A successful pick pops the queue, so an unchanged head means the pick failed
+                self._msg = f"[SelectInstanceToSceneNameState] Pick of instance {self._candidates[0]} failed."
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                return
+        self._candidates = []
+        self._candidate_cycle = None
+
+        if self._scene_per_target and not self._export_args:
+            # Otherwise every target would silently get the same whole-scene export
+            self._msg = ("[SelectInstanceToSceneNameState] scene_per_target needs export_args=True "
+                         "(an export script that accepts --target_id).")
+            Logger.logerr(self._msg)
+            self._had_error = True
+            return
 
         try:
             seg = userdata.seg_json
@@ -80,71 +353,150 @@ class SelectInstanceToSceneNameState(EventState):
                 self._had_error = True
                 return
 
-            instance_ids_2d = np.array(userdata.instance_ids_2d, dtype=np.int32)
+            instance_ids_2d = userdata.instance_ids_2d
+            if not isinstance(instance_ids_2d, np.ndarray):   # keeps a shared np.memmap as is
+                instance_ids_2d = np.asarray(instance_ids_2d)
+            if instance_ids_2d.dtype.kind not in 'iu':
+                instance_ids_2d = instance_ids_2d.astype(np.int32)
 
-            best_id, best_area, areas = self._pick_largest(instance_ids, instance_ids_2d)
-            if best_id is None or best_area is None or best_area <= 0:
-                self._msg = "[SelectInstanceToSceneNameState] Failed to find a non-empty instance mask."
-                Logger.logwarn(self._msg)
-                self._had_error = True
-                return
+            if self._offload_workers > 0 and self._submit_rank(instance_ids, instance_ids_2d, cycle):
+                return   # execute() polls the ranking
+            ranked, areas = self._rank(instance_ids, instance_ids_2d)
+            self._decide(userdata, ranked, areas, instance_ids, cycle)
 
-            # NEW: manual id from userdata
-            manual_id = self._get_manual_id(userdata)
+        except Exception as e:
+            self._msg = f"[SelectInstanceToSceneNameState] Exception: {e}"
+            Logger.logerr(self._msg)
+            self._had_error = True
 
-            # Decide
-            if self._selection_mode == 'largest':
-                chosen_id = best_id
-            elif self._selection_mode == 'manual':
-                if manual_id is None:
-                    self._msg = ("[SelectInstanceToSceneNameState] selection_mode='manual' but "
-                                 "manual_target_instance_id was not provided.")
-                    Logger.logwarn(self._msg)
-                    self._had_error = True
-                    return
-                chosen_id = manual_id
-            else:  # 'largest_or_manual' default
-                chosen_id = manual_id if manual_id is not None else best_id
-
-            # Validate chosen_id
-            valid_ids = [int(x) for x in instance_ids]
-            if int(chosen_id) not in valid_ids:
-                self._msg = (f"[SelectInstanceToSceneNameState] Chosen instance id {chosen_id} "
-                             f"is not in instance_id_list {valid_ids}.")
-                Logger.logwarn(self._msg)
-                self._had_error = True
-                return
+    def _submit_rank(self, instance_ids, instance_ids_2d, cycle):
+        """Start ranking in the worker pool; False if offloading is not possible."""
+        try:
+            from uoc_flexbe_states.postprocess_pool import get_pool, rank_shared, share_array, shm_dir
 
-            chosen_area = areas.get(int(chosen_id), -1)
-            self._target_id = int(chosen_id)
-            self._msg = (f"[SelectInstanceToSceneNameState] Selected instance {self._target_id} "
-                         f"(area={chosen_area}) → scene_name='{self._default_scene_name}'")
-            Logger.loginfo(self._msg)
-
-            cmd = [
-                "python3",
-                "/home/csrobot/graspnet_ws/src/contact_graspnet_ros2/contact_graspnet/test_data/ucn_to_cgn_scene.py",
-                # IMPORTANT: if your script supports args, you should pass them here:
-                # "--im_name", userdata.im_name,
-                # "--seg_dir", userdata.result_dir,
-                # "--scene_name", self._default_scene_name,
-                # "--target_id", str(self._target_id),
-            ]
-            subprocess.check_call(cmd)
-
-            Logger.loginfo("[SelectInstanceToSceneNameState] Generated contact_graspnet/test_data/scene_from_ucn.npy using ucn_to_cgn_scene.py")
+            label, owned = share_array(instance_ids_2d, shm_dir())
+            self._rank_future = get_pool(self._offload_workers).submit(
+                rank_shared, label, [int(i) for i in instance_ids], self._coarse_stride, self._refine_top)
+            self._rank_ctx = (instance_ids, cycle, label['path'] if owned else None)
+            return True
+        except Exception as e:
+            Logger.logwarn(f"[SelectInstanceToSceneNameState] Offloading failed, ranking inline: {e}")
+            self._rank_future = None
+            return False
+
+    def _finish_rank(self, userdata):
+        """Poll the offloaded ranking; False while it is still running."""
+        from uoc_flexbe_states.postprocess_pool import release_files
 
+        if not self._rank_future.done():
+            return False
+        future, self._rank_future = self._rank_future, None
+        instance_ids, cycle, owned_path = self._rank_ctx
+        if owned_path:
+            release_files([owned_path])
+        try:
+            ranked, areas = self._ranked_areas(future.result())
+            self._decide(userdata, ranked, areas, instance_ids, cycle)
         except Exception as e:
             self._msg = f"[SelectInstanceToSceneNameState] Exception: {e}"
             Logger.logerr(self._msg)
             self._had_error = True
+        return True
+
+    def _decide(self, userdata, ranked, areas, instance_ids, cycle):
+        """Choose the target from the ranking according to selection_mode."""
+        best_id = ranked[0] if ranked else None
+        if best_id is None or areas[best_id] <= 0:
+            self._msg = "[SelectInstanceToSceneNameState] Failed to find a non-empty instance mask."
+            Logger.logwarn(self._msg)
+            self._had_error = True
+            return
+
+        # NEW: manual id from userdata
+        manual_id = self._get_manual_id(userdata)
+
+        # Decide
+        if self._selection_mode == 'largest':
+            chosen_id = best_id
+        elif self._selection_mode == 'queue':
+            queue = list(getattr(userdata, 'pick_queue', None) or [])
+            if not queue:
+                self._msg = "[SelectInstanceToSceneNameState] selection_mode='queue' but pick_queue is empty."
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                return
+            chosen_id = int(queue[0])
+        elif self._selection_mode == 'manual':
+            if manual_id is None and self._manual_wait > 0:
+                self._start_waiting(userdata, ranked, areas, instance_ids, cycle)
+                return
+            if manual_id is None:
+                self._msg = ("[SelectInstanceToSceneNameState] selection_mode='manual' but "
+                             "manual_target_instance_id was not provided.")
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                return
+            chosen_id = manual_id
+        else:  # 'largest_or_manual' default
+            chosen_id = manual_id if manual_id is not None else best_id
+
+        self._commit(userdata, chosen_id, ranked, areas, instance_ids, cycle)
 
     def execute(self, userdata):
+        if self._rank_future is not None and not self._finish_rank(userdata):
+            return None
+
+        if self._waiting and not self._had_error:
+            manual_id = self._get_manual_id(userdata)
+            if manual_id is None and self._topic_target is not None and self._topic_target[0] >= self._wait_start:
+                manual_id = self._topic_target[1]
+            if manual_id is None:
+                if time.monotonic() - self._wait_start <= self._manual_wait:
+                    return None
+                self._msg = (f"[SelectInstanceToSceneNameState] No manual target within "
+                             f"{self._manual_wait:.0f}s.")
+                Logger.logwarn(self._msg)
+                self._had_error = True
+                self._discard_speculative()
+            else:
+                self._waiting = False
+                try:
+                    self._commit(userdata, manual_id, *self._pending)
+                except Exception as e:
+                    self._msg = f"[SelectInstanceToSceneNameState] Exception: {e}"
+                    Logger.logerr(self._msg)
+                    self._had_error = True
+
+        if self._handoff and not self._had_error and not self._finish_handoff(userdata):
+            return None
+
         if self._had_error:
+            if self._mark_failed_cycles:
+                # Lets output retention keep this segmentation cycle for debugging
+                mark_cycle_failed(getattr(userdata, 'result_dir', ''))
             userdata.message = self._msg
             return 'failed'
 
         userdata.target_instance_id = self._target_id
-        userdata.scene_name = self._default_scene_name
+        userdata.scene_name = self._scene_name
+        userdata.grasp_index = 0  # new target => start from its first grasp pose
         userdata.message = self._msg
-        return 'finished'
\ No newline at end of file
+        return 'next_candidate' if self._is_fallback else 'finished'
+
+    def on_exit(self, userdata):
+        if self._rank_future is not None:
+            # Left before the offloaded ranking finished: drop it, remove its input file when done
+            future, self._rank_future = self._rank_future, None
+            owned_path = self._rank_ctx[2]
+            if owned_path:
+                from uoc_flexbe_states.postprocess_pool import release_files
+
+                if future.cancel():
+                    release_files([owned_path])
+                else:
+                    future.add_done_callback(lambda _: release_files([owned_path]))
+        if self._waiting or self._handoff:
+            # Left while waiting (e.g. preempted): stop the background exports
+            self._waiting = False
+            self._handoff = False
+            self._discard_speculative()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compare coarse-to-fine target ranking against exact mode on recorded scenes.
+
+Reads segmentation recordings (see seg_recording.py), ranks the instances of
+every recorded label map with rank_instances() in exact mode and for each
+requested stride, and prints per stride:
+
+  top1     share of scenes where the coarse mode picks the same largest instance
+  topk     mean share of the exact top-k found in the coarse top-k
+  area_err mean relative area error of the refined candidates (should be ~0)
+  est_err  mean relative area error of the unrefined (strided) estimates
+  exact_ms / coarse_ms  median ranking time, and the speed-up
+
+Usage:
+    uoc_selection_report rec1.uocseg [rec2.uocseg ...] --strides 2 4 8 --refine-top 3
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from uoc_flexbe_states.label_map_utils import rank_instances
+from uoc_flexbe_states.seg_recording import read_records
+
+
+def _timed_rank(label_map, ids, stride, refine_top, repeat):
+    best = None
+    ranked = None
+    for _ in range(max(repeat, 1)):
+        t0 = time.perf_counter()
+        ranked = rank_instances(label_map, ids, stride=stride, refine_top=refine_top)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return ranked, best
+
+
+def _nanmean(values):
+    values = [v for v in values if v == v]
+    return float(np.mean(values)) if values else float('nan')
+
+
+def compare_scene(label_map, strides, refine_top=3, top_k=3, background_id=0, repeat=1):
+    """Per-stride comparison rows for one label map (list of dicts)."""
+    ids = np.unique(label_map)
+    ids = ids[ids != background_id]
+    if ids.size == 0:
+        return []
+
+    exact, exact_sec = _timed_rank(label_map, ids, 1, 0, repeat)
+    exact_area = dict(zip(exact['ids'].tolist(), exact['areas'].tolist()))
+    exact_top = exact['ids'][:top_k].tolist()
+
+    rows = []
+    for stride in strides:
+        coarse, coarse_sec = _timed_rank(label_map, ids, stride, refine_top, repeat)
+        rel = np.array([abs(a - exact_area[i]) / max(exact_area[i], 1.0)
+                        for i, a in zip(coarse['ids'].tolist(), coarse['areas'].tolist())])
+        refined = coarse['refined']
+        rows.append({
+            'stride': stride,
+            'instances': int(ids.size),
+            'top1': int(coarse['ids'][0] == exact['ids'][0]),
+            'topk': len(set(exact_top) & set(coarse['ids'][:top_k].tolist())) / len(exact_top),
+            'area_err': float(rel[refined].mean()) if refined.any() else float('nan'),
+            'est_err': float(rel[~refined].mean()) if (~refined).any() else float('nan'),
+            'exact_ms': exact_sec * 1e3,
+            'coarse_ms': coarse_sec * 1e3,
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('recordings', nargs='+', help='Segmentation recording files')
+    parser.add_argument('--strides', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--refine-top', type=int, default=3)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--background-id', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Time each ranking N times and keep the best')
+    parser.add_argument('--csv', default='', help='Also write the per-scene rows to this CSV file')
+    args = parser.parse_args(argv)
+
+    rows = []
+    for path in args.recordings:
+        for n, (_, label_map) in enumerate(read_records(path)):
+            if label_map is None or label_map.ndim != 2:
+                continue
+            for row in compare_scene(label_map, args.strides, args.refine_top, args.top_k,
+                                     args.background_id, args.repeat):
+                row.update({'recording': path, 'record': n, 'shape': 'x'.join(map(str, label_map.shape))})
+                rows.append(row)
+
+    if not rows:
+        print('No recorded label maps found.', file=sys.stderr)
+        return 1
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(f"{'stride':>6} {'scenes':>6} {'top1':>6} {'top' + str(args.top_k):>6} {'area_err':>9} "
+          f"{'est_err':>8} {'exact_ms':>9} {'coarse_ms':>9} {'speedup':>8}")
+    for stride in args.strides:
+        sel = [r for r in rows if r['stride'] == stride]
+        exact_ms = float(np.median([r['exact_ms'] for r in sel]))
+        coarse_ms = float(np.median([r['coarse_ms'] for r in sel]))
+        print(f"{stride:>6} {len(sel):>6} {np.mean([r['top1'] for r in sel]):>6.1%} "
+              f"{np.mean([r['topk'] for r in sel]):>6.1%} "
+              f"{_nanmean([r['area_err'] for r in sel]):>9.2%} {_nanmean([r['est_err'] for r in sel]):>8.2%} "
+              f"{exact_ms:>9.2f} {coarse_ms:>9.2f} {exact_ms / max(coarse_ms, 1e-9):>7.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
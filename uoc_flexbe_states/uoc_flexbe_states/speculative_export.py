@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Background scene export for candidate targets.
+
+While SelectInstanceToSceneNameState waits for the operator's choice, the
+scene export script is already run for the top-K candidate instances, each
+into its own scene name.  Exports are subprocesses driven from a small
+thread pool, so several can run at once and any of them can be killed when
+the choice makes it unnecessary.
+"""
+
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpeculativeSceneExporter(object):
+    """
+    Run scene exports in the background and hand over / discard them by target id.
+
+    max_workers   Exports running at the same time
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    MISSING = 'missing'
+
+    def __init__(self, max_workers=2):
+        self._max_workers = max(int(max_workers), 1)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._jobs = {}   # target_id -> {'cmd', 'scene_name', 'scene_path', 'future', 'proc', 'state'}
+
+    def start(self, target_id, cmd, scene_name, scene_path=''):
+        """Queue one export; scene_path (optional) is deleted if the export is discarded."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='uoc_spec_export')
+        job = {'cmd': list(cmd), 'scene_name': scene_name, 'scene_path': scene_path,
+               'proc': None, 'state': self.PENDING, 'cancelled': False}
+        with self._lock:
+            self._jobs[int(target_id)] = job
+        job['future'] = self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        with self._lock:
+            if job['cancelled']:
+                return
+            try:
+                job['proc'] = subprocess.Popen(job['cmd'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError:
+                job['state'] = self.FAILED
+                return
+            job['state'] = self.RUNNING
+        code = job['proc'].wait()
+        with self._lock:
+            if job['state'] == self.RUNNING:
+                job['state'] = self.DONE if code == 0 else self.FAILED
+
+    def status(self, target_id):
+        """One of PENDING, RUNNING, DONE, FAILED or MISSING (never started / discarded)."""
+        job = self._jobs.get(int(target_id))
+        return job['state'] if job is not None else self.MISSING
+
+    def take(self, target_id):
+        """Hand over a finished export: forget it (its scene file is kept) and return its scene name."""
+        with self._lock:
+            job = self._jobs.pop(int(target_id), None)
+        return job['scene_name'] if job is not None and job['state'] == self.DONE else None
+
+    def discard(self, keep=None):
+        """Cancel or kill every export except `keep` and delete their scene files."""
+        with self._lock:
+            dropped = [(tid, job) for tid, job in self._jobs.items() if tid != keep]
+            for tid, job in dropped:
+                del self._jobs[tid]
+                job['cancelled'] = True
+                job['future'].cancel()
+                if job['state'] in (self.PENDING, self.RUNNING):
+                    job['state'] = self.FAILED
+                    if job['proc'] is not None and job['proc'].poll() is None:
+                        job['proc'].kill()
+        for _, job in dropped:
+            if job['scene_path']:
+                try:
+                    if job['proc'] is not None:
+                        job['proc'].wait(timeout=2.0)
+                    os.remove(job['scene_path'])
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+        return [tid for tid, _ in dropped]
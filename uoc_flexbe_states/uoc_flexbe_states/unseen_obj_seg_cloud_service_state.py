@@ -1,20 +1,23 @@
 #!/usr/bin/env python3
-import json, os
+import json, os, time
 from flexbe_core import EventState, Logger
 from flexbe_core.proxy import ProxyServiceCaller
-from unseen_obj_clst_ros2.srv import SegCloud
-from sensor_msgs.msg import PointCloud2, CameraInfo
 
 class UnseenObjSegCloudServiceState(EventState):
     """
     Calls 'run_segmentation_cloud' with a PointCloud2 (and optional CameraInfo).
     Outputs:
       seg_json (dict), result_dir (str), instance_ids (list), classes (list), bboxes (list), message (str)
+    record_path: append every response to this recording (see seg_recording), '' = off
+    replay_path: serve responses from this recording instead of calling the service, '' = off
     """
     def __init__(self,
                  cloud_service='run_segmentation_cloud',
                  service_timeout=5.0,
-                 default_im_name='from_cloud'):
+                 default_im_name='from_cloud',
+                 record_path='',
+                 replay_path='',
+                 replay_loop=True):
         super().__init__(
             outcomes=['finished', 'failed'],
             input_keys=['cloud_in', 'camera_info'], #, 'image_name'],
@@ -23,12 +26,56 @@ class UnseenObjSegCloudServiceState(EventState):
         self._timeout = float(service_timeout)
         self._default_im_name = default_im_name
         self._cloud_srv_name = cloud_service
-        self._srv = ProxyServiceCaller({ self._cloud_srv_name: SegCloud })
+        # Service type, message types and proxy are set up on first entry
+        self._srv = None
         self._res = None
         self._err = False
+        self._record_path = str(record_path)
+        self._replay_path = str(replay_path)
+        self._replay_loop = bool(replay_loop)
+        self._recorder = None
+        self._replayer = None
+        self._request_info = {}
+        self._call_sec = 0.0
 
     def on_enter(self, userdata):
         self._res, self._err = None, False
+
+        if self._replay_path:
+            from types import SimpleNamespace
+            try:
+                if self._replayer is None:
+                    from uoc_flexbe_states.seg_recording import shared_replayer
+                    self._replayer = shared_replayer(self._replay_path, loop=self._replay_loop)
+                record = self._replayer.next()
+            except Exception as e:
+                Logger.logerr(f"[SegCloudServiceState] Failed to read replay '{self._replay_path}': {e}")
+                record = None
+            if record is None:
+                Logger.logerr(f"[SegCloudServiceState] Replay '{self._replay_path}' exhausted.")
+                self._err = True
+                return
+            meta, label = record
+            seg_json = dict(meta.get('seg_json', {}))
+            if label is not None:
+                seg_json['instance_ids'] = label
+            response = meta.get('response', {})
+            # Already decoded: execute() takes seg_json as is instead of parsing json_result
+            self._res = SimpleNamespace(success=response.get('success', True),
+                                        log_output=response.get('log_output', ''),
+                                        json_result='', seg_json=seg_json)
+            return
+
+        try:
+            from unseen_obj_clst_ros2.srv import SegCloud
+            from sensor_msgs.msg import PointCloud2, CameraInfo
+
+            if self._srv is None:
+                self._srv = ProxyServiceCaller({ self._cloud_srv_name: SegCloud })
+        except Exception as e:
+            Logger.logerr(f"[SegCloudServiceState] Failed to create service proxy: {e}")
+            self._err = True
+            return
         if not isinstance(getattr(userdata, 'cloud_in', None), PointCloud2):
             Logger.logerr("[SegCloudServiceState] Missing or invalid 'cloud_in' PointCloud2.")
             self._err = True
@@ -51,23 +98,49 @@ class UnseenObjSegCloudServiceState(EventState):
             # except Exception:
             #     pass
 
+            cloud = userdata.cloud_in
+            self._request_info = {'service': self._cloud_srv_name,
+                                  'frame_id': cloud.header.frame_id,
+                                  'width': int(cloud.width), 'height': int(cloud.height),
+                                  'has_cam_info': isinstance(getattr(userdata, 'camera_info', None), CameraInfo)}
+            t0 = time.monotonic()
             self._res = self._srv.call(self._cloud_srv_name, req)
+            self._call_sec = time.monotonic() - t0
 
         except Exception as e:
             Logger.logerr(f"[SegCloudServiceState] Service call failed: {e}")
             self._err = True
 
+    def _record(self, seg_json):
+        if not self._record_path or self._replay_path:
+            return
+        try:
+            if self._recorder is None:
+                from uoc_flexbe_states.seg_recording import shared_recorder
+                self._recorder = shared_recorder(self._record_path)
+            response = {'success': bool(self._res.success), 'log_output': str(self._res.log_output or '')}
+            self._recorder.append('SegCloud', self._request_info, response, seg_json,
+                                  timing={'call_sec': self._call_sec})
+        except Exception as e:
+            Logger.logwarn(f"[SegCloudServiceState] Failed to record response: {e}")
+
     def execute(self, userdata):
         if self._err or self._res is None:
             return 'failed'
         if not self._res.success:
+            self._record({})
             userdata.message = self._res.log_output or "Segmentation failed."
             return 'failed'
 
         try:
-            seg_json = json.loads(self._res.json_result)
+            seg_json = getattr(self._res, 'seg_json', None)
+            if seg_json is None:
+                seg_json = json.loads(self._res.json_result)
+                self._record(seg_json)
             classes = seg_json.get('classes', [])
             instance_ids = seg_json.get('instance_ids', [])
+            if hasattr(instance_ids, 'tolist'):
+                instance_ids = instance_ids.tolist()   # replayed: binary array
             bboxes = seg_json.get('bboxes', [])
 
             result_dir = seg_json.get('result_dir', '')
@@ -3,7 +3,6 @@
 
 import os
 import json
-import numpy as np
 
 import time
 
@@ -11,9 +10,10 @@ import time
 from flexbe_core import EventState, Logger
 from flexbe_core.proxy import ProxyServiceCaller
 
-from unseen_obj_clst_ros2.srv import SegImage
+from uoc_flexbe_states.output_retention import mark_cycle_failed, shared_manager
 
-import subprocess, os
+# NumPy, subprocess and the SegImage service type are imported inside the
+# methods that need them, so loading a behavior does not pay for them up front.
 
 
 # Note: equivalent to running "ros2 service call /segmentation_rgbd unseen_obj_clst_ros2/srv/SegImage "{im_name: 'from_rgbd'}" in another terminal
@@ -33,10 +33,46 @@ class UnseenObjSegRGBDServiceState(EventState):
       3) Extracts the 2D instance-id map and builds per-instance binary masks.
       4) Publishes everything on userdata for downstream states (e.g. CGN).
 
+    Output retention (any retention_* parameter set): when a new cycle starts,
+    the previous cycle's result_dir is closed by an OutputRetentionManager
+    shared by all behavior runs in the process (so the last run's cycle is
+    closed too).  With keep_last / keep_failed_only it is moved into
+    <parent>/.uoc_history; size and age caps are enforced on the parent
+    directory by a background thread, oldest first.  Cycles in which this
+    state or the selection state failed are flagged as failed.
+
+    Record / replay: with record_path set, every response (request fields,
+    scalar response fields, segmentation JSON, binary label map, timings) is
+    appended to a compact log (see seg_recording).  With replay_path set, the
+    state serves responses from such a log in order instead of calling the
+    service or running the visualizer, so behaviors can be re-run offline at
+    full speed.  In replay, seg_json['instance_ids'] is the label map array.
+
+    Offloading (offload_workers > 0, service mode): JSON parsing, np.unique
+    and mask building run in a worker-process pool (see postprocess_pool)
+    while the visualizer runs; execute() polls for the result.  The label
+    map and masks come back as memory-mapped files in `shm_dir` rather than
+    pickled, and seg_json['instance_ids'] is then the label map array.  The
+    files are held per service, not per state instance, and removed when the
+    next cycle starts, even if that is in a later behavior run.
+
+    Streaming results, outlines and operator thumbnails are separate states:
+    UnseenObjSegStreamState, ExtractInstancePolygonsState and
+    PublishInstanceThumbnailsState.
+
     -- service_name     string    Service name (default: '/segmentation_rgbd')
     -- service_timeout  float     Timeout for service discovery (sec)
     -- default_im_name  string    Fallback im_name if userdata.im_name is empty
     -- background_id    int       Label to treat as background (default: 0)
+    -- retention_max_mb           float  Cap on total output size in MB, 0 = no cap (default: 0)
+    -- retention_max_age          float  Remove outputs older than this (sec), 0 = no cap (default: 0)
+    -- retention_keep_last        int    Keep the last N cycles in history, 0 = off (default: 0)
+    -- retention_keep_failed_only bool   Keep only failed cycles in history (default: False)
+    -- record_path      string    Append every response to this recording, '' = off (default: '')
+    -- replay_path      string    Serve responses from this recording instead of the service (default: '')
+    -- replay_loop      bool      Restart the recording when it is exhausted (default: True)
+    -- offload_workers  int       Worker processes for post-processing, 0 = on the onboard thread (default: 0)
+    -- shm_dir          string    Directory for shared arrays (default: '/dev/shm')
 
     ># im_name                      string   Optional override for im_name
     <# seg_json                     dict     Full segmentation JSON
@@ -44,6 +80,7 @@ class UnseenObjSegRGBDServiceState(EventState):
     <# instance_ids_2d              object   HxW np.ndarray of instance IDs (int32)
     <# instance_id_list             list     Sorted unique non-background IDs
     <# instance_masks               list     List of HxW np.uint8 masks (one per instance)
+    <# seg_cycle_id                 int      New, process-wide increasing id for every result
     <# message                      string   Log / debug text from server
 
     <= finished                     Segmentation succeeded and userdata filled
@@ -54,7 +91,16 @@ class UnseenObjSegRGBDServiceState(EventState):
                  service_name: str = '/segmentation_rgbd',
                  service_timeout: float = 10.0,
                  default_im_name: str = 'from_rgbd',
-                 background_id: int = 0):
+                 background_id: int = 0,
+                 retention_max_mb: float = 0.0,
+                 retention_max_age: float = 0.0,
+                 retention_keep_last: int = 0,
+                 retention_keep_failed_only: bool = False,
+                 record_path: str = '',
+                 replay_path: str = '',
+                 replay_loop: bool = True,
+                 offload_workers: int = 0,
+                 shm_dir: str = '/dev/shm'):
 
         super(UnseenObjSegRGBDServiceState, self).__init__(
             outcomes=['finished', 'failed'],
@@ -65,6 +111,7 @@ class UnseenObjSegRGBDServiceState(EventState):
                 'instance_ids_2d',
                 'instance_id_list',
                 'instance_masks',
+                'seg_cycle_id',
                 'message'
             ]
         )
@@ -74,21 +121,212 @@ class UnseenObjSegRGBDServiceState(EventState):
         self._default_im_name = str(default_im_name)
         self._background_id = int(background_id)
 
-        # Proxy to the SegImage service
-        self._srv = ProxyServiceCaller({self._service_name: SegImage})
+        # Proxy to the SegImage service (created on first entry)
+        self._srv = None
+        self._srv_type = None
 
         self._res = None
         self._had_error = False
         self._im_name_used = self._default_im_name
 
+        # Shared across behavior runs, so the previous run's cycle is still closed on the next entry
+        self._retention = shared_manager(max_total_mb=retention_max_mb,
+                                         max_age_sec=retention_max_age,
+                                         keep_last=retention_keep_last,
+                                         keep_failed_only=retention_keep_failed_only)
+
+        # Record / replay (created on first entry)
+        self._record_path = str(record_path)
+        self._replay_path = str(replay_path)
+        self._replay_loop = bool(replay_loop)
+        self._recorder = None
+        self._replayer = None
+        self._replayed = None
+        self._call_sec = 0.0
+
+        # Post-processing offload (pool shared per process, created on first use)
+        self._offload_workers = max(int(offload_workers), 0)
+        self._shm_dir = str(shm_dir)
+        self._future = None
+
+    def _ensure_proxy(self):
+        """Import the service type and create the proxy on first use."""
+        if self._srv is None:
+            from unseen_obj_clst_ros2.srv import SegImage
+            self._srv_type = SegImage
+            self._srv = ProxyServiceCaller({self._service_name: SegImage})
+
+    def _decode_instance_map(self, seg_json):
+        """Return (HxW int32 map, sorted non-background ids, per-instance masks) from seg_json."""
+        from uoc_flexbe_states.label_map_utils import decode_instance_map
+
+        return decode_instance_map(seg_json, self._background_id)
+
+    def _record(self, kind, request, seg_json, arr=None, decode_sec=0.0):
+        """Append the current response to the recording, if recording is enabled."""
+        if not self._record_path:
+            return
+        try:
+            if self._recorder is None:
+                from uoc_flexbe_states.seg_recording import shared_recorder
+                self._recorder = shared_recorder(self._record_path)
+            res = self._res
+            response = {
+                'success': bool(getattr(res, 'success', True)),
+                'log_output': str(getattr(res, 'log_output', '')),
+                'result_dir': str(getattr(res, 'result_dir', '')),
+            }
+            self._recorder.append(kind, request, response, seg_json, arr,
+                                  {'call_sec': self._call_sec, 'decode_sec': decode_sec})
+        except Exception as e:
+            Logger.logwarn(f"[{type(self).__name__}] Failed to record response: {e}")
+
+    def _execute_replay(self, userdata):
+        """Fill userdata from the recorded response read in on_enter."""
+        meta, label = self._replayed
+        response = meta.get('response', {})
+        if not response.get('success', True):
+            msg = response.get('log_output', '') or 'Segmentation failed.'
+            Logger.logerr(f"[{type(self).__name__}] Replayed segmentation failure: {msg}")
+            userdata.message = msg
+            return 'failed'
+
+        seg_json = dict(meta.get('seg_json', {}))
+        if label is None:
+            Logger.logerr(f"[{type(self).__name__}] Replayed record has no label map.")
+            userdata.message = "Segmentation JSON missing 'instance_ids'."
+            return 'failed'
+        seg_json['instance_ids'] = label
+
+        arr, unique_ids, masks = self._decode_instance_map(seg_json)
+        self._fill_userdata(userdata, seg_json, arr, unique_ids, masks,
+                            response.get('result_dir', ''), response.get('log_output', ''))
+        return 'finished'
+
+    def _submit_decode(self):
+        """Hand the response JSON to the worker pool; on any problem, decode inline instead."""
+        try:
+            from uoc_flexbe_states.postprocess_pool import decode_segmentation, get_pool, shm_dir
+
+            self._future = get_pool(self._offload_workers).submit(
+                decode_segmentation, self._res.json_result, self._background_id, shm_dir(self._shm_dir))
+        except Exception as e:
+            Logger.logwarn(f"[{type(self).__name__}] Offloading failed, decoding inline: {e}")
+            self._future = None
+
+    def _execute_offloaded(self, userdata, request):
+        """Fill userdata from a finished worker result (label map / masks mapped from shared files)."""
+        from uoc_flexbe_states.postprocess_pool import hold_files, map_array
+
+        future, self._future = self._future, None
+        try:
+            out = future.result()
+        except KeyError as e:
+            Logger.logerr(f"[{type(self).__name__}] 'instance_ids' missing in JSON.")
+            self._flag_failed(getattr(self._res, 'result_dir', ''))
+            self._record('SegImage', request, {})
+            userdata.message = str(e.args[0])
+            return 'failed'
+        except Exception as e:
+            Logger.logerr(f"[{type(self).__name__}] Failed to parse json_result: {e}")
+            self._flag_failed(getattr(self._res, 'result_dir', ''))
+            self._record('SegImage', request, {'json_result': str(getattr(self._res, 'json_result', ''))})
+            userdata.message = f"JSON parse error: {e}"
+            return 'failed'
+
+        # Held across behavior runs until this state's next cycle, so downstream states can share them
+        hold_files(self._shared_owner(), [info['path'] for info in (out['label'], out['masks']) if info])
+
+        arr = map_array(out['label'])
+        masks = list(map_array(out['masks'])) if out['masks'] else []
+        seg_json = out['seg_json']
+        seg_json['instance_ids'] = arr
+        self._record('SegImage', request, seg_json, arr, out['decode_sec'])
+
+        self._fill_userdata(userdata, seg_json, arr, out['unique_ids'], masks,
+                            getattr(self._res, 'result_dir', ''),
+                            getattr(self._res, 'log_output', ''))
+        return 'finished'
+
+    def _flag_failed(self, result_dir):
+        """Flag a failed cycle for retention and remember it so the next entry closes it."""
+        if self._retention.enabled and result_dir:
+            mark_cycle_failed(result_dir)
+            self._retention.open_cycle(result_dir)
+
+    def _fill_userdata(self, userdata, seg_json, arr, unique_ids, masks, fallback_result_dir, message):
+        """Write a decoded segmentation result to userdata."""
+        from uoc_flexbe_states.label_map_utils import next_seg_cycle_id
+
+        h, w = arr.shape
+        Logger.loginfo(
+            f"[{type(self).__name__}] Received instance_ids map of shape {h}x{w}."
+        )
+        Logger.loginfo(
+            f"[{type(self).__name__}] Unique instance IDs (no background): {unique_ids}"
+        )
+
+        # Result directory: prefer JSON's 'result_dir', fall back to response field
+        result_dir = seg_json.get('result_dir', '') or fallback_result_dir
+        if not result_dir:
+            # As absolute last resort, try base_output_dir + im_name
+            base_output_dir = seg_json.get('base_output_dir', '')
+            if base_output_dir:
+                result_dir = os.path.join(base_output_dir, f"segmentation_{self._im_name_used}")
+
+        self._retention.open_cycle(result_dir)
+
+        # Fill userdata
+        userdata.seg_json = seg_json
+        userdata.result_dir = result_dir
+        userdata.instance_ids_2d = arr
+        userdata.instance_id_list = unique_ids
+        userdata.instance_masks = masks
+        userdata.seg_cycle_id = next_seg_cycle_id()
+        userdata.message = message
+
     # ------------------------------------------------------------------
     # FlexBE lifecycle
     # ------------------------------------------------------------------
 
+    def _shared_owner(self):
+        return f"{type(self).__name__}:{self._service_name}"
+
     def on_enter(self, userdata):
         """Send the SegImage request when we enter the state."""
         self._res = None
+        self._future = None
         self._had_error = False
+        if self._offload_workers:
+            # A new cycle starts: the previous cycle's shared files (possibly from an earlier run) go away
+            from uoc_flexbe_states.postprocess_pool import release_held
+
+            release_held(self._shared_owner())
+        self._im_name_used = getattr(userdata, 'im_name', None) or self._default_im_name
+
+        if self._replay_path:
+            try:
+                if self._replayer is None:
+                    from uoc_flexbe_states.seg_recording import shared_replayer
+                    self._replayer = shared_replayer(self._replay_path, loop=self._replay_loop)
+                self._replayed = self._replayer.next()
+            except Exception as e:
+                Logger.logerr(f"[{type(self).__name__}] Failed to read replay '{self._replay_path}': {e}")
+                self._replayed = None
+            if self._replayed is None:
+                Logger.logerr(f"[{type(self).__name__}] Replay '{self._replay_path}' exhausted.")
+                self._had_error = True
+            return
+
+        # Close the previous cycle before the server starts writing the next one
+        self._retention.close_open_cycles()
+
+        try:
+            self._ensure_proxy()
+        except Exception as e:
+            Logger.logerr(f"[{type(self).__name__}] Failed to create service proxy: {e}")
+            self._had_error = True
+            return
 
         # # Check service availability
         # if not self._srv.is_available(self._service_name, timeout=self._timeout):
@@ -120,16 +358,23 @@ class UnseenObjSegRGBDServiceState(EventState):
         self._im_name_used = im_name
 
         # Build request
-        req = SegImage.Request()
+        req = self._srv_type.Request()
         # SegImage server expects `im_name` as the field
         req.im_name = im_name
 
         try:
+            import subprocess
+
+            t0 = time.monotonic()
             self._res = self._srv.call(self._service_name, req)
+            self._call_sec = time.monotonic() - t0
             Logger.loginfo(
                 f"[{type(self).__name__}] Called {self._service_name} "
                 f"with im_name='{im_name}'."
             )
+            if self._offload_workers > 0 and getattr(self._res, 'success', False):
+                # Decoding overlaps with the visualizer run below
+                self._submit_decode()
 
             cmd = [
                 "python3",
@@ -143,6 +388,11 @@ class UnseenObjSegRGBDServiceState(EventState):
 
     def execute(self, userdata):
         """Parse the response and fill userdata."""
+        if self._replay_path:
+            return 'failed' if self._had_error else self._execute_replay(userdata)
+
+        request = {'service': self._service_name, 'im_name': self._im_name_used}
+
         if self._had_error or self._res is None:
             return 'failed'
 
@@ -150,62 +400,58 @@ class UnseenObjSegRGBDServiceState(EventState):
         if not getattr(self._res, 'success', False):
             msg = getattr(self._res, 'log_output', 'Segmentation failed.')
             Logger.logerr(f"[{type(self).__name__}] Segmentation reported failure: {msg}")
+            self._flag_failed(getattr(self._res, 'result_dir', ''))
+            self._record('SegImage', request, {})
             userdata.message = msg
             return 'failed'
 
+        if self._future is not None:
+            if not self._future.done():
+                return None
+            return self._execute_offloaded(userdata, request)
+
         # Parse JSON
         try:
             json_str = self._res.json_result
             seg_json = json.loads(json_str)
         except Exception as e:
             Logger.logerr(f"[{type(self).__name__}] Failed to parse json_result: {e}")
+            self._flag_failed(getattr(self._res, 'result_dir', ''))
+            self._record('SegImage', request, {'json_result': str(getattr(self._res, 'json_result', ''))})
             userdata.message = f"JSON parse error: {e}"
             return 'failed'
 
-        # Extract instance-id map
-        instance_ids = seg_json.get('instance_ids', None)
-        if instance_ids is None:
+        # Extract instance-id map and masks
+        t0 = time.monotonic()
+        try:
+            arr, unique_ids, masks = self._decode_instance_map(seg_json)
+        except KeyError as e:
             Logger.logerr(f"[{type(self).__name__}] 'instance_ids' missing in JSON.")
-            userdata.message = "Segmentation JSON missing 'instance_ids'."
+            self._flag_failed(seg_json.get('result_dir', '') or getattr(self._res, 'result_dir', ''))
+            self._record('SegImage', request, seg_json)
+            userdata.message = str(e.args[0])
             return 'failed'
+        self._record('SegImage', request, seg_json, arr, time.monotonic() - t0)
 
-        # Convert to numpy array for easier mask construction
-        arr = np.asarray(instance_ids, dtype=np.int32)
-        h, w = arr.shape
-        Logger.loginfo(
-            f"[{type(self).__name__}] Received instance_ids map of shape {h}x{w}."
-        )
-
-        # Unique instance labels (excluding background)
-        unique_ids = sorted(int(v) for v in np.unique(arr) if v != self._background_id)
-        Logger.loginfo(
-            f"[{type(self).__name__}] Unique instance IDs (no background): {unique_ids}"
-        )
-
-        # Build binary masks (HxW np.uint8, 1 where pixel == instance_id)
-        masks = []
-        for inst_id in unique_ids:
-            mask = (arr == inst_id).astype(np.uint8)
-            masks.append(mask)
-
-        # Result directory: prefer JSON's 'result_dir', fall back to response field
-        result_dir = seg_json.get('result_dir', '') or getattr(self._res, 'result_dir', '')
-        if not result_dir:
-            # As absolute last resort, try base_output_dir + im_name
-            base_output_dir = seg_json.get('base_output_dir', '')
-            if base_output_dir:
-                result_dir = os.path.join(base_output_dir, f"segmentation_{self._im_name_used}")
-
-        # Fill userdata
-        userdata.seg_json = seg_json
-        userdata.result_dir = result_dir
-        userdata.instance_ids_2d = arr
-        userdata.instance_id_list = unique_ids
-        userdata.instance_masks = masks
-        userdata.message = getattr(self._res, 'log_output', '')
-
+        self._fill_userdata(userdata, seg_json, arr, unique_ids, masks,
+                            getattr(self._res, 'result_dir', ''),
+                            getattr(self._res, 'log_output', ''))
         return 'finished'
 
     def on_exit(self, userdata):
-        """No special cleanup needed."""
-        pass
+        """Drop a pending offloaded decode (e.g. on preemption) and its shared files."""
+        if self._future is not None:
+            future, self._future = self._future, None
+            if not future.cancel():
+                future.add_done_callback(_release_result)
+
+
+def _release_result(future):
+    """Remove the shared files of an abandoned worker result."""
+    from uoc_flexbe_states.postprocess_pool import release_files
+
+    try:
+        out = future.result()
+    except Exception:
+        return
+    release_files([info['path'] for info in (out['label'], out['masks']) if info])
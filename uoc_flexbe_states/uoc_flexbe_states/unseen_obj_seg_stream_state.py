@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from functools import partial
+
+from flexbe_core import EventState, Logger
+
+# topic -> {'latest': (receive time, seg_json, arr, unique_ids, masks) or None,
+#           'used': receive time of the last frame handed out, 'background_id': int}
+# Shared by all instances, since FlexBE builds new states on every behavior run.
+_STREAMS = {}
+
+
+def _stream_cb(topic, msg):
+    """Decode a streamed result off the onboard thread and keep only the latest."""
+    from uoc_flexbe_states.label_map_utils import decode_instance_map
+
+    stamp = time.monotonic()
+    stream = _STREAMS[topic]
+    try:
+        seg_json = json.loads(msg.data)
+        arr, unique_ids, masks = decode_instance_map(seg_json, stream['background_id'])
+    except Exception as e:
+        Logger.logwarn(f"[UnseenObjSegStreamState] Dropping undecodable message on '{topic}': {e}")
+        return
+    # Single item assignment: the reader sees either the old or the new tuple
+    stream['latest'] = (stamp, seg_json, arr, unique_ids, masks)
+
+
+class UnseenObjSegStreamState(EventState):
+    """
+    Take the latest segmentation the RGB-D server streams, instead of calling its service.
+
+    The server publishes the same segmentation JSON as /segmentation_rgbd
+    returns (std_msgs/String) after every frame.  The subscription callback
+    decodes each message in the background and keeps only the most recent
+    result (queue depth 1).  On entry the state returns that result right
+    away if it is newer than the frame used last (by any behavior run) and at
+    most `max_staleness` seconds old; otherwise it waits for the next one up
+    to `timeout`.  The outputs match UnseenObjSegRGBDServiceState's.
+
+    -- stream_topic     string    Segmentation JSON topic (default: '/segmentation_rgbd/stream')
+    -- max_staleness    float     Max age (sec) of a streamed result to accept (default: 0.5)
+    -- timeout          float     Max wait for a fresh result (sec) (default: 10.0)
+    -- background_id    int       Label to treat as background (default: 0)
+    -- record_path      string    Append every result to this recording, '' = off (default: '')
+
+    <# seg_json                     dict     Full segmentation JSON
+    <# result_dir                   string   Output directory (from the JSON)
+    <# instance_ids_2d              object   HxW np.ndarray of instance IDs (int32)
+    <# instance_id_list             list     Sorted unique non-background IDs
+    <# instance_masks               list     List of HxW np.uint8 masks (one per instance)
+    <# seg_cycle_id                 int      New, process-wide increasing id for every result
+    <# message                      string   Summary
+
+    <= finished                     Fresh segmentation received and userdata filled
+    <= failed                       No fresh segmentation within the timeout
+    """
+
+    def __init__(self,
+                 stream_topic: str = '/segmentation_rgbd/stream',
+                 max_staleness: float = 0.5,
+                 timeout: float = 10.0,
+                 background_id: int = 0,
+                 record_path: str = ''):
+        super().__init__(
+            outcomes=['finished', 'failed'],
+            output_keys=['seg_json', 'result_dir', 'instance_ids_2d', 'instance_id_list', 'instance_masks',
+                         'seg_cycle_id', 'message']
+        )
+        self._stream_topic = str(stream_topic)
+        self._max_staleness = float(max_staleness)
+        self._timeout = float(timeout)
+        self._background_id = int(background_id)
+        self._record_path = str(record_path)
+
+        self._had_error = False
+        self._enter_time = None
+
+    def _ensure_subscription(self):
+        """Subscribe to the stream once per process."""
+        if self._stream_topic in _STREAMS:
+            return
+        from rclpy.qos import QoSProfile
+        from std_msgs.msg import String
+        from flexbe_core.proxy import ProxySubscriberCached
+
+        _STREAMS[self._stream_topic] = {'latest': None, 'used': None, 'background_id': self._background_id}
+        try:
+            ProxySubscriberCached().subscribe(self._stream_topic, String,
+                                              callback=partial(_stream_cb, self._stream_topic),
+                                              qos=QoSProfile(depth=1))
+        except Exception:
+            del _STREAMS[self._stream_topic]
+            raise
+
+    def _record(self, seg_json, arr, age):
+        if not self._record_path:
+            return
+        try:
+            from uoc_flexbe_states.seg_recording import shared_recorder
+
+            shared_recorder(self._record_path).append(
+                'stream', {'stream_topic': self._stream_topic, 'age_sec': age},
+                {'success': True, 'log_output': '', 'result_dir': str(seg_json.get('result_dir', ''))},
+                seg_json, arr, {'call_sec': 0.0, 'decode_sec': 0.0})
+        except Exception as e:
+            Logger.logwarn(f"[UnseenObjSegStreamState] Failed to record result: {e}")
+
+    def on_enter(self, userdata):
+        self._had_error = False
+        self._enter_time = time.monotonic()
+        try:
+            self._ensure_subscription()
+        except Exception as e:
+            Logger.logerr(f"[UnseenObjSegStreamState] Failed to subscribe to '{self._stream_topic}': {e}")
+            self._had_error = True
+
+    def execute(self, userdata):
+        if self._had_error:
+            userdata.message = f"Not subscribed to '{self._stream_topic}'."
+            return 'failed'
+
+        now = time.monotonic()
+        stream = _STREAMS[self._stream_topic]
+        latest = stream['latest']
+        if latest is not None and (stream['used'] is None or latest[0] > stream['used']):
+            age = now - latest[0]
+            if age <= self._max_staleness:
+                from uoc_flexbe_states.label_map_utils import next_seg_cycle_id
+
+                stamp, seg_json, arr, unique_ids, masks = latest
+                stream['used'] = stamp   # never plan twice on the same frame
+                self._record(seg_json, arr, age)
+                userdata.seg_json = seg_json
+                userdata.result_dir = seg_json.get('result_dir', '')
+                userdata.instance_ids_2d = arr
+                userdata.instance_id_list = unique_ids
+                userdata.instance_masks = masks
+                userdata.seg_cycle_id = next_seg_cycle_id()
+                userdata.message = (f"Streamed segmentation from '{self._stream_topic}' "
+                                    f"({age * 1000.0:.0f} ms old, {len(unique_ids)} instances).")
+                Logger.loginfo(f"[UnseenObjSegStreamState] {userdata.message}")
+                return 'finished'
+
+        if now - self._enter_time > self._timeout:
+            userdata.message = (f"No new segmentation younger than {self._max_staleness:.2f}s on "
+                                f"'{self._stream_topic}' within {self._timeout:.1f}s.")
+            Logger.logerr(f"[UnseenObjSegStreamState] {userdata.message}")
+            return 'failed'
+
+        return None